@@ -1,7 +1,10 @@
 from django.contrib import admin
 from decimal import Decimal
 from django.utils.html import format_html
-from .models import Client, Instrument, MarginLoan, Portfolio, AuditLog
+from .models import Client, Instrument, MarginLoan, Portfolio, AuditLog, OutboxEvent
+from .outbox import OutboxRelay
+from .services.margin_rates import margin_rates
+from risk.services.recompute import recompute_scheduler
 from risk.services.risk_engine import RiskEngine
 
 
@@ -25,10 +28,15 @@ class ClientAdmin(admin.ModelAdmin):
     search_fields = ["name", "email"]
     ordering = ["-created_at"]
 
-    # ✅ Optimize DB
+    # ✅ Optimize DB: risk columns come from one aggregate query
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related("risk_profile")
+        return qs.select_related("risk_profile").with_risk_metrics()
+
+    # list_editable saves every row: recalculate each profile once at the end
+    def changelist_view(self, request, extra_context=None):
+        with recompute_scheduler.batch():
+            return super().changelist_view(request, extra_context)
 
     # ---------------- SAFE ACCESS ----------------
 
@@ -42,7 +50,9 @@ class ClientAdmin(admin.ModelAdmin):
 
     def risk_used_exposure(self, obj):
         try:
-            used = RiskEngine.calculate_current_exposure(obj.id)
+            used = getattr(obj, "used_exposure", None)
+            if used is None:
+                used = RiskEngine.calculate_current_exposure(obj.id)
             return f"{used:.2f}"
         except Exception:
             return "0.00"
@@ -51,7 +61,9 @@ class ClientAdmin(admin.ModelAdmin):
 
     def risk_utilization_pct(self, obj):
         try:
-            utilization = RiskEngine.margin_utilization(obj.id)
+            utilization = getattr(obj, "edr_percent", None)
+            if utilization is None:
+                utilization = RiskEngine.margin_utilization(obj.id)
 
             # Color-coded EDR
             if utilization < 50:
@@ -138,7 +150,7 @@ class PortfolioAdmin(admin.ModelAdmin):
     position_value.short_description = "Position Value"
 
     def margin_exposure(self, obj):
-        rate = obj.instrument.effective_margin_rate()
+        rate = margin_rates.effective_rate(obj.instrument_id)
         return obj.quantity * obj.avg_price * rate
     margin_exposure.short_description = "Margin Exposure"
 
@@ -156,3 +168,28 @@ class AuditLogAdmin(admin.ModelAdmin):
 
     list_filter = ["event_type", "created_at"]
     readonly_fields = ["created_at"]
+
+
+# -----------------------------
+# OUTBOX ADMIN (RELAY BACKLOG)
+# -----------------------------
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "topic",
+        "key",
+        "created_at",
+        "sent_at",
+        "attempts",
+        "parked_at",
+    ]
+
+    list_filter = ["topic", "sent_at", "parked_at"]
+    readonly_fields = ["created_at", "sent_at", "attempts", "last_error", "parked_at"]
+    actions = ["requeue_parked"]
+
+    @admin.action(description="Requeue parked events")
+    def requeue_parked(self, request, queryset):
+        requeued = OutboxRelay.requeue(list(queryset.values_list("id", flat=True)))
+        self.message_user(request, f"Requeued {requeued} parked event(s)")
@@ -0,0 +1,221 @@
+# core/async_consumers.py
+"""
+asyncio consumer runtime: several topics in one process.
+
+Each topic gets its own KafkaConsumer, driven from a dedicated
+single-thread executor (kafka-python is blocking and not thread-safe).
+A poll batch is split by message key; keys run concurrently, each key's
+events run in order. Sync handlers (handle_portfolio_event /
+handle_margin_event) are offloaded with sync_to_async, coroutine
+handlers are awaited directly.
+
+Sync handlers (every CONSUMERS handler) run through core.retry like
+start_consumer: duplicates are dropped by core.dedupe, a failing event
+waits in the RetryScheduler (due retries join the next batch on their
+key) and is dead-lettered after KAFKA_RETRY_MAX_ATTEMPTS; commits never
+pass an offset still waiting for a retry. Coroutine handlers get neither
+retry/DLQ nor dedupe: they own their error policy, and an exception they
+raise is logged and committed past.
+
+Offsets are committed after the whole batch is handled. SIGTERM/SIGINT
+stop polling, let the in-flight batch finish, commit and close.
+"""
+import asyncio
+import logging
+import signal
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from core import metrics
+from core.consumers import create_kafka_consumer
+from core.retry import PendingRetry, RetryScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def _as_coroutine(handler):
+    if asyncio.iscoroutinefunction(handler):
+        return handler
+
+    def run(event):
+        try:
+            return handler(event)
+        finally:
+            close_old_connections()
+
+    # thread_sensitive=False: handlers for different keys overlap on
+    # separate threads (each with its own DB connection)
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def _ordering_key(key, tp):
+    """
+    Events with the same key run in order; keyless ones per partition
+    """
+    if isinstance(key, bytes):
+        key = key.decode("utf-8", errors="replace")
+    return key if key is not None else ((tp[0], tp[1]), None)
+
+
+class TopicRunner:
+
+    def __init__(
+        self,
+        topic: str,
+        group_id: str,
+        handler,
+        consumer_factory=None,
+        concurrency: int | None = None,
+        dedupe=None,
+        retry=None,
+    ):
+        self.topic = topic
+        self.group_id = group_id
+        self.handler = _as_coroutine(handler)
+        self.consumer_factory = consumer_factory or (
+            lambda: create_kafka_consumer(topic, group_id, enable_auto_commit=False)
+        )
+        self.limit = asyncio.Semaphore(
+            concurrency or getattr(settings, "KAFKA_ASYNC_CONCURRENCY", 32)
+        )
+        # All KafkaConsumer calls happen on this one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"kafka-{topic}")
+        self.consumer = None
+        self.stats = metrics.consumer_metrics(topic)
+
+        self.dedupe = None
+        self.retry = None
+        if not asyncio.iscoroutinefunction(handler):
+            self.dedupe = dedupe
+            self.retry = retry if retry is not None else RetryScheduler(topic, handler, dedupe=dedupe)
+            self._attempt = _as_coroutine(self.retry.attempt)
+            self._run_retry = _as_coroutine(self.retry.run)
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+    async def _handle_key(self, messages):
+        async with self.limit:
+            for message in messages:
+                if self.retry is not None:
+                    # Failures are scheduled for a retry, never raised
+                    with self.stats.time_handler():
+                        if isinstance(message, PendingRetry):
+                            await self._run_retry(message)
+                        else:
+                            await self._attempt(message)
+                    continue
+
+                try:
+                    with self.stats.time_handler():
+                        await self.handler(message.value)
+                except Exception as e:
+                    logger.error(
+                        f"❌ Handler failed for {message.topic}[{message.partition}]@{message.offset}: {e}",
+                        exc_info=True,
+                    )
+
+    async def handle_batch(self, raw_messages, retries=()) -> int:
+        by_key = OrderedDict()
+        count = 0
+
+        # Due retries go first on their key (they are the older events)
+        for item in retries:
+            by_key.setdefault(_ordering_key(item.key, item.tp), []).append(item)
+
+        for tp, messages in raw_messages.items():
+            count += len(messages)
+            if self.dedupe is not None:
+                # One lookup per partition batch; skipped ones are committed
+                messages, _ = await sync_to_async(self.dedupe.filter_messages, thread_sensitive=False)(messages)
+
+            for message in messages:
+                if not message.value:
+                    continue
+                by_key.setdefault(_ordering_key(message.key, tp), []).append(message)
+
+        if count:
+            self.stats.observe_batch(count)
+        await asyncio.gather(*(self._handle_key(msgs) for msgs in by_key.values()))
+        return count
+
+    async def _commit(self):
+        with self.stats.time_commit():
+            if self.retry is not None:
+                # Held back below offsets still waiting for a retry
+                await self._call(self.retry.commit, self.consumer)
+            else:
+                await self._call(self.consumer.commit)
+
+    async def run(self, stopping: asyncio.Event):
+        self.consumer = await self._call(self.consumer_factory)
+        max_records = getattr(settings, "KAFKA_CONSUMER_MAX_RECORDS", 500)
+        logger.info(f"📥 Async consumer ready: topic={self.topic} group={self.group_id}")
+
+        try:
+            while not stopping.is_set():
+                retries = []
+                timeout_ms = 1000
+                if self.retry is not None:
+                    retries = await sync_to_async(self.retry.due, thread_sensitive=False)()
+                    # Wake up for the next due retry
+                    timeout_ms = int(self.retry.next_due_in() * 1000)
+
+                raw_messages = await self._call(
+                    self.consumer.poll, timeout_ms=timeout_ms, max_records=max_records
+                )
+                if not raw_messages and not retries:
+                    continue
+
+                count = await self.handle_batch(raw_messages, retries)
+                await self._commit()
+                await self._call(self.stats.update_lag, self.consumer)
+                logger.debug(f"✅ {self.topic}: committed batch of {count}")
+        finally:
+            await self._call(self.consumer.close)
+            self.executor.shutdown(wait=True)
+            logger.info(f"✅ Async consumer for {self.topic} closed")
+
+
+class AsyncConsumerRuntime:
+    """
+    Runs one TopicRunner per topic until SIGTERM/SIGINT
+    """
+
+    def __init__(self, runners):
+        self.runners = list(runners)
+        self.stopping = None
+        self.loop = None
+
+    def stop(self):
+        logger.info("🛑 Async consumers draining")
+        self.stopping.set()
+
+    def request_stop(self):
+        """
+        Thread-safe stop (e.g. from a handler thread or another process hook)
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stop)
+
+    async def run(self):
+        self.stopping = asyncio.Event()
+        metrics.start()
+
+        self.loop = loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not the main thread / platform without signal support
+                pass
+
+        await asyncio.gather(*(runner.run(self.stopping) for runner in self.runners))
+
+    def start(self):
+        asyncio.run(self.run())
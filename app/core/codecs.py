@@ -0,0 +1,356 @@
+# core/codecs.py
+"""
+Event envelope + wire codecs.
+
+Every event is wrapped in an Envelope (id, type, version, key,
+timestamp, payload) and encoded with the codec named by KAFKA_EVENT_CODEC:
+
+"json"   → the envelope as a JSON object (default, human-readable;
+           orjson when installed). Decimal fields are listed next to the
+           payload and restored as Decimal on decode.
+"binary" → magic byte + frame version, then the envelope as one msgpack
+           array (uuid ids as 16 raw bytes). Top-level Decimal fields
+           travel as text with their positions listed in the frame and
+           are restored on decode; nested ones use a msgpack ext type.
+
+Producers no longer stringify amounts by hand. decode() sniffs the first
+byte, so consumers read both codecs, binary frames v1/v2 (struct header
++ JSON payload) and the legacy bare-JSON events still on the topics.
+"""
+import json
+import struct
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+
+import msgpack
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is used instead
+    orjson = None
+
+
+EVENT_VERSION = 1
+
+
+class CodecError(ValueError):
+    pass
+
+
+@dataclass
+class Envelope:
+    type: str
+    payload: dict = field(default_factory=dict)
+    key: str | None = None
+    version: int = EVENT_VERSION
+    timestamp: int = 0          # ms since epoch
+    id: str | None = None       # stable across retries/redeliveries (dedupe key)
+
+    @classmethod
+    def from_event(
+        cls,
+        event: dict,
+        key=None,
+        version: int = EVENT_VERSION,
+        timestamp: int | None = None,
+        event_id: str | None = None,
+    ):
+        payload = dict(event)
+        # A re-published event keeps its id
+        event_id = payload.pop("event_id", None) or event_id or uuid.uuid4().hex
+        return cls(
+            type=payload.pop("type", "") or "",
+            payload=payload,
+            key=str(key) if key is not None else None,
+            version=version,
+            timestamp=timestamp if timestamp is not None else int(time.time() * 1000),
+            id=event_id,
+        )
+
+    @property
+    def event(self) -> dict:
+        """
+        Flat event dict (the shape handlers consume)
+        """
+        event = {"type": self.type, **self.payload}
+        if self.id:
+            event["event_id"] = self.id
+        return event
+
+
+# ------------------------------
+# HELPERS
+# ------------------------------
+def _default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _split_decimals(payload: dict):
+    """
+    Top-level Decimal fields → (payload with them as str, [field names])
+    """
+    decimals = [k for k, v in payload.items() if type(v) is Decimal]
+    if not decimals:
+        return payload, decimals
+
+    payload = dict(payload)
+    for k in decimals:
+        payload[k] = str(payload[k])
+    return payload, decimals
+
+
+def _restore_decimals(payload: dict, decimals) -> dict:
+    for k in decimals:
+        if k in payload:
+            payload[k] = Decimal(payload[k])
+    return payload
+
+
+if orjson is not None:
+    def _dumps(value) -> bytes:
+        return orjson.dumps(value, default=_default)
+
+    _loads = orjson.loads
+else:
+    def _dumps(value) -> bytes:
+        return json.dumps(value, default=_default, separators=(",", ":")).encode("utf-8")
+
+    def _loads(data):
+        return json.loads(data)
+
+
+# ------------------------------
+# CODECS
+# ------------------------------
+class JsonCodec:
+    name = "json"
+
+    def encode(self, envelope: Envelope) -> bytes:
+        payload, decimals = _split_decimals(envelope.payload)
+        body = {
+            "id": envelope.id,
+            "type": envelope.type,
+            "version": envelope.version,
+            "key": envelope.key,
+            "ts": envelope.timestamp,
+            "payload": payload,
+        }
+        if decimals:
+            body["decimals"] = decimals
+        return _dumps(body)
+
+    def decode(self, data: bytes) -> Envelope:
+        body = _loads(data)
+        if not isinstance(body, dict):
+            raise CodecError(f"Expected a JSON object, got {type(body).__name__}")
+
+        if "payload" not in body or "version" not in body:
+            # Legacy bare event (pre-envelope producers): no id is minted,
+            # so consumers fall back to the message position for dedupe
+            payload = dict(body)
+            event_type = payload.pop("type", "") or ""
+            return Envelope(type=event_type, payload=payload, id=payload.pop("event_id", None))
+
+        return Envelope(
+            type=body.get("type") or "",
+            payload=_restore_decimals(body["payload"], body.get("decimals", ())),
+            key=body.get("key"),
+            version=body["version"],
+            timestamp=body.get("ts", 0),
+            id=body.get("id"),
+        )
+
+
+_EXT_DECIMAL = 1    # nested Decimal as its exact ASCII text
+
+
+def _pack_default(value):
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(_EXT_DECIMAL, str(value).encode("ascii"))
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Type is not msgpack serializable: {type(value).__name__}")
+
+
+def _pack_id(event_id):
+    # uuid4().hex ids (the default) → 16 bytes
+    if event_id and len(event_id) == 32 and event_id == event_id.lower():
+        try:
+            return bytes.fromhex(event_id)
+        except ValueError:
+            pass
+    return event_id
+
+
+def _unpack_ext(code: int, data: bytes):
+    if code == _EXT_DECIMAL:
+        return Decimal(data.decode("ascii"))
+    return msgpack.ExtType(code, data)
+
+
+class BinaryCodec:
+    """
+    magic | frame version | msgpack [event version, ts, id, type, key, payload, decimal positions]
+
+    Frames v1/v2 (struct header + JSON payload) are still decoded:
+
+    v2: magic | frame | event version | ts | len(id) | len(type) | len(key) | len(decimals)
+        then id, type, key, comma-separated decimal fields and the JSON payload
+    v1: the same without the id
+    """
+
+    name = "binary"
+    MAGIC = b"\xe7"         # never the first byte of a JSON document
+    FRAME_VERSION = 3
+    HEADER_V2 = struct.Struct(">cBHqBHHH")
+    HEADER_V1 = struct.Struct(">cBHqHHH")
+
+    def __init__(self):
+        self._prefix = self.MAGIC + bytes((self.FRAME_VERSION,))
+        self._local = threading.local()     # one reusable Packer per thread
+
+    @property
+    def _packer(self) -> msgpack.Packer:
+        packer = getattr(self._local, "packer", None)
+        if packer is None:
+            packer = self._local.packer = msgpack.Packer(default=_pack_default)
+        return packer
+
+    def encode(self, envelope: Envelope) -> bytes:
+        # Top-level values converted up front: no per-value callback
+        payload, decimals = envelope.payload, []
+        for i, (name, value) in enumerate(envelope.payload.items()):
+            if type(value) is Decimal:
+                decimals.append(i)
+            elif not isinstance(value, (datetime, date)):
+                continue
+            if payload is envelope.payload:
+                payload = dict(payload)
+            payload[name] = str(value) if type(value) is Decimal else value.isoformat()
+
+        return self._prefix + self._packer.pack(
+            (
+                envelope.version,
+                envelope.timestamp,
+                _pack_id(envelope.id),
+                envelope.type,
+                envelope.key,
+                payload,
+                decimals,
+            )
+        )
+
+    def decode(self, data: bytes) -> Envelope:
+        frame = data[1] if len(data) > 1 else None
+
+        if frame == self.FRAME_VERSION:
+            try:
+                version, timestamp, event_id, type_, key, payload, decimals = msgpack.unpackb(
+                    memoryview(data)[2:], ext_hook=_unpack_ext, strict_map_key=False
+                )
+            except (TypeError, ValueError, msgpack.UnpackException) as e:
+                raise CodecError(f"Unreadable event frame: {e}") from e
+            if decimals:
+                keys = list(payload)
+                for i in decimals:
+                    payload[keys[i]] = Decimal(payload[keys[i]])
+
+            return Envelope(
+                type=type_,
+                payload=payload,
+                key=key,
+                version=version,
+                timestamp=timestamp,
+                id=event_id.hex() if type(event_id) is bytes else event_id,
+            )
+
+        return self._decode_struct_frame(data, frame)
+
+    def _decode_struct_frame(self, data: bytes, frame) -> Envelope:
+        try:
+            if frame == 2:
+                magic, frame, version, timestamp, id_len, type_len, key_len, dec_len = (
+                    self.HEADER_V2.unpack_from(data)
+                )
+                pos = self.HEADER_V2.size
+            elif frame == 1:
+                magic, frame, version, timestamp, type_len, key_len, dec_len = (
+                    self.HEADER_V1.unpack_from(data)
+                )
+                id_len, pos = 0, self.HEADER_V1.size
+            else:
+                raise CodecError(f"Unsupported frame v{frame}")
+        except struct.error as e:
+            raise CodecError(f"Truncated event header: {e}") from e
+
+        event_id = data[pos:pos + id_len].decode("utf-8") or None
+        pos += id_len
+
+        type_ = data[pos:pos + type_len].decode("utf-8")
+        pos += type_len
+
+        key = None
+        if key_len != 0xFFFF:
+            key = data[pos:pos + key_len].decode("utf-8")
+            pos += key_len
+
+        decimals = data[pos:pos + dec_len].decode("utf-8").split(",") if dec_len else ()
+        pos += dec_len
+
+        return Envelope(
+            type=type_,
+            payload=_restore_decimals(_loads(data[pos:]), decimals),
+            key=key,
+            version=version,
+            timestamp=timestamp,
+            id=event_id,
+        )
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), BinaryCodec())}
+
+
+def get_codec(name: str | None = None):
+    name = name or getattr(settings, "KAFKA_EVENT_CODEC", "json")
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise CodecError(f"Unknown event codec '{name}'") from None
+
+
+# ------------------------------
+# ENTRY POINTS
+# ------------------------------
+def encode(value, codec: str | None = None) -> bytes:
+    """
+    Kafka value_serializer: Envelope or bare event dict → bytes
+    """
+    if not isinstance(value, Envelope):
+        value = Envelope.from_event(value)
+    return get_codec(codec).encode(value)
+
+
+def decode(data: bytes) -> Envelope:
+    """
+    bytes → Envelope, whichever codec wrote them
+    """
+    if not data:
+        raise CodecError("Empty message")
+
+    try:
+        if data[:1] == BinaryCodec.MAGIC:
+            return CODECS["binary"].decode(data)
+        return CODECS["json"].decode(data)
+    except CodecError:
+        raise
+    except Exception as e:
+        raise CodecError(str(e)) from e
@@ -0,0 +1,323 @@
+# core/consumer_pool.py
+"""
+Partition-parallel consumer runtime.
+
+One poll loop feeds a pool of worker threads. Messages are routed by
+crc32(key) to a per-worker queue, so events for the same client are
+handled strictly in order while independent clients run in parallel.
+
+Workers finish out of order, so offsets are committed per partition only
+up to the lowest offset that is not yet fully processed (OffsetTracker).
+A crash therefore re-delivers, never skips.
+
+Failures go through core.retry.RetryScheduler like start_consumer: the
+worker schedules the retry, the poll thread hands due retries back to the
+key's worker, and after KAFKA_RETRY_MAX_ATTEMPTS the event is
+dead-lettered. The watermark is capped at the lowest offset still
+waiting for a retry, so a failing event is never committed past.
+"""
+import logging
+import queue
+import signal
+import threading
+import time
+import zlib
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+from kafka import ConsumerRebalanceListener
+
+from core.consumers import create_kafka_consumer
+from core.kafka_transport import offset_and_metadata
+from core.metrics import consumer_metrics, start as start_metrics
+from core.retry import RetryScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class OffsetTracker:
+    """
+    Per-partition low-watermark of fully processed offsets
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}     # tp → deque of dispatched offsets (ascending)
+        self._done = {}        # tp → set of finished offsets
+        self._watermark = {}   # tp → next offset after the finished prefix
+        self._committed = {}   # tp → last committed position
+
+    def track(self, tp, offset: int):
+        with self._lock:
+            self._pending.setdefault(tp, deque()).append(offset)
+            self._done.setdefault(tp, set())
+
+    def mark_done(self, tp, offset: int):
+        with self._lock:
+            if tp in self._done:
+                self._done[tp].add(offset)
+
+    def committable(self, floor=None) -> dict:
+        """
+        {tp: next offset to consume} for partitions whose commit position
+        moved. floor() → {(topic, partition): offset} caps it (offsets
+        waiting for a retry); it is read after the watermarks advance, so
+        a retry scheduled before its offset was marked done is seen.
+        """
+        positions = {}
+
+        with self._lock:
+            for tp, pending in self._pending.items():
+                done = self._done[tp]
+
+                while pending and pending[0] in done:
+                    offset = pending.popleft()
+                    done.discard(offset)
+                    self._watermark[tp] = offset + 1
+
+            caps = floor() if floor is not None else {}
+
+            for tp, position in self._watermark.items():
+                cap = caps.get((tp[0], tp[1]))
+                if cap is not None:
+                    position = min(position, cap)
+                if self._committed.get(tp, -1) < position:
+                    positions[tp] = position
+                    self._committed[tp] = position
+
+        return positions
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def forget(self, partitions=None):
+        with self._lock:
+            for tp in list(self._pending if partitions is None else partitions):
+                self._pending.pop(tp, None)
+                self._done.pop(tp, None)
+                self._watermark.pop(tp, None)
+                self._committed.pop(tp, None)
+
+
+class KeyedWorkerPool:
+    """
+    N worker threads, one bounded queue each; same key → same worker.
+    With a RetryScheduler, messages run through retry.attempt() and due
+    retries come back through submit_retry(); without one, handler
+    failures are only logged.
+    """
+
+    def __init__(self, handler, tracker: OffsetTracker, workers: int = 8, queue_size: int = 1000, stats=None, retry=None):
+        self.handler = handler
+        self.tracker = tracker
+        self.stats = stats
+        self.retry = retry
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"consumer-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def route(self, message) -> int:
+        return self._route(message.key, message.topic, message.partition)
+
+    def _route(self, key, topic, partition) -> int:
+        if key is None:
+            # No key: keep partition order
+            key = f"{topic}:{partition}"
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        return zlib.crc32(key) % len(self.queues)
+
+    def submit(self, tp, message):
+        """
+        Queue a message for its key's worker (blocks when that queue is full)
+        """
+        self.tracker.track(tp, message.offset)
+        self.queues[self.route(message)].put((tp, message))
+
+    def submit_retry(self, item):
+        """
+        Queue a due retry (core.retry.PendingRetry) for its key's worker;
+        its offset is held back by the retry scheduler, not the tracker
+        """
+        self.queues[self._route(item.key, *item.tp)].put((None, item))
+
+    def join(self):
+        """
+        Wait until every queued message has been processed
+        """
+        for q in self.queues:
+            q.join()
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None:
+                q.task_done()
+                return
+
+            tp, message = item
+            try:
+                if tp is None or message.value:
+                    if self.stats is not None:
+                        with self.stats.time_handler():
+                            self._handle(tp, message)
+                    else:
+                        self._handle(tp, message)
+            except Exception as e:
+                # No retry scheduler (or the scheduler itself failed)
+                topic, partition = (message.topic, message.partition) if tp is not None else message.tp
+                logger.error(
+                    f"❌ Handler failed for {topic}[{partition}]@{message.offset}: {e}",
+                    exc_info=True,
+                )
+            finally:
+                close_old_connections()
+                if tp is not None:
+                    # After attempt(): a failure (or a message parked behind
+                    # one) is already in the retry floor
+                    self.tracker.mark_done(tp, message.offset)
+                q.task_done()
+
+    def _handle(self, tp, message):
+        if self.retry is None:
+            self.handler(message.value)
+        elif tp is None:
+            self.retry.run(message)
+        else:
+            self.retry.attempt(message)
+
+
+class _CommitOnRevoke(ConsumerRebalanceListener):
+
+    def __init__(self, runner):
+        self.runner = runner
+
+    def on_partitions_revoked(self, revoked):
+        # Finish what we hold for these partitions before they move;
+        # pending retries are redelivered to the new owner
+        self.runner.pool.join()
+        self.runner.commit()
+        self.runner.tracker.forget(revoked)
+        self.runner.retry.forget(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+
+class PooledConsumer:
+    """
+    Poll loop + KeyedWorkerPool + watermark commits
+    """
+
+    def __init__(self, topic: str, group_id: str, handler, workers: int | None = None, consumer=None, dedupe=None, retry=None):
+        self.topic = topic
+        self.group_id = group_id
+        self.dedupe = dedupe
+        self.stats = consumer_metrics(topic)
+        self.tracker = OffsetTracker()
+        # Marks dedupe ids in the handler's transaction, retries, dead-letters
+        self.retry = retry if retry is not None else RetryScheduler(topic, handler, dedupe=dedupe)
+        self.pool = KeyedWorkerPool(
+            handler,
+            self.tracker,
+            workers=workers or getattr(settings, "KAFKA_CONSUMER_WORKERS", 8),
+            stats=self.stats,
+            retry=self.retry,
+        )
+        self.commit_interval = getattr(settings, "KAFKA_CONSUMER_COMMIT_INTERVAL", 1.0)
+        self.consumer = consumer
+        self._running = True
+
+    def commit(self):
+        positions = self.tracker.committable(floor=self.retry.commit_floor)
+        if not positions:
+            return
+        with self.stats.time_commit():
+            self.consumer.commit(
+                {tp: offset_and_metadata(offset) for tp, offset in positions.items()}
+            )
+        logger.debug(f"✅ Committed {len(positions)} partition watermark(s)")
+
+    def stop(self, *args):
+        logger.info("🛑 Pooled consumer stopping (draining in-flight messages)")
+        self._running = False
+
+    def submit_due_retries(self) -> int:
+        due = self.retry.due()
+        for item in due:
+            self.pool.submit_retry(item)
+        return len(due)
+
+    def poll_once(self, max_records: int | None = None) -> int:
+        self.submit_due_retries()
+
+        # Wake up for the next due retry
+        raw_messages = self.consumer.poll(
+            timeout_ms=int(self.retry.next_due_in() * 1000),
+            max_records=max_records or getattr(settings, "KAFKA_CONSUMER_MAX_RECORDS", 500),
+        )
+        count = 0
+        for tp, messages in raw_messages.items():
+            duplicates = set()
+            if self.dedupe is not None:
+                _, skipped = self.dedupe.filter_messages(messages)
+                duplicates = {message.offset for message in skipped}
+
+            for message in messages:
+                if message.offset in duplicates or not message.value:
+                    # Nothing to run, but the watermark must pass it
+                    self.tracker.track(tp, message.offset)
+                    self.tracker.mark_done(tp, message.offset)
+                else:
+                    self.pool.submit(tp, message)
+                count += 1
+
+        if count:
+            self.stats.observe_batch(count)
+        return count
+
+    def run(self):
+        if self.consumer is None:
+            self.consumer = create_kafka_consumer(
+                self.topic, self.group_id, enable_auto_commit=False, subscribe=False
+            )
+            self.consumer.subscribe([self.topic], listener=_CommitOnRevoke(self))
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.pool.start()
+        start_metrics()
+        logger.info(
+            f"📥 Pooled consumer ready: topic={self.topic} workers={len(self.pool.queues)}"
+        )
+
+        last_commit = time.monotonic()
+        try:
+            while self._running:
+                self.poll_once()
+                self.stats.update_lag(self.consumer)
+
+                if time.monotonic() - last_commit >= self.commit_interval:
+                    self.commit()
+                    last_commit = time.monotonic()
+        finally:
+            self.pool.join()
+            self.commit()
+            self.pool.stop()
+            self.consumer.close()
+            logger.info("✅ Pooled consumer closed")
@@ -97,17 +97,28 @@ import django
 import json
 import logging
 import time
-from kafka import KafkaConsumer, KafkaProducer
-from kafka.errors import NoBrokersAvailable, KafkaError
+from kafka import KafkaProducer
+from kafka.errors import KafkaError
+try:
+    from kafka.errors import NoBrokersAvailable
+except ImportError:  # kafka-python 3.x reports bootstrap failure as a timeout
+    from kafka.errors import KafkaTimeoutError as NoBrokersAvailable
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 from django.conf import settings
+from django.db import transaction
 
 # Setup Django first
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "oms_margin_demo.settings")
 django.setup()
 
+from core.codecs import decode
+from core.dedupe import Deduplicator
+from core.kafka_transport import make_consumer
+from core import metrics
 from core.models import AuditLog, Client, MarginLoan
+from core.retry import RetryScheduler
+from risk.services.event_evaluation import RiskEventEvaluator
 
 # Configure logging
 logging.basicConfig(
@@ -117,11 +128,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def safe_deserializer(m):
-    """Safely deserialize Kafka message"""
+    """Safely deserialize Kafka message (any codec in core.codecs,
+    including legacy bare JSON) into the flat event dict"""
     try:
         if not m:
             return None
-        return json.loads(m.decode("utf-8"))
+        return decode(m).event
     except Exception as e:
         logger.error(f"⚠️ Failed to deserialize Kafka message: {e} | raw={m}")
         return None
@@ -155,25 +167,69 @@ def save_audit_log(event, client_id=None, loan_id=None):
             loan=loan,
             details=event,
         )
-        logger.info(f"📝 AuditLog saved: {event.get('type')}")
+        logger.debug(f"📝 AuditLog saved: {event.get('type')}")
         return True
         
     except Exception as e:
         logger.error(f"❌ Failed to save AuditLog: {e} | event={event}")
-        return False
+        raise
 
-def create_kafka_consumer(topic, group_id):
-    """Create and configure Kafka consumer with retry logic"""
+def save_audit_logs(events):
+    """Batch version of save_audit_log: FK ids are checked with one
+    query per model and every row is written with one bulk_create.
+    Unknown client/loan ids are stored as NULL, as in save_audit_log."""
+    events = [e for e in events if isinstance(e, dict)]
+    if not events:
+        return 0
+
+    def _id(value):
+        try:
+            return int(value) if value else None
+        except (TypeError, ValueError):
+            return None
+
+    rows = [(e, _id(e.get("client_id")), _id(e.get("loan_id"))) for e in events]
+    client_ids = {client_id for _, client_id, _ in rows if client_id}
+    loan_ids = {loan_id for _, _, loan_id in rows if loan_id}
+
+    known_clients = set(
+        Client.objects.filter(id__in=client_ids).values_list("id", flat=True)
+    ) if client_ids else set()
+    known_loans = set(
+        MarginLoan.objects.filter(id__in=loan_ids).values_list("id", flat=True)
+    ) if loan_ids else set()
+
+    missing = (client_ids - known_clients) | (loan_ids - known_loans)
+    if missing:
+        logger.warning(f"Client/Loan IDs not found: {sorted(missing)}")
+
+    AuditLog.objects.bulk_create(
+        [
+            AuditLog(
+                event_type=e.get("type"),
+                client_id=client_id if client_id in known_clients else None,
+                loan_id=loan_id if loan_id in known_loans else None,
+                details=e,
+            )
+            for e, client_id, loan_id in rows
+        ]
+    )
+    logger.debug(f"📝 {len(events)} AuditLog row(s) saved")
+    return len(events)
+
+def create_kafka_consumer(topic, group_id, enable_auto_commit=True, subscribe=True):
+    """Create and configure Kafka consumer with retry logic
+    (subscribe=False: caller subscribes, e.g. with a rebalance listener)"""
     max_retries = 5
     retry_delay = 5  # seconds
     
     for attempt in range(max_retries):
         try:
-            consumer = KafkaConsumer(
-                topic,
+            consumer = make_consumer(
+                *([topic] if subscribe else []),
                 bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
                 auto_offset_reset="earliest",
-                enable_auto_commit=True,
+                enable_auto_commit=enable_auto_commit,
                 group_id=group_id,
                 value_deserializer=safe_deserializer,
                 session_timeout_ms=30000,
@@ -202,7 +258,7 @@ def create_kafka_consumer(topic, group_id):
 def handle_portfolio_event(event: dict):
     """Process portfolio events"""
     try:
-        logger.info(f"📦 Processing portfolio event: {event.get('type')}")
+        logger.debug(f"📦 Processing portfolio event: {event.get('type')}")
         
         if event.get("type") == "FORCED_SELL":
             logger.warning(f"⚠️ Forced Sell triggered: {event}")
@@ -211,40 +267,147 @@ def handle_portfolio_event(event: dict):
             # Save audit log
             save_audit_log(event, client_id=client_id)
             
-            # TODO: Implement forced sell logic
-            logger.info(f"Would execute forced sell for client {client_id}")
+            RiskEventEvaluator.forced_sells([event])
             
     except Exception as e:
+        # Let the consumer retry / dead-letter it
         logger.error(f"❌ Error in portfolio event handler: {e}", exc_info=True)
+        raise
 
 def handle_margin_event(event: dict):
     """Process margin events"""
     try:
-        logger.info(f"💰 Processing margin event: {event.get('type')}")
+        logger.debug(f"💰 Processing margin event: {event.get('type')}")
         
         if event.get("type") == "MARGIN_REQUEST":
-            logger.info(f"💰 Margin Request received: {event}")
+            logger.debug(f"💰 Margin Request received: {event}")
             client_id = event.get("client_id")
             loan_id = event.get("loan_id")
             
+            # Decision goes into the audit row ("decision")
+            RiskEventEvaluator.margin_requests([event])
+            
             # Save audit log
             save_audit_log(event, client_id=client_id, loan_id=loan_id)
             
-            # TODO: Business logic for margin approval/rejection
-            logger.info(f"Would process margin request for client {client_id}")
-            
     except Exception as e:
         logger.error(f"❌ Error in margin event handler: {e}", exc_info=True)
+        raise
+
+# Batch handlers: one call per poll batch (events in partition order);
+# risk work is coalesced to one evaluation per client per batch
+def handle_portfolio_events(events):
+    """Process a batch of portfolio events"""
+    forced_sells = [e for e in events if e.get("type") == "FORCED_SELL"]
+    if forced_sells:
+        logger.warning(f"⚠️ {len(forced_sells)} Forced Sell event(s) in batch")
+        save_audit_logs(forced_sells)
+        RiskEventEvaluator.forced_sells(forced_sells)
+
+def handle_margin_events(events):
+    """Process a batch of margin events"""
+    requests = [e for e in events if e.get("type") == "MARGIN_REQUEST"]
+    if requests:
+        logger.info(f"💰 {len(requests)} Margin Request(s) in batch")
+        RiskEventEvaluator.margin_requests(requests)
+        save_audit_logs(requests)
+
+def process_batch(consumer, handler_func, max_records=None, dedupe=None, retry=None, stats=None):
+    """Poll one batch, hand it to a batch handler inside one transaction,
+    then commit its offsets. On failure nothing is committed and the
+    consumer is rewound to the start of the batch so it is redelivered.
+
+    dedupe (core.dedupe.Deduplicator): already-processed events are
+    dropped with one bulk lookup and the new ids are marked in the same
+    transaction as the handler's writes.
+
+    retry (core.retry.RetryScheduler): a failed batch is re-run one event
+    at a time; only the failing events wait for a retry, the rest of the
+    batch is persisted and the partition keeps moving. Events whose key
+    is still waiting behind a retry stay out of the batch and queue up
+    behind it.
+
+    stats (core.metrics.ConsumerMetrics): batch size, handler and commit
+    latency."""
+    max_records = max_records or getattr(settings, "KAFKA_CONSUMER_MAX_RECORDS", 500)
+
+    raw_messages = consumer.poll(timeout_ms=1000, max_records=max_records)
+    if not raw_messages:
+        return 0
+
+    # Empty / undecodable / non-dict payloads are skipped (and committed)
+    valid = [
+        message
+        for messages in raw_messages.values()
+        for message in messages
+        if isinstance(message.value, dict)
+    ]
+
+    held = []
+    if retry is not None:
+        held = [message for message in valid if retry.blocks(message)]
+        valid = [message for message in valid if not retry.blocks(message)]
+
+    count = sum(len(messages) for messages in raw_messages.values())
+    stats = stats if stats is not None else metrics.consumer_metrics("default")
+    stats.observe_batch(count)
+
+    try:
+        with stats.time_handler(), transaction.atomic():
+            if dedupe is not None:
+                valid, _ = dedupe.filter_messages(valid)
+                dedupe.mark(dedupe.event_id(message) for message in valid)
+            if valid:
+                handler_func([message.value for message in valid])
+    except Exception as e:
+        if retry is None:
+            for tp, messages in raw_messages.items():
+                consumer.seek(tp, messages[0].offset)
+            raise
+
+        logger.warning(f"⚠️ Batch failed ({e}); handling its {len(valid)} event(s) one by one")
+        for message in valid:
+            retry.attempt(message)
 
-def start_consumer(topic: str, group_id: str, handler_func):
-    """Generic Kafka consumer runner with topic verification"""
+    for message in held:
+        retry.attempt(message)
+
+    # Offsets only move once the batch is persisted (and never past a
+    # message still waiting for a retry)
+    with stats.time_commit():
+        if retry is not None:
+            retry.commit(consumer)
+        else:
+            consumer.commit()
+
+    logger.debug(f"📥 Processed batch of {count} message(s)")
+    return count
+
+def start_consumer(topic: str, group_id: str, handler_func, batch: bool = False, max_records=None):
+    """Generic Kafka consumer runner with topic verification
+
+    batch=True: handler_func receives a list of events per poll, offsets
+    are committed manually after the batch is persisted.
+
+    Failing events are retried with backoff and then dead-lettered
+    (core.retry); offsets are committed manually in both modes.
+    """
     consumer = None
     
     try:
         logger.info(f"🚀 Starting {topic} consumer for group {group_id}...")
         
         # Create consumer with retry logic
-        consumer = create_kafka_consumer(topic, group_id)
+        consumer = create_kafka_consumer(topic, group_id, enable_auto_commit=False)
+        dedupe = Deduplicator(group_id) if getattr(settings, "KAFKA_CONSUMER_DEDUPE", True) else None
+        retry = RetryScheduler(
+            topic,
+            (lambda event: handler_func([event])) if batch else handler_func,
+            dedupe=dedupe,
+        )
+        stats = metrics.consumer_metrics(topic)
+        sample = metrics.LogSampler()
+        metrics.start()
         
         # Verify topic exists and has partitions
         try:
@@ -270,28 +433,59 @@ def start_consumer(topic: str, group_id: str, handler_func):
         
         # Main consumption loop
         while True:
+            if batch:
+                try:
+                    if retry.run_due():
+                        retry.commit(consumer)
+                    process_batch(consumer, handler_func, max_records, dedupe=dedupe, retry=retry, stats=stats)
+                    stats.update_lag(consumer)
+                except KeyboardInterrupt:
+                    logger.info("🛑 Consumer stopped by user")
+                    break
+                except Exception as e:
+                    logger.error(f"⚠️ Error in batch consumption loop: {e}", exc_info=True)
+                    time.sleep(5)
+                continue
+
             try:
-                # Poll for messages
-                raw_messages = consumer.poll(timeout_ms=1000, max_records=10)
+                if retry.run_due():
+                    retry.commit(consumer)
+
+                # Poll for messages (wake up for the next due retry)
+                raw_messages = consumer.poll(
+                    timeout_ms=int(retry.next_due_in() * 1000), max_records=10
+                )
                 
+                stats.update_lag(consumer)
                 if not raw_messages:
                     # No messages, but continue polling
                     continue
                 
                 # Process messages
+                stats.observe_batch(sum(len(messages) for messages in raw_messages.values()))
                 for tp, messages in raw_messages.items():
+                    if dedupe is not None:
+                        # One lookup per partition batch, not per message
+                        messages, _ = dedupe.filter_messages(messages)
+
                     for message in messages:
-                        logger.info(f"📩 Received message from {message.topic}[{message.partition}]@offset{message.offset}")
-                        
                         event = message.value
                         if not event:
                             continue
 
-                        logger.info(f"🎯 Processing event: {event}")
-                        handler_func(event)
+                        # Per-message logging is sampled (metrics cover volume)
+                        if logger.isEnabledFor(logging.DEBUG) and sample():
+                            logger.debug(
+                                f"📩 {message.topic}[{message.partition}]@offset{message.offset}: {event}"
+                            )
+
+                        # Failures wait in the retry heap, not in this loop
+                        with stats.time_handler():
+                            retry.attempt(message)
                 
                 # Commit offsets
-                consumer.commit_async()
+                with stats.time_commit():
+                    retry.commit(consumer, asynchronous=True)
                 
             except KeyboardInterrupt:
                 logger.info("🛑 Consumer stopped by user")
@@ -306,6 +500,12 @@ def start_consumer(topic: str, group_id: str, handler_func):
         if consumer:
             consumer.close()
 
+# Per-message consumers by name: (topic, group_id, handler)
+CONSUMERS = {
+    "portfolio": ("portfolio-events", "oms-portfolio-group", handle_portfolio_event),
+    "margin": ("margin-loan-events", "oms-margin-group", handle_margin_event),
+}
+
 # Dispatcher entrypoint
 # core/consumers.py - Fixed version
 if __name__ == "__main__":
@@ -314,9 +514,9 @@ if __name__ == "__main__":
     consumer_type = sys.argv[1] if len(sys.argv) > 1 else "portfolio"
 
     if consumer_type == "portfolio":
-        start_consumer("portfolio-events", "oms-portfolio-group", handle_portfolio_event)
+        start_consumer("portfolio-events", "oms-portfolio-group", handle_portfolio_events, batch=True)
     elif consumer_type == "margin":
-        start_consumer("margin-loan-events", "oms-margin-group", handle_margin_event)
+        start_consumer("margin-loan-events", "oms-margin-group", handle_margin_events, batch=True)
     else:
         logger.error("❌ Unknown consumer type. Use: portfolio | margin")
         sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,138 @@
+# core/dedupe.py
+"""
+Consumer-side deduplication.
+
+Redeliveries (rebalance, crash before commit, producer retries) re-run
+handlers. Deduplicator keeps, per consumer group, the set of event ids
+already handled:
+
+- in-process LRU of recently processed ids (no query for hot redeliveries)
+- ProcessedEvent rows, checked with ONE query per poll batch
+
+Ids are written with bulk_create in the same transaction as the
+handler's writes, so "processed" and "marked" commit together. Two
+consumers racing on the same event collide on the unique constraint; the
+loser's batch rolls back, is redelivered and then skipped.
+
+Event id = envelope id (core.codecs); legacy events without one fall
+back to their log position "topic:partition:offset".
+"""
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ProcessedEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Deduplicator:
+
+    def __init__(self, group: str, cache_size: int | None = None):
+        self.group = group
+        self.cache_size = cache_size or getattr(settings, "KAFKA_DEDUPE_CACHE_SIZE", 100_000)
+        self._recent = OrderedDict()
+        # Pooled consumers mark from worker threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def event_id(message) -> str:
+        """
+        Id of a consumed record (stored on the event as "event_id")
+        """
+        event = message.value
+        fallback = f"{message.topic}:{message.partition}:{message.offset}"
+        if not isinstance(event, dict):
+            return fallback
+        return event.setdefault("event_id", fallback)
+
+    # ------------------------------
+    # CHECK
+    # ------------------------------
+    def unseen(self, event_ids) -> set:
+        """
+        Subset of event_ids not processed yet (LRU, then one bulk query)
+        """
+        candidates = set()
+        with self._lock:
+            for event_id in event_ids:
+                if event_id in self._recent:
+                    self._recent.move_to_end(event_id)
+                else:
+                    candidates.add(event_id)
+
+        if not candidates:
+            return candidates
+
+        seen = set(
+            ProcessedEvent.objects
+            .filter(group=self.group, event_id__in=candidates)
+            .values_list("event_id", flat=True)
+        )
+        self._remember(seen)
+        return candidates - seen
+
+    def filter_messages(self, messages) -> tuple[list, list]:
+        """
+        Split records into (new, duplicates); the first copy of an id
+        inside the batch counts as new
+        """
+        keyed = [(self.event_id(message), message) for message in messages]
+        unseen = self.unseen(event_id for event_id, _ in keyed)
+
+        new, duplicates = [], []
+        for event_id, message in keyed:
+            if event_id in unseen:
+                unseen.discard(event_id)
+                new.append(message)
+            else:
+                duplicates.append(message)
+
+        if duplicates:
+            logger.info(f"♻️ Skipped {len(duplicates)} duplicate event(s) for {self.group}")
+        return new, duplicates
+
+    # ------------------------------
+    # MARK
+    # ------------------------------
+    def mark(self, event_ids):
+        """
+        Record ids as processed; call inside the handler's transaction
+        """
+        event_ids = list(event_ids)
+        if not event_ids:
+            return
+
+        ProcessedEvent.objects.bulk_create(
+            [ProcessedEvent(group=self.group, event_id=event_id) for event_id in event_ids]
+        )
+        # Only cache what actually committed
+        transaction.on_commit(lambda: self._remember(event_ids))
+
+    def _remember(self, event_ids):
+        with self._lock:
+            for event_id in event_ids:
+                self._recent[event_id] = None
+                self._recent.move_to_end(event_id)
+            while len(self._recent) > self.cache_size:
+                self._recent.popitem(last=False)
+
+    # ------------------------------
+    # RETENTION
+    # ------------------------------
+    @staticmethod
+    def prune(days: int | None = None) -> int:
+        """
+        Drop seen-set rows older than the redelivery horizon
+        """
+        days = days if days is not None else getattr(settings, "KAFKA_DEDUPE_RETENTION_DAYS", 7)
+        deleted, _ = ProcessedEvent.objects.filter(
+            processed_at__lt=timezone.now() - timedelta(days=days)
+        ).delete()
+        logger.info(f"🧹 Pruned {deleted} processed-event row(s) older than {days} day(s)")
+        return deleted
@@ -1,3 +1,9 @@
 # core/events.py
 MARGIN_REQUEST = "MARGIN_REQUEST"
 FORCED_SELL = "FORCED_SELL"
+LOAN_CREATED = "LOAN_CREATED"
+POSITION_UPDATED = "POSITION_UPDATED"
+POSITION_CLOSED = "POSITION_CLOSED"
+LOAN_UPDATED = "LOAN_UPDATED"
+LOAN_CLOSED = "LOAN_CLOSED"
+MARGIN_POLICY_CHANGED = "MARGIN_POLICY_CHANGED"
@@ -0,0 +1,458 @@
+# core/kafka_transport.py
+"""
+Pluggable Kafka transport.
+
+KAFKA_TRANSPORT = "kafka"  → kafka-python KafkaProducer / KafkaConsumer
+KAFKA_TRANSPORT = "memory" → in-process partitioned log (this module)
+
+The in-memory broker keeps the parts of Kafka the OMS code relies on:
+keyed partitioning, per-partition offsets, consumer groups with
+partition assignment and rebalance callbacks, manual assignment,
+committed offsets, seek, offsets_for_times and auto_offset_reset. It lets the produce → consume → handler
+pipeline run in tests and benchmarks without a broker. Everything lives
+in one process; nothing is persisted.
+"""
+import itertools
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+from django.conf import settings
+from kafka.structs import OffsetAndMetadata, OffsetAndTimestamp, TopicPartition
+
+
+RecordMetadata = namedtuple("RecordMetadata", "topic partition offset timestamp")
+InMemoryRecord = namedtuple(
+    "InMemoryRecord", "topic partition offset timestamp key value headers"
+)
+
+
+def offset_and_metadata(offset: int) -> OffsetAndMetadata:
+    # kafka-python 3.x added leader_epoch
+    if "leader_epoch" in OffsetAndMetadata._fields:
+        return OffsetAndMetadata(offset, "", -1)
+    return OffsetAndMetadata(offset, "")
+
+
+def offset_and_timestamp(offset: int, timestamp: int) -> OffsetAndTimestamp:
+    if "leader_epoch" in OffsetAndTimestamp._fields:
+        return OffsetAndTimestamp(offset, timestamp, -1)
+    return OffsetAndTimestamp(offset, timestamp)
+
+
+# ------------------------------
+# FACTORIES
+# ------------------------------
+def transport() -> str:
+    return getattr(settings, "KAFKA_TRANSPORT", "kafka")
+
+
+def make_producer(**config):
+    if transport() == "memory":
+        return InMemoryProducer(**config)
+
+    from kafka import KafkaProducer
+    return KafkaProducer(**config)
+
+
+def make_consumer(*topics, **config):
+    if transport() == "memory":
+        return InMemoryConsumer(*topics, **config)
+
+    from kafka import KafkaConsumer
+    return KafkaConsumer(*topics, **config)
+
+
+# ------------------------------
+# BROKER
+# ------------------------------
+class InMemoryBroker:
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.reset()
+
+    def reset(self, partitions: int | None = None):
+        with self._cond:
+            self.default_partitions = partitions or getattr(
+                settings, "KAFKA_MEMORY_PARTITIONS", 8
+            )
+            self._logs = {}        # topic → [[record, ...] per partition]
+            self._committed = {}   # (group_id, tp) → offset
+            self._members = {}     # group_id → [consumer, ...] (join order)
+            self._generation = {}  # group_id → int
+            self._round_robin = itertools.count()
+
+    # ---- topics ----
+    def create_topic(self, topic: str, partitions: int | None = None):
+        with self._cond:
+            self._log(topic, partitions)
+
+    def _log(self, topic: str, partitions: int | None = None):
+        log = self._logs.get(topic)
+        if log is None:
+            log = self._logs[topic] = [
+                [] for _ in range(partitions or self.default_partitions)
+            ]
+        return log
+
+    def partitions_for(self, topic: str) -> set:
+        with self._cond:
+            return set(range(len(self._log(topic))))
+
+    def end_offset(self, tp: TopicPartition) -> int:
+        with self._cond:
+            return len(self._log(tp.topic)[tp.partition])
+
+    # ---- produce ----
+    def append(self, topic: str, key: bytes | None, value: bytes | None, partition: int | None = None):
+        with self._cond:
+            log = self._log(topic)
+
+            if partition is None:
+                if key is None:
+                    partition = next(self._round_robin) % len(log)
+                else:
+                    partition = zlib.crc32(key) % len(log)
+
+            timestamp = int(time.time() * 1000)
+            offset = len(log[partition])
+            log[partition].append((timestamp, key, value))
+
+            self._cond.notify_all()
+
+        return RecordMetadata(topic, partition, offset, timestamp)
+
+    # ---- fetch ----
+    def read(self, tp: TopicPartition, offset: int, limit: int):
+        with self._cond:
+            return self._log(tp.topic)[tp.partition][offset:offset + limit]
+
+    def offset_for_time(self, tp: TopicPartition, timestamp: int):
+        """
+        First (offset, timestamp) at or after timestamp (ms), None past the end
+        """
+        with self._cond:
+            for offset, (ts, _, _) in enumerate(self._log(tp.topic)[tp.partition]):
+                if ts >= timestamp:
+                    return offset, ts
+        return None
+
+    def wait_for_data(self, timeout: float):
+        with self._cond:
+            self._cond.wait(timeout)
+
+    # ---- groups ----
+    def join(self, group_id: str, consumer):
+        with self._cond:
+            members = self._members.setdefault(group_id, [])
+            if consumer not in members:
+                members.append(consumer)
+                self._generation[group_id] = self._generation.get(group_id, 0) + 1
+
+    def leave(self, group_id: str, consumer):
+        with self._cond:
+            members = self._members.get(group_id, [])
+            if consumer in members:
+                members.remove(consumer)
+                self._generation[group_id] = self._generation.get(group_id, 0) + 1
+
+    def generation(self, group_id: str) -> int:
+        with self._cond:
+            return self._generation.get(group_id, 0)
+
+    def assignment(self, group_id: str, consumer, topics) -> set:
+        """
+        Round-robin partitions of the subscribed topics over the group
+        """
+        with self._cond:
+            members = self._members.get(group_id) or [consumer]
+            index = members.index(consumer) if consumer in members else 0
+
+            partitions = [
+                TopicPartition(topic, p)
+                for topic in sorted(topics)
+                for p in range(len(self._log(topic)))
+            ]
+            return set(partitions[index::len(members)])
+
+    def commit(self, group_id: str, tp: TopicPartition, offset: int):
+        with self._cond:
+            self._committed[(group_id, tp)] = offset
+
+    def committed(self, group_id: str, tp: TopicPartition):
+        with self._cond:
+            return self._committed.get((group_id, tp))
+
+
+# Process-wide instance shared by every in-memory producer/consumer
+broker = InMemoryBroker()
+
+
+# ------------------------------
+# PRODUCER
+# ------------------------------
+class InMemoryFuture:
+    """
+    Already-completed send future (same surface as kafka-python's)
+    """
+
+    def __init__(self, metadata=None, exception=None):
+        self.metadata = metadata
+        self.exception = exception
+
+    def get(self, timeout=None):
+        if self.exception:
+            raise self.exception
+        return self.metadata
+
+    def succeeded(self):
+        return self.exception is None
+
+    def add_callback(self, fn, *args, **kwargs):
+        if self.exception is None:
+            fn(*args, self.metadata, **kwargs)
+        return self
+
+    def add_errback(self, fn, *args, **kwargs):
+        if self.exception is not None:
+            fn(*args, self.exception, **kwargs)
+        return self
+
+
+class InMemoryProducer:
+
+    def __init__(self, value_serializer=None, key_serializer=None, **config):
+        self.value_serializer = value_serializer
+        self.key_serializer = key_serializer
+        self._closed = False
+
+    def send(self, topic, value=None, key=None, partition=None, **kwargs):
+        if self._closed:
+            return InMemoryFuture(exception=RuntimeError("Producer closed"))
+
+        try:
+            key_bytes = self.key_serializer(key) if self.key_serializer and key is not None else key
+            value_bytes = self.value_serializer(value) if self.value_serializer else value
+        except Exception as e:
+            return InMemoryFuture(exception=e)
+
+        return InMemoryFuture(broker.append(topic, key_bytes, value_bytes, partition))
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        self._closed = True
+
+
+# ------------------------------
+# CONSUMER
+# ------------------------------
+class InMemoryConsumer:
+
+    def __init__(
+        self,
+        *topics,
+        group_id=None,
+        value_deserializer=None,
+        key_deserializer=None,
+        auto_offset_reset="latest",
+        enable_auto_commit=True,
+        max_poll_records=500,
+        **config,
+    ):
+        self.group_id = group_id
+        self.value_deserializer = value_deserializer
+        self.key_deserializer = key_deserializer
+        self.auto_offset_reset = auto_offset_reset
+        self.enable_auto_commit = enable_auto_commit
+        self.max_poll_records = max_poll_records
+
+        self._topics = set()
+        self._listener = None
+        self._assigned = set()
+        self._generation = None
+        self._positions = {}
+        self._manual = False
+        self._closed = False
+
+        if topics:
+            self.subscribe(list(topics))
+
+    # ---- subscription / assignment ----
+    def subscribe(self, topics, listener=None):
+        self._topics = set(topics)
+        self._listener = listener
+        for topic in self._topics:
+            broker.create_topic(topic)
+        broker.join(self._group, self)
+
+    def assign(self, partitions):
+        """
+        Manual assignment: no group membership, no rebalances
+        """
+        self._manual = True
+        self._assigned = set(partitions)
+        for tp in self._assigned:
+            broker.create_topic(tp.topic)
+        self._positions = {tp: self._initial_position(tp) for tp in self._assigned}
+
+    @property
+    def _group(self):
+        # group_id=None → standalone consumer with its own "group"
+        return self.group_id or f"__standalone-{id(self)}"
+
+    def assignment(self) -> set:
+        self._rebalance()
+        return set(self._assigned)
+
+    def subscription(self) -> set:
+        return set(self._topics)
+
+    def topics(self) -> set:
+        return set(broker._logs)
+
+    def partitions_for_topic(self, topic):
+        return broker.partitions_for(topic)
+
+    def _rebalance(self):
+        if self._manual:
+            return
+        generation = broker.generation(self._group)
+        if generation == self._generation:
+            return
+
+        new = broker.assignment(self._group, self, self._topics)
+        revoked = self._assigned - new
+        added = new - self._assigned
+
+        if revoked:
+            if self._listener:
+                self._listener.on_partitions_revoked(revoked)
+            elif self.enable_auto_commit:
+                self.commit({tp: self._positions[tp] for tp in revoked if tp in self._positions})
+            for tp in revoked:
+                self._positions.pop(tp, None)
+
+        self._assigned = new
+        self._generation = generation
+
+        for tp in added:
+            self._positions[tp] = self._initial_position(tp)
+
+        if added and self._listener:
+            self._listener.on_partitions_assigned(added)
+
+    def _initial_position(self, tp) -> int:
+        committed = broker.committed(self._group, tp)
+        if committed is not None:
+            return committed
+        if self.auto_offset_reset == "earliest":
+            return 0
+        return broker.end_offset(tp)
+
+    # ---- fetch ----
+    def poll(self, timeout_ms=0, max_records=None, update_offsets=True):
+        if self._closed:
+            raise RuntimeError("Consumer closed")
+
+        self._rebalance()
+        limit = max_records or self.max_poll_records
+        deadline = time.monotonic() + timeout_ms / 1000
+
+        while True:
+            batch = self._fetch(limit)
+            remaining = deadline - time.monotonic()
+            if batch or remaining <= 0:
+                break
+            broker.wait_for_data(remaining)
+
+        if self.enable_auto_commit and batch:
+            self.commit()
+
+        return batch
+
+    def _fetch(self, limit: int) -> dict:
+        batch = {}
+
+        for tp in sorted(self._assigned):
+            if limit <= 0:
+                break
+
+            position = self._positions[tp]
+            rows = broker.read(tp, position, limit)
+            if not rows:
+                continue
+
+            batch[tp] = [
+                InMemoryRecord(
+                    topic=tp.topic,
+                    partition=tp.partition,
+                    offset=position + i,
+                    timestamp=timestamp,
+                    key=self.key_deserializer(key) if self.key_deserializer and key is not None else key,
+                    value=self.value_deserializer(value) if self.value_deserializer else value,
+                    headers=[],
+                )
+                for i, (timestamp, key, value) in enumerate(rows)
+            ]
+            self._positions[tp] = position + len(rows)
+            limit -= len(rows)
+
+        return batch
+
+    def __iter__(self):
+        while not self._closed:
+            for records in self.poll(timeout_ms=1000).values():
+                yield from records
+
+    # ---- offsets ----
+    def position(self, tp) -> int:
+        return self._positions[tp]
+
+    def seek(self, tp, offset: int):
+        self._positions[tp] = offset
+
+    def seek_to_beginning(self, *partitions):
+        for tp in partitions or self._assigned:
+            self._positions[tp] = 0
+
+    def committed(self, tp):
+        return broker.committed(self._group, tp)
+
+    def beginning_offsets(self, partitions) -> dict:
+        return {tp: 0 for tp in partitions}
+
+    def end_offsets(self, partitions) -> dict:
+        return {tp: broker.end_offset(tp) for tp in partitions}
+
+    def offsets_for_times(self, timestamps) -> dict:
+        found = {}
+        for tp, timestamp in timestamps.items():
+            hit = broker.offset_for_time(tp, timestamp)
+            found[tp] = offset_and_timestamp(*hit) if hit else None
+        return found
+
+    def commit(self, offsets=None, **kwargs):
+        if offsets is None:
+            offsets = {tp: self._positions[tp] for tp in self._assigned}
+
+        for tp, offset in offsets.items():
+            # OffsetAndMetadata or a plain int
+            broker.commit(self._group, tp, getattr(offset, "offset", offset))
+
+    def commit_async(self, offsets=None, callback=None):
+        self.commit(offsets)
+        if callback:
+            callback(offsets, None)
+
+    def close(self, autocommit=True):
+        if self._closed:
+            return
+        if autocommit and self.enable_auto_commit:
+            self.commit()
+        if not self._manual:
+            broker.leave(self._group, self)
+        self._closed = True
@@ -0,0 +1,80 @@
+import json
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from core.codecs import CODECS, Envelope, decode, orjson
+
+SAMPLE_EVENTS = {
+    "MARGIN_REQUEST": {
+        "type": "MARGIN_REQUEST",
+        "client_id": 1042,
+        "loan_id": 88231,
+        "amount": Decimal("250000.00"),
+    },
+    "LOAN_CREATED": {
+        "type": "LOAN_CREATED",
+        "loan_id": 88231,
+        "client_id": 1042,
+        "amount": Decimal("250000.00"),
+        "interest_rate": Decimal("12.50"),
+        "created_at": datetime(2025, 9, 7, 10, 30, tzinfo=timezone.utc),
+    },
+    "FORCED_SELL": {
+        "type": "FORCED_SELL",
+        "client_id": 1042,
+        "portfolio_id": 5531,
+        "symbol": "GP",
+        "quantity": Decimal("1200"),
+        "price": Decimal("384.70"),
+        "exposure": Decimal("461640.00"),
+        "edr": Decimal("87.35"),
+        "reason": "EDR above force-sell threshold",
+    },
+}
+
+
+def _legacy_encode(event):
+    # What producers did before core.codecs: hand-stringified Decimals
+    return json.dumps(
+        {k: str(v) if isinstance(v, (Decimal, datetime)) else v for k, v in event.items()}
+    ).encode("utf-8")
+
+
+class Command(BaseCommand):
+    help = "Compare encode/decode cost and message size of the event codecs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50000)
+
+    def handle(self, *args, **options):
+        n = options["iterations"]
+        self.stdout.write(
+            f"{n:,} iterations per event, orjson={'yes' if orjson else 'no'}\n"
+            f"{'event':<16}{'codec':<9}{'bytes':>7}{'encode µs':>12}{'decode µs':>12}"
+        )
+
+        for name, event in SAMPLE_EVENTS.items():
+            legacy = _legacy_encode(event)
+            self._row(name, "legacy", len(legacy),
+                      self._time(lambda: _legacy_encode(event), n),
+                      self._time(lambda: json.loads(legacy), n))
+
+            envelope = Envelope.from_event(event, key=event["client_id"])
+            for codec in CODECS.values():
+                data = codec.encode(envelope)
+                self._row(name, codec.name, len(data),
+                          self._time(lambda: codec.encode(envelope), n),
+                          self._time(lambda: decode(data).event, n))
+
+    @staticmethod
+    def _time(fn, n) -> float:
+        started = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - started) / n * 1e6
+
+    def _row(self, event, codec, size, encode_us, decode_us):
+        self.stdout.write(f"{event:<16}{codec:<9}{size:>7}{encode_us:>12.2f}{decode_us:>12.2f}")
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from core.codecs import Envelope
+from core.kafka_transport import broker
+from core.producers import KafkaProducerWrapper
+
+TOPIC = "benchmark-margin-events"
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = "Benchmark produce → consume → handler throughput and latency (in-memory broker by default)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=10000)
+        parser.add_argument("--clients", type=int, default=100, help="Distinct message keys")
+        parser.add_argument("--partitions", type=int, default=8)
+        parser.add_argument(
+            "--runtime",
+            choices=["batch", "pool", "async"],
+            default="batch",
+            help="batch: process_batch, pool: PooledConsumer workers, async: TopicRunner",
+        )
+        parser.add_argument(
+            "--audit",
+            action="store_true",
+            help="Publish through send_event and consume with the real margin "
+                 "handlers (writes AuditLog rows to the configured database)",
+        )
+        parser.add_argument(
+            "--transport",
+            choices=["memory", "kafka"],
+            default="memory",
+        )
+
+    def handle(self, *args, **options):
+        with override_settings(
+            KAFKA_TRANSPORT=options["transport"],
+            KAFKA_MEMORY_PARTITIONS=options["partitions"],
+            KAFKA_PUBLISH_MODE="async",
+        ):
+            # The producer singleton may belong to another transport
+            KafkaProducerWrapper.close()
+            if options["transport"] == "memory":
+                broker.reset(partitions=options["partitions"])
+
+            try:
+                stats = self._run(options)
+            finally:
+                KafkaProducerWrapper.close()
+
+        latencies = stats["latencies"]
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {options['runtime']} runtime, {options['transport']} transport, "
+            f"{len(latencies)}/{options['events']} events"
+        ))
+        self.stdout.write(
+            f"   produce:  {options['events'] / stats['produce_seconds']:,.0f} events/s\n"
+            f"   pipeline: {len(latencies) / stats['total_seconds']:,.0f} events/s "
+            f"({stats['total_seconds']:.2f}s)\n"
+            f"   latency:  p50={_percentile(latencies, 50):.2f}ms "
+            f"p95={_percentile(latencies, 95):.2f}ms "
+            f"p99={_percentile(latencies, 99):.2f}ms "
+            f"max={max(latencies, default=0.0):.2f}ms"
+        )
+
+    # ------------------------------
+    # PIPELINE
+    # ------------------------------
+    def _run(self, options):
+        from core.consumers import (
+            create_kafka_consumer,
+            handle_margin_event,
+            handle_margin_events,
+        )
+
+        total = options["events"]
+        latencies = []
+        lock = threading.Lock()
+        group_id = f"benchmark-{options['runtime']}-{time.time_ns()}"
+
+        def record(event):
+            elapsed = (time.perf_counter() - event["produced_at"]) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+        def handle_one(event):
+            if options["audit"]:
+                handle_margin_event(event)
+            record(event)
+
+        def handle_many(events):
+            if options["audit"]:
+                handle_margin_events(events)
+            for event in events:
+                record(event)
+
+        consumer = create_kafka_consumer(TOPIC, group_id, enable_auto_commit=False)
+        produced = {}
+
+        def produce():
+            started = time.perf_counter()
+            producer = KafkaProducerWrapper.get_producer()
+            for i in range(total):
+                client_id = i % options["clients"] + 1
+                event = {
+                    "type": "MARGIN_REQUEST",
+                    "client_id": client_id,
+                    "amount": 1000.0,
+                    "seq": i,
+                    "produced_at": time.perf_counter(),
+                }
+                if options["audit"]:
+                    KafkaProducerWrapper.send_event(TOPIC, key=str(client_id), event=event)
+                else:
+                    producer.send(TOPIC, key=str(client_id), value=Envelope.from_event(event, key=client_id))
+            KafkaProducerWrapper.flush()
+            produced["seconds"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        producer_thread = threading.Thread(target=produce, name="benchmark-producer")
+        producer_thread.start()
+
+        try:
+            if options["runtime"] == "batch":
+                self._consume_batch(consumer, handle_many, total)
+            elif options["runtime"] == "pool":
+                self._consume_pool(consumer, group_id, handle_one, total)
+            else:
+                self._consume_async(consumer, group_id, handle_one, total)
+        finally:
+            producer_thread.join()
+            consumer.close()
+
+        return {
+            "latencies": latencies,
+            "produce_seconds": produced["seconds"],
+            "total_seconds": time.perf_counter() - started,
+        }
+
+    @staticmethod
+    def _consume_batch(consumer, handler, total):
+        from core.consumers import process_batch
+
+        consumed = 0
+        while consumed < total:
+            consumed += process_batch(consumer, handler)
+
+    @staticmethod
+    def _consume_pool(consumer, group_id, handler, total):
+        from core.consumer_pool import PooledConsumer
+
+        runner = PooledConsumer(TOPIC, group_id, handler, consumer=consumer)
+        runner.pool.start()
+        try:
+            dispatched = 0
+            while dispatched < total:
+                dispatched += runner.poll_once()
+                runner.commit()
+            runner.pool.join()
+            runner.commit()
+        finally:
+            runner.pool.stop()
+
+    @staticmethod
+    def _consume_async(consumer, group_id, handler, total):
+        from core.async_consumers import TopicRunner
+
+        runner = TopicRunner(TOPIC, group_id, handler, consumer_factory=lambda: consumer)
+
+        async def consume():
+            runner.consumer = await runner._call(runner.consumer_factory)
+            consumed = 0
+            while consumed < total:
+                raw_messages = await runner._call(runner.consumer.poll, timeout_ms=1000)
+                if raw_messages:
+                    consumed += await runner.handle_batch(raw_messages)
+                    await runner._commit()
+
+        try:
+            asyncio.run(consume())
+        finally:
+            runner.executor.shutdown(wait=True)
@@ -1,9 +1,10 @@
-import json
 import logging
 from django.core.management.base import BaseCommand
 from kafka import KafkaConsumer
 from django.conf import settings
 
+from core.consumers import safe_deserializer
+
 logger = logging.getLogger(__name__)
 
 
@@ -34,7 +35,7 @@ class Command(BaseCommand):
             topic,
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             group_id=group_id,
-            value_deserializer=lambda m: json.loads(m.decode("utf-8")),
+            value_deserializer=safe_deserializer,  # any core.codecs envelope
             key_deserializer=lambda k: k.decode("utf-8") if k else None,
             auto_offset_reset="earliest",  # start from earliest if no offset
             enable_auto_commit=True,
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.dedupe import Deduplicator
+
+
+class Command(BaseCommand):
+    help = "Delete consumer dedupe rows older than the redelivery horizon"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help="Keep this many days (default: KAFKA_DEDUPE_RETENTION_DAYS)",
+        )
+
+    def handle(self, *args, **options):
+        deleted = Deduplicator.prune(options["days"])
+        self.stdout.write(self.style.SUCCESS(f"✅ Pruned {deleted} processed event(s)"))
@@ -0,0 +1,87 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import OutboxRelay
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Relay pending outbox events to Kafka in batches (run one relay per database)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Rows per batch (default: KAFKA_OUTBOX_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when the outbox is drained (default: 1.0)",
+        )
+        parser.add_argument(
+            "--lag-every",
+            type=float,
+            default=30.0,
+            help="Seconds between relay-lag log lines (default: 30)",
+        )
+        parser.add_argument(
+            "--requeue-parked",
+            action="store_true",
+            help="Put parked events back in the queue and exit",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the outbox once and exit",
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_parked"]:
+            requeued = OutboxRelay.requeue()
+            self.stdout.write(self.style.SUCCESS(f"✅ Requeued {requeued} parked outbox event(s)"))
+            return
+
+        relay = OutboxRelay(batch_size=options["batch_size"])
+
+        if options["once"]:
+            try:
+                sent = relay.drain()
+            finally:
+                relay.close()
+            self.stdout.write(self.style.SUCCESS(f"✅ Relayed {sent} outbox event(s)"))
+            self._log_lag()
+            return
+
+        logger.info(f"🔄 Outbox relay started (batch={relay.batch_size})")
+        last_lag = 0.0
+
+        try:
+            while True:
+                if relay.relay_batch() < relay.batch_size:
+                    time.sleep(options["interval"])
+
+                if time.monotonic() - last_lag >= options["lag_every"]:
+                    self._log_lag()
+                    last_lag = time.monotonic()
+        except KeyboardInterrupt:
+            logger.info("🛑 Outbox relay stopped manually")
+        finally:
+            relay.close()
+
+    def _log_lag(self):
+        lag = OutboxRelay.lag()
+        logger.info(
+            f"📊 Outbox lag: pending={lag['pending']} "
+            f"oldest={lag['oldest_age_seconds']:.1f}s parked={lag['parked']}"
+        )
+        if lag["parked"]:
+            logger.error(
+                f"🅿️ {lag['parked']} outbox event(s) parked: fix the cause, then "
+                f"`manage.py relay_outbox --requeue-parked`"
+            )
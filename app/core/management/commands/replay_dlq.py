@@ -0,0 +1,87 @@
+import logging
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.codecs import Envelope
+from core.consumers import CONSUMERS, create_kafka_consumer
+from core.producers import KafkaProducerWrapper
+from core.retry import dlq_topic
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Re-publish dead-lettered events to their original topic in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("consumer", nargs="?", choices=sorted(CONSUMERS))
+        parser.add_argument("--topic", help="Original topic (instead of a consumer name)")
+        parser.add_argument("--group", default="oms-dlq-replay", help="Consumer group for the DLQ")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many events")
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Summarise the DLQ without re-publishing or committing",
+        )
+
+    def handle(self, *args, **options):
+        if options["topic"]:
+            topic = options["topic"]
+        elif options["consumer"]:
+            topic = CONSUMERS[options["consumer"]][0]
+        else:
+            raise CommandError("Give a consumer name or --topic")
+
+        consumer = create_kafka_consumer(dlq_topic(topic), options["group"], enable_auto_commit=False)
+        producer = KafkaProducerWrapper.get_producer()
+        errors = Counter()
+        replayed = 0
+        limit = options["limit"]
+
+        try:
+            while limit is None or replayed < limit:
+                batch_size = options["batch_size"] if limit is None else min(options["batch_size"], limit - replayed)
+                raw_messages = consumer.poll(timeout_ms=2000, max_records=batch_size)
+                if not raw_messages:
+                    break
+
+                futures = []
+                for messages in raw_messages.values():
+                    for message in messages:
+                        event = message.value
+                        if not isinstance(event, dict):
+                            continue
+
+                        meta = event.pop("dead_letter", None) or {}
+                        errors[meta.get("error_type", "unknown")] += 1
+                        replayed += 1
+                        if options["dry_run"]:
+                            continue
+
+                        key = message.key.decode("utf-8") if isinstance(message.key, bytes) else message.key
+                        # Same event id → consumer dedupe still applies
+                        futures.append(producer.send(
+                            meta.get("original_topic", topic),
+                            key=key,
+                            value=Envelope.from_event(event, key=key),
+                        ))
+
+                if options["dry_run"]:
+                    continue
+
+                # One flush per batch; DLQ offsets only move once all are acked
+                producer.flush()
+                for future in futures:
+                    future.get(timeout=10)
+                consumer.commit()
+                logger.info(f"🔁 Replayed {len(futures)} event(s) from {dlq_topic(topic)}")
+        finally:
+            consumer.close(autocommit=False)
+            KafkaProducerWrapper.flush()
+
+        verb = "Found" if options["dry_run"] else "Replayed"
+        self.stdout.write(self.style.SUCCESS(f"✅ {verb} {replayed} dead-lettered event(s) for {topic}"))
+        for error_type, count in errors.most_common():
+            self.stdout.write(f"   {error_type}: {count}")
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from core.replay import REPLAY_TOPICS, export_events, read_file, read_topics, replay
+
+
+class Command(BaseCommand):
+    help = "Rebuild loans, positions and risk flags by replaying the event log"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--topic",
+            action="append",
+            dest="topics",
+            choices=REPLAY_TOPICS,
+            help="Topic to replay (repeatable, default: all)",
+        )
+        parser.add_argument("--file", help="Replay an exported event log instead of Kafka")
+        parser.add_argument("--from-offset", type=int, default=None, help="Start offset in every partition")
+        parser.add_argument(
+            "--from-timestamp",
+            default=None,
+            help="Start at the first event at/after this time (ISO 8601 or epoch ms)",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Events folded per write")
+        parser.add_argument("--export", help="Write the events to this file instead of applying them")
+        parser.add_argument("--dry-run", action="store_true", help="Fold and count without writing")
+
+    def handle(self, *args, **options):
+        if options["file"] and (options["topics"] or options["from_offset"] is not None):
+            raise CommandError("--file cannot be combined with --topic/--from-offset")
+        if options["from_offset"] is not None and options["from_timestamp"]:
+            raise CommandError("Give either --from-offset or --from-timestamp")
+
+        from_timestamp = self._timestamp(options["from_timestamp"])
+
+        if options["file"]:
+            batches = read_file(options["file"], from_timestamp, options["batch_size"])
+        else:
+            batches = read_topics(
+                options["topics"] or REPLAY_TOPICS,
+                from_offset=options["from_offset"],
+                from_timestamp=from_timestamp,
+                batch_size=options["batch_size"],
+            )
+
+        if options["export"]:
+            count = export_events(batches, options["export"])
+            self.stdout.write(self.style.SUCCESS(f"✅ Exported {count} event(s) to {options['export']}"))
+            return
+
+        result = replay(batches, dry_run=options["dry_run"])
+
+        verb = "Folded" if options["dry_run"] else "Replayed"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {verb} {result['events']:,} event(s) in {result['seconds']:.2f}s "
+            f"({result['events_per_second']:,.0f} events/s)"
+        ))
+        for event_type, count in sorted(result["counts"].items()):
+            self.stdout.write(f"   {event_type}: {count}")
+        for model, count in sorted(result["written"].items()):
+            self.stdout.write(f"   wrote {model}: {count}")
+
+    @staticmethod
+    def _timestamp(value):
+        """
+        ISO 8601 / epoch ms → epoch ms
+        """
+        if not value:
+            return None
+        if value.isdigit():
+            return int(value)
+        moment = parse_datetime(value)
+        if moment is None:
+            raise CommandError(f"Unreadable timestamp: {value}")
+        return int(moment.timestamp() * 1000)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.async_consumers import AsyncConsumerRuntime, TopicRunner
+from core.consumers import CONSUMERS
+from core.dedupe import Deduplicator
+
+
+class Command(BaseCommand):
+    help = "Consume several topics concurrently in one asyncio process"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "consumers",
+            nargs="*",
+            choices=sorted(CONSUMERS),
+            help="Consumers to run (default: all)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=None,
+            help="Keys handled concurrently per topic (default: KAFKA_ASYNC_CONCURRENCY)",
+        )
+
+    def handle(self, *args, **options):
+        names = options["consumers"] or sorted(CONSUMERS)
+
+        dedupe = getattr(settings, "KAFKA_CONSUMER_DEDUPE", True)
+
+        runners = []
+        for name in names:
+            topic, group_id, handler = CONSUMERS[name]
+            runners.append(TopicRunner(
+                topic,
+                group_id,
+                handler,
+                concurrency=options["concurrency"],
+                dedupe=Deduplicator(group_id) if dedupe else None,
+            ))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Starting async consumers: {', '.join(names)}")
+        )
+        AsyncConsumerRuntime(runners).start()
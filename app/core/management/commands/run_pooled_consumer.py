@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.consumer_pool import PooledConsumer
+from core.consumers import CONSUMERS
+from core.dedupe import Deduplicator
+
+
+class Command(BaseCommand):
+    help = "Consume a topic with a keyed worker pool (per-client ordering, parallel clients)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("consumer", choices=sorted(CONSUMERS))
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Worker threads (default: KAFKA_CONSUMER_WORKERS)",
+        )
+
+    def handle(self, *args, **options):
+        topic, group_id, handler = CONSUMERS[options["consumer"]]
+        dedupe = Deduplicator(group_id) if getattr(settings, "KAFKA_CONSUMER_DEDUPE", True) else None
+
+        self.stdout.write(self.style.SUCCESS(f"Starting pooled consumer for {topic}..."))
+        PooledConsumer(topic, group_id, handler, workers=options["workers"], dedupe=dedupe).run()
@@ -0,0 +1,283 @@
+# core/metrics.py
+"""
+Consumer metrics.
+
+One ConsumerMetrics per topic (consumer_metrics(topic)), updated by the
+consumer runtimes:
+
+- messages / batches / retries / dead letters (counters)
+- batch size, handler latency and commit latency (bucketed histograms)
+- per-partition lag = end offset - committed offset (refreshed from the
+  poll thread at most every KAFKA_METRICS_LAG_INTERVAL seconds)
+
+start() exposes them as a periodic stats log line (KAFKA_METRICS_INTERVAL)
+and, when KAFKA_METRICS_PORT is set, a Prometheus text endpoint at
+/metrics served from a daemon thread of the consumer process.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BATCH_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot: +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-quantile
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class ConsumerMetrics:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.monotonic()
+        self.counters = Counter()
+        self.batch_size = Histogram(BATCH_BUCKETS)
+        self.handler_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.commit_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.lag = {}                 # partition → messages behind
+        self._lag_checked = 0.0
+        self._lock = threading.Lock()
+
+    # ------------------------------
+    # RECORDING
+    # ------------------------------
+    def inc(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def observe_batch(self, size: int):
+        with self._lock:
+            self.counters["messages"] += size
+            self.counters["batches"] += 1
+            self.batch_size.observe(size)
+
+    @contextmanager
+    def time_handler(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.handler_ms.observe(elapsed)
+
+    @contextmanager
+    def time_commit(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.commit_ms.observe(elapsed)
+
+    def update_lag(self, consumer, force: bool = False):
+        """
+        Refresh partition lag (call from the thread that owns the consumer)
+        """
+        now = time.monotonic()
+        if not force and now - self._lag_checked < getattr(settings, "KAFKA_METRICS_LAG_INTERVAL", 10):
+            return
+        self._lag_checked = now
+
+        try:
+            assigned = list(consumer.assignment())
+            if not assigned:
+                return
+            ends = consumer.end_offsets(assigned)
+            lag = {}
+            for tp in assigned:
+                committed = consumer.committed(tp)
+                committed = getattr(committed, "offset", committed) or 0
+                lag[tp.partition] = max(0, ends.get(tp, 0) - committed)
+        except Exception as e:
+            logger.debug(f"Lag refresh failed for {self.name}: {e}")
+            return
+
+        with self._lock:
+            self.lag = lag
+
+    # ------------------------------
+    # EXPORT
+    # ------------------------------
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "consumer": self.name,
+                "uptime_seconds": time.monotonic() - self.started,
+                "counters": dict(self.counters),
+                "batch_size": self.batch_size.snapshot(),
+                "handler_ms": self.handler_ms.snapshot(),
+                "commit_ms": self.commit_ms.snapshot(),
+                "lag": dict(self.lag),
+                "total_lag": sum(self.lag.values()),
+            }
+
+    def prometheus_lines(self) -> list:
+        label = f'consumer="{self.name}"'
+        lines = []
+
+        with self._lock:
+            for counter, value in sorted(self.counters.items()):
+                lines.append(f"oms_consumer_{counter}_total{{{label}}} {value}")
+
+            for metric, histogram in (
+                ("batch_size", self.batch_size),
+                ("handler_latency_ms", self.handler_ms),
+                ("commit_latency_ms", self.commit_ms),
+            ):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'oms_consumer_{metric}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f"oms_consumer_{metric}_sum{{{label}}} {histogram.sum}")
+                lines.append(f"oms_consumer_{metric}_count{{{label}}} {histogram.count}")
+
+            for partition, lag in sorted(self.lag.items()):
+                lines.append(f'oms_consumer_lag{{{label},partition="{partition}"}} {lag}')
+
+        return lines
+
+
+# ------------------------------
+# REGISTRY
+# ------------------------------
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def consumer_metrics(name: str) -> ConsumerMetrics:
+    metrics = _registry.get(name)
+    if metrics is None:
+        with _registry_lock:
+            metrics = _registry.setdefault(name, ConsumerMetrics(name))
+    return metrics
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metrics in list(_registry.values()):
+        lines.extend(metrics.prometheus_lines())
+    return "\n".join(lines) + "\n"
+
+
+class LogSampler:
+    """
+    True for one call in every `every` (per-message debug logging)
+    """
+
+    def __init__(self, every: int | None = None):
+        self.every = max(1, every or getattr(settings, "KAFKA_LOG_SAMPLE_RATE", 1000))
+        self._calls = 0
+
+    def __call__(self) -> bool:
+        self._calls += 1
+        return self._calls % self.every == 1 or self.every == 1
+
+
+# ------------------------------
+# EXPOSITION
+# ------------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _report_forever(interval: float):
+    previous = {}
+    while True:
+        time.sleep(interval)
+        for metrics in list(_registry.values()):
+            stats = metrics.snapshot()
+            messages = stats["counters"].get("messages", 0)
+            rate = (messages - previous.get(metrics.name, 0)) / interval
+            previous[metrics.name] = messages
+            logger.info(
+                f"📊 {metrics.name}: {rate:,.0f} msg/s, "
+                f"batch p50={stats['batch_size']['p50']:.0f}, "
+                f"handler p95={stats['handler_ms']['p95']:.0f}ms, "
+                f"commit p95={stats['commit_ms']['p95']:.0f}ms, "
+                f"lag={stats['total_lag']}, "
+                f"retries={stats['counters'].get('retries', 0)}, "
+                f"dead_letters={stats['counters'].get('dead_letters', 0)}"
+            )
+
+
+_started = False
+
+
+def start():
+    """
+    Start the stats dump / scrape endpoint once per process (per settings)
+    """
+    global _started
+    with _registry_lock:
+        if _started:
+            return
+        _started = True
+
+    interval = getattr(settings, "KAFKA_METRICS_INTERVAL", 60)
+    if interval:
+        threading.Thread(
+            target=_report_forever, args=(interval,), name="consumer-metrics", daemon=True
+        ).start()
+
+    port = getattr(settings, "KAFKA_METRICS_PORT", None)
+    if port:
+        server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"📊 Consumer metrics on :{port}/metrics")
@@ -1,6 +1,146 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least, Round
 from decimal import Decimal, ROUND_HALF_UP
 
+from risk.constants import UTILIZATION_LEVELS
+
+
+# ======================================================
+# SQL EXPOSURE EXPRESSIONS
+# ======================================================
+
+RATE_FIELD = models.DecimalField(max_digits=5, decimal_places=2)
+MONEY_FIELD = models.DecimalField(max_digits=20, decimal_places=2)
+
+ZERO = Value(Decimal("0.00"), output_field=MONEY_FIELD)
+
+
+def effective_margin_rate_expression(prefix: str = ""):
+    """
+    SQL mirror of Instrument.effective_margin_rate()
+    (prefix = lookup path to the instrument, e.g. "instrument__")
+    """
+
+    return Case(
+        When(Q(**{f"{prefix}is_marginable": False}), then=Value(Decimal("0.00"))),
+        When(Q(**{f"{prefix}board": "Z"}), then=Value(Decimal("0.00"))),
+        When(
+            Q(**{f"{prefix}board": "B"}),
+            then=Round(F(f"{prefix}margin_rate") * Value(Decimal("0.75")), 2),
+        ),
+        default=F(f"{prefix}margin_rate"),
+        output_field=RATE_FIELD,
+    )
+
+
+def applied_margin_rate_expression(instrument_prefix: str, leverage_path: str):
+    """
+    min(board_rate, client_leverage); blocked instruments have board_rate 0,
+    so they contribute nothing without a second CASE
+    """
+
+    return Least(
+        effective_margin_rate_expression(instrument_prefix),
+        F(leverage_path),
+        output_field=RATE_FIELD,
+    )
+
+
+class PortfolioQuerySet(models.QuerySet):
+
+    def with_margin_exposure(self):
+        """
+        Annotate effective_rate, applied_rate and margin_exposure
+        (quantity × avg_price × applied_rate) per row
+        """
+
+        return self.annotate(
+            effective_rate=effective_margin_rate_expression("instrument__"),
+            applied_rate=applied_margin_rate_expression(
+                "instrument__", "client__risk_profile__leverage_multiplier"
+            ),
+            margin_exposure=Round(
+                F("quantity") * F("avg_price") * F("applied_rate"),
+                2,
+                output_field=MONEY_FIELD,
+            ),
+        )
+
+    def used_exposure(self) -> Decimal:
+        """
+        Σ margin exposure over the queryset, in one aggregate query
+        """
+
+        total = self.aggregate(
+            used=Coalesce(
+                Sum(
+                    F("quantity") * F("avg_price") * applied_margin_rate_expression(
+                        "instrument__", "client__risk_profile__leverage_multiplier"
+                    ),
+                    output_field=MONEY_FIELD,
+                ),
+                ZERO,
+            )
+        )["used"]
+
+        return total.quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+
+class ClientQuerySet(models.QuerySet):
+
+    def with_risk_metrics(self):
+        """
+        Annotate used_exposure, loan_amount, edr_percent and edr_status
+        in a single aggregate query (clients need a risk_profile).
+
+        Rounding happens in SQL (half away from zero), so edr_percent can
+        differ from RiskEngine by 0.01 on exact ties.
+        """
+
+        used = Round(
+            Coalesce(
+                Sum(
+                    F("portfolios__quantity")
+                    * F("portfolios__avg_price")
+                    * applied_margin_rate_expression(
+                        "portfolios__instrument__", "risk_profile__leverage_multiplier"
+                    ),
+                    output_field=MONEY_FIELD,
+                ),
+                ZERO,
+            ),
+            2,
+            output_field=MONEY_FIELD,
+        )
+
+        return self.annotate(
+            used_exposure=used,
+        ).annotate(
+            loan_amount=Greatest(
+                F("used_exposure") - F("cash_balance"),
+                ZERO,
+                output_field=MONEY_FIELD,
+            ),
+            edr_percent=Case(
+                When(risk_profile__max_exposure=0, then=ZERO),
+                default=Round(
+                    F("used_exposure") * Value(Decimal("100")) / F("risk_profile__max_exposure"),
+                    2,
+                ),
+                output_field=MONEY_FIELD,
+            ),
+        ).annotate(
+            edr_status=Case(
+                When(edr_percent__lt=UTILIZATION_LEVELS["SAFE"], then=Value("SAFE")),
+                When(edr_percent__lt=UTILIZATION_LEVELS["WARNING"], then=Value("WARNING")),
+                When(edr_percent__lt=UTILIZATION_LEVELS["MARGIN_CALL"], then=Value("MARGIN_CALL")),
+                default=Value("FORCE_SELL"),
+                output_field=models.CharField(),
+            ),
+        )
+
 
 # ======================================================
 # INSTRUMENT
@@ -82,6 +222,8 @@ class Client(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ClientQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -113,8 +255,14 @@ class Portfolio(models.Model):
         default=Decimal("0.0000"),
     )
 
+    objects = PortfolioQuerySet.as_manager()
+
     class Meta:
         unique_together = ("client", "instrument")
+        indexes = [
+            # instrument → holders (risk.services.holders)
+            models.Index(fields=["instrument", "client"], name="portfolio_holders_idx"),
+        ]
 
     # --------------------------------------
     # MARKET VALUE
@@ -214,7 +362,8 @@ class AuditLog(models.Model):
         related_name="audit_logs",
     )
 
-    details = models.JSONField(null=True, blank=True)
+    # Events carry Decimal / datetime values (see core.codecs)
+    details = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
     created_at = models.DateTimeField(auto_now_add=True)
 
     @classmethod
@@ -228,3 +377,61 @@ class AuditLog(models.Model):
 
     def __str__(self):
         return f"{self.event_type} @ {self.created_at}"
+
+
+# ======================================================
+# OUTBOX (events written with the business change)
+# ======================================================
+
+class OutboxEvent(models.Model):
+    topic = models.CharField(max_length=100)
+    key = models.CharField(max_length=100, null=True, blank=True)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    # Payload fields that were Decimals (stored as str, restored on relay)
+    decimals = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    # Set after KAFKA_OUTBOX_MAX_ATTEMPTS failures; the relay skips it
+    parked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Relay scan: unsent rows in id order
+            models.Index(
+                fields=["id"],
+                name="outbox_pending_idx",
+                condition=Q(sent_at__isnull=True, parked_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        state = "sent" if self.sent_at else "parked" if self.parked_at else "pending"
+        return f"Outbox({self.topic}, {self.payload.get('type')}, {state})"
+
+
+# ======================================================
+# PROCESSED EVENTS (consumer dedupe seen-set)
+# ======================================================
+
+class ProcessedEvent(models.Model):
+    group = models.CharField(max_length=100)
+    event_id = models.CharField(max_length=255)
+    processed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # A concurrent duplicate fails its whole batch, which is then
+            # redelivered and skipped
+            models.UniqueConstraint(fields=["group", "event_id"], name="processed_event_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["processed_at"], name="processed_event_age_idx"),
+        ]
+
+    def __str__(self):
+        return f"Processed({self.group}, {self.event_id})"
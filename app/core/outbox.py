@@ -0,0 +1,256 @@
+# core/outbox.py
+"""
+Transactional outbox.
+
+enqueue() writes the event as an OutboxEvent row in the caller's
+transaction, so an event exists exactly when the business change that
+produced it was committed. OutboxRelay (manage.py relay_outbox) drains
+unsent rows in large batches through a lingering, compressed producer
+and marks them sent in bulk. Inside `with enqueue_batch():` the rows
+are collected and written with one bulk insert at the end of the block.
+
+Delivery is at-least-once: a relay that dies between the broker ack and
+the bulk update re-sends that batch.
+
+Per-key order is kept:
+
+- the producer is idempotent with one request in flight per connection,
+  so the broker appends a batch in send order, retries included
+- a batch is sent whole and flushed once; results are read in id order
+  and a key stops at its first failure: its later rows stay pending and
+  are retried behind it (in id order) by the next batch
+- after KAFKA_OUTBOX_MAX_ATTEMPTS failures the row is parked: the relay
+  skips it, lag() reports it and requeue() puts it back
+
+Run ONE relay. Rows are locked without SKIP LOCKED, so a second relay
+blocks on the first one's batch and only takes over when it stops (hot
+standby); it never sends rows of a key concurrently.
+
+Payloads are stored as JSON with their Decimal fields listed (the same
+convention as core.codecs), so relayed events carry the same field
+types as directly published ones.
+"""
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from core.codecs import Envelope, _restore_decimals, _split_decimals, encode
+from core.kafka_transport import make_producer
+from core.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+_batch: ContextVar["list | None"] = ContextVar("outbox_batch", default=None)
+
+
+def enqueue(topic: str, key: str | None, event: dict) -> OutboxEvent:
+    """
+    Record an event for the relay (call inside the business transaction)
+    """
+    payload, decimals = _split_decimals(event)
+    row = OutboxEvent(topic=topic, key=key, payload=payload, decimals=decimals)
+
+    batch = _batch.get()
+    if batch is not None:
+        batch.append(row)
+    else:
+        row.save()
+    return row
+
+
+@contextmanager
+def enqueue_batch():
+    """
+    Write every enqueue() in the block with one bulk insert at its end
+    (nested blocks join the outer one). Use it inside the transaction
+    as a whole: nothing is written if the block raises.
+    """
+    if _batch.get() is not None:
+        yield
+        return
+
+    rows = []
+    token = _batch.set(rows)
+    try:
+        yield
+    finally:
+        _batch.reset(token)
+
+    if rows:
+        OutboxEvent.objects.bulk_create(rows, batch_size=1000)
+
+
+class OutboxRelay:
+
+    def __init__(self, batch_size: int | None = None, producer=None):
+        self.batch_size = batch_size or getattr(settings, "KAFKA_OUTBOX_BATCH_SIZE", 5000)
+        self._producer = producer
+
+    @property
+    def producer(self):
+        if self._producer is None:
+            self._producer = make_producer(
+                bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                value_serializer=encode,
+                key_serializer=lambda k: str(k).encode("utf-8") if k else None,
+                acks="all",
+                retries=3,
+                # Broker-side dedupe of retries, and no reordering behind one
+                enable_idempotence=True,
+                max_in_flight_requests_per_connection=1,
+                # Fill large batches instead of one request per event
+                linger_ms=getattr(settings, "KAFKA_OUTBOX_LINGER_MS", 50),
+                batch_size=getattr(settings, "KAFKA_OUTBOX_PRODUCER_BATCH_BYTES", 256 * 1024),
+                compression_type=getattr(settings, "KAFKA_OUTBOX_COMPRESSION", "gzip"),
+            )
+            logger.info("✅ Outbox relay producer initialized")
+        return self._producer
+
+    @staticmethod
+    def _envelope(row: OutboxEvent) -> Envelope:
+        # Event time is when the business change committed, not relay time;
+        # the id survives re-sends of the same row (consumer dedupe)
+        return Envelope.from_event(
+            _restore_decimals(dict(row.payload), row.decimals),
+            key=row.key,
+            timestamp=int(row.created_at.timestamp() * 1000),
+            event_id=f"outbox:{row.id}",
+        )
+
+    # ------------------------------
+    # RELAY
+    # ------------------------------
+    def relay_batch(self) -> int:
+        """
+        Send one batch of pending rows; returns how many were sent.
+        Rows stay locked until the batch is marked, so a second relay waits.
+        """
+        with transaction.atomic():
+            rows = list(
+                OutboxEvent.objects
+                .select_for_update()
+                .filter(sent_at__isnull=True, parked_at__isnull=True)
+                .order_by("id")[:self.batch_size]
+            )
+            if not rows:
+                return 0
+
+            sent, failed = self._send(rows)
+
+            if sent:
+                OutboxEvent.objects.filter(id__in=sent).update(sent_at=timezone.now())
+
+            if failed:
+                self._record_failures(failed)
+
+        logger.info(f"📤 Outbox relay sent {len(sent)} event(s)")
+        return len(sent)
+
+    def _send(self, rows) -> tuple[list, list]:
+        """
+        Send the whole batch, flush once, then read the results in id
+        order: a key stops at its first failure and its later rows are
+        neither marked sent nor failed. Returns (sent ids, failed rows).
+        """
+        futures = []
+        for row in rows:
+            try:
+                future = self.producer.send(row.topic, key=row.key, value=self._envelope(row))
+            except Exception as e:
+                future = e
+            futures.append((row, future))
+        self.producer.flush()
+
+        sent, failed, stopped = [], [], set()
+        for row, future in futures:
+            # Keyless rows have no order to keep
+            ordering = (row.topic, row.key) if row.key else None
+            if ordering in stopped:
+                continue
+            try:
+                if isinstance(future, Exception):
+                    raise future
+                future.get(timeout=0)
+                sent.append(row.id)
+            except Exception as e:
+                row.last_error = str(e)[:1000]
+                failed.append(row)
+                if ordering is not None:
+                    stopped.add(ordering)
+
+        return sent, failed
+
+    @staticmethod
+    def _record_failures(failed):
+        max_attempts = getattr(settings, "KAFKA_OUTBOX_MAX_ATTEMPTS", 10)
+        now = timezone.now()
+
+        parked = []
+        for row in failed:
+            # Row is locked: the in-memory count is current
+            row.attempts += 1
+            if row.attempts >= max_attempts:
+                row.parked_at = now
+                parked.append(row)
+
+        OutboxEvent.objects.bulk_update(failed, ["attempts", "last_error", "parked_at"])
+        logger.error(f"❌ Outbox relay: {len(failed)} event(s) failed, will retry")
+
+        for row in parked:
+            logger.error(
+                f"🅿️ Outbox event {row.id} ({row.topic}, key={row.key}) parked after "
+                f"{row.attempts} attempt(s): {row.last_error}"
+            )
+
+    def drain(self) -> int:
+        """
+        Relay until no pending rows are left (or a batch fully fails)
+        """
+        total = 0
+        while True:
+            sent = self.relay_batch()
+            total += sent
+            if sent < self.batch_size:
+                return total
+
+    def close(self):
+        if self._producer is not None:
+            self._producer.close()
+            self._producer = None
+
+    # ------------------------------
+    # LAG
+    # ------------------------------
+    @staticmethod
+    def lag() -> dict:
+        """
+        Pending rows, the age (seconds) of the oldest one and parked rows
+        """
+        stats = OutboxEvent.objects.filter(sent_at__isnull=True).aggregate(
+            pending=Count("id", filter=Q(parked_at__isnull=True)),
+            oldest=Min("created_at", filter=Q(parked_at__isnull=True)),
+            parked=Count("id", filter=Q(parked_at__isnull=False)),
+        )
+
+        oldest = stats["oldest"]
+        return {
+            "pending": stats["pending"],
+            "oldest_age_seconds": (
+                (timezone.now() - oldest).total_seconds() if oldest else 0.0
+            ),
+            "parked": stats["parked"],
+        }
+
+    @staticmethod
+    def requeue(ids=None) -> int:
+        """
+        Put parked rows (all, or only ids) back in the relay's queue
+        """
+        parked = OutboxEvent.objects.filter(sent_at__isnull=True, parked_at__isnull=False)
+        if ids is not None:
+            parked = parked.filter(id__in=ids)
+        return parked.update(parked_at=None, attempts=0)
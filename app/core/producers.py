@@ -1,41 +1,85 @@
 
-import json
+import atexit
 import logging
-from kafka import KafkaProducer
+import threading
 from django.conf import settings
-from core.models import AuditLog, Client, MarginLoan
+from django.db import transaction
+from core import events as event_types
+from core.codecs import Envelope, encode
+from core.kafka_transport import make_producer
+from core.models import AuditLog, Client, MarginLoan, Portfolio
 
 logger = logging.getLogger(__name__)
 
 
 class KafkaProducerWrapper:
-    """Singleton Kafka Producer Wrapper"""
+    """Singleton Kafka Producer Wrapper
+
+    KAFKA_PUBLISH_MODE = "sync"  → send_event waits for the broker ack
+    KAFKA_PUBLISH_MODE = "async" → send_event returns once the record is
+    queued; delivery is reported through callbacks and at most
+    KAFKA_MAX_IN_FLIGHT records may be unacknowledged at a time
+    """
 
     _producer = None
+    _lock = threading.Lock()
+    _in_flight = None
 
     @classmethod
     def get_producer(cls):
         if cls._producer is None:
-            try:
-                cls._producer = KafkaProducer(
-                    bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-                    value_serializer=lambda v: json.dumps(v).encode("utf-8"),
-                    key_serializer=lambda k: str(k).encode("utf-8") if k else None,
-                    acks="all",  # ✅ safer delivery
-                    retries=3,   # ✅ auto retry
-                )
-                logger.info("✅ Kafka Producer initialized")
-            except Exception as e:
-                logger.error(f"❌ Failed to initialize Kafka Producer: {e}")
-                raise
+            with cls._lock:
+                if cls._producer is None:
+                    try:
+                        cls._producer = make_producer(
+                            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                            value_serializer=encode,  # KAFKA_EVENT_CODEC envelope
+                            key_serializer=lambda k: str(k).encode("utf-8") if k else None,
+                            acks="all",  # ✅ safer delivery
+                            retries=3,   # ✅ auto retry
+                        )
+                        logger.info("✅ Kafka Producer initialized")
+                    except Exception as e:
+                        logger.error(f"❌ Failed to initialize Kafka Producer: {e}")
+                        raise
         return cls._producer
 
     @classmethod
-    def send_event(cls, topic: str, key: str, event: dict, client=None, loan=None):
-        """Send event to Kafka and log to AuditLog"""
+    def is_async(cls) -> bool:
+        return getattr(settings, "KAFKA_PUBLISH_MODE", "sync") == "async"
+
+    @classmethod
+    def _in_flight_slots(cls):
+        if cls._in_flight is None:
+            with cls._lock:
+                if cls._in_flight is None:
+                    cls._in_flight = threading.BoundedSemaphore(
+                        getattr(settings, "KAFKA_MAX_IN_FLIGHT", 1000)
+                    )
+        return cls._in_flight
+
+    @classmethod
+    def send_event(
+        cls,
+        topic: str,
+        key: str,
+        event: dict,
+        client=None,
+        loan=None,
+        on_delivery=None,
+        on_error=None,
+    ):
+        """Send event to Kafka and log to AuditLog
+
+        on_delivery(metadata) / on_error(exc) are called from the producer
+        I/O thread in async mode, and inline in sync mode.
+        """
+        if cls.is_async():
+            return cls._send_async(topic, key, event, client, loan, on_delivery, on_error)
+
         try:
             producer = cls.get_producer()
-            future = producer.send(topic, key=key, value=event)
+            future = producer.send(topic, key=key, value=Envelope.from_event(event, key=key))
             result = future.get(timeout=10)  # wait for ack
 
             logger.info(
@@ -50,11 +94,96 @@ class KafkaProducerWrapper:
                 details=event,
             )
 
+            if on_delivery:
+                on_delivery(result)
+
             return True
         except Exception as e:
             logger.error(f"❌ Kafka send_event error: {e} | topic={topic} | event={event}")
+            if on_error:
+                on_error(e)
+            return False
+
+    @classmethod
+    def _send_async(cls, topic, key, event, client, loan, on_delivery, on_error):
+        slots = cls._in_flight_slots()
+
+        # Bounded in-flight queue: wait briefly for a slot, never forever
+        timeout = getattr(settings, "KAFKA_IN_FLIGHT_TIMEOUT", 5)
+        if not slots.acquire(timeout=timeout):
+            logger.error(f"❌ Kafka in-flight limit reached | topic={topic} | event={event}")
+            if on_error:
+                on_error(BufferError("Kafka in-flight limit reached"))
+            return False
+
+        def _delivered(metadata):
+            slots.release()
+            logger.debug(
+                f"📤 Delivered event to {topic} | partition={metadata.partition} offset={metadata.offset}"
+            )
+            if on_delivery:
+                on_delivery(metadata)
+
+        def _failed(exc):
+            slots.release()
+            logger.error(f"❌ Kafka delivery failed: {exc} | topic={topic} | event={event}")
+            if on_error:
+                on_error(exc)
+
+        try:
+            future = cls.get_producer().send(topic, key=key, value=Envelope.from_event(event, key=key))
+        except Exception as e:
+            slots.release()
+            logger.error(f"❌ Kafka send_event error: {e} | topic={topic} | event={event}")
+            if on_error:
+                on_error(e)
             return False
 
+        future.add_callback(_delivered)
+        future.add_errback(_failed)
+
+        # Audit the publish from the calling thread (callbacks run on the
+        # producer I/O thread, which must not touch the DB)
+        AuditLog.log_event(
+            event_type=event.get("type"),
+            client=client,
+            loan=loan,
+            details=event,
+        )
+
+        return True
+
+    @classmethod
+    def publish_on_commit(cls, topic: str, key: str, event: dict, client=None, loan=None, **kwargs):
+        """Publish once the surrounding transaction commits
+        (immediately in autocommit; never for rolled-back writes)
+
+        With KAFKA_OUTBOX_ENABLED the event is written to the outbox in
+        the current transaction instead and sent by the outbox relay.
+        """
+        if getattr(settings, "KAFKA_OUTBOX_ENABLED", False):
+            from core.outbox import enqueue
+
+            enqueue(topic, key, event)
+            AuditLog.log_event(
+                event_type=event.get("type"),
+                client=client,
+                loan=loan,
+                details=event,
+            )
+            return True
+
+        transaction.on_commit(
+            lambda: cls.send_event(topic, key, event, client=client, loan=loan, **kwargs)
+        )
+        return True
+
+    @classmethod
+    def flush(cls, timeout: float | None = None):
+        """Block until every queued record is acknowledged or failed"""
+        if cls._producer:
+            cls._producer.flush(timeout=timeout)
+
     @classmethod
     def close(cls):
         if cls._producer:
@@ -68,28 +197,110 @@ class KafkaProducerWrapper:
                 cls._producer = None
 
 
+# Flush queued async records on interpreter shutdown
+atexit.register(KafkaProducerWrapper.close)
+
+
 # Example event helpers
-def publish_margin_request(client_id: int, amount: float, loan: MarginLoan = None):
+# on_commit=True publishes transactionally (outbox or after commit)
+def publish_margin_request(client_id: int, amount: float, loan: MarginLoan = None, on_commit: bool = False):
     event = {
         "type": "MARGIN_REQUEST",
         "client_id": client_id,
         "amount": amount,
     }
+    if loan is not None:
+        event["loan_id"] = loan.id
+        event["interest_rate"] = loan.interest_rate
+        event["created_at"] = loan.created_at.isoformat() if loan.created_at else None
     client = Client.objects.filter(id=client_id).first()
+    publish = KafkaProducerWrapper.publish_on_commit if on_commit else KafkaProducerWrapper.send_event
     # Change from margin-loan-events to margin_requests
-    return KafkaProducerWrapper.send_event(
+    return publish(
         "margin-loan-events", key=str(client_id), event=event, client=client, loan=loan
     )
 
-def publish_forced_sell(client_id: int, portfolio_id: int, reason: str):
+def publish_forced_sell(
+    client_id: int, portfolio_id: int, reason: str, on_commit: bool = False, quantity=None
+):
     event = {
         "type": "FORCED_SELL",
         "client_id": client_id,
         "portfolio_id": portfolio_id,
         "reason": reason,
     }
+    if quantity is not None:
+        # Remaining quantity (absolute, so replaying the event is idempotent)
+        event["quantity"] = quantity
     client = Client.objects.filter(id=client_id).first()
+    publish = KafkaProducerWrapper.publish_on_commit if on_commit else KafkaProducerWrapper.send_event
     # Change from portfolio-events to portfolio_events
-    return KafkaProducerWrapper.send_event(
+    return publish(
         "portfolio-events", key=str(client_id), event=event, client=client
-    )
\ No newline at end of file
+    )
+
+
+# State events: absolute row values, so the log can rebuild positions and
+# loans (core.replay). They go through the outbox only: an insert in the
+# caller's transaction, never a broker round trip on the request path, and
+# no AuditLog row. Without KAFKA_OUTBOX_ENABLED they are not published.
+def _publish_state(topic: str, key: str, event: dict) -> bool:
+    if not getattr(settings, "KAFKA_OUTBOX_ENABLED", False):
+        return False
+
+    from core.outbox import enqueue
+
+    enqueue(topic, key, event)
+    return True
+
+def publish_position_updated(portfolio: Portfolio, **fields):
+    """fields: the changed values, default every position field"""
+    event = {
+        "type": event_types.POSITION_UPDATED,
+        "client_id": portfolio.client_id,
+        "portfolio_id": portfolio.id,
+        "instrument_id": portfolio.instrument_id,
+    }
+    event.update(fields or {
+        "quantity": portfolio.quantity,
+        "avg_price": portfolio.avg_price,
+        "pledged_quantity": portfolio.pledged_quantity,
+    })
+    return _publish_state("portfolio-events", key=str(portfolio.client_id), event=event)
+
+def publish_position_closed(portfolio: Portfolio):
+    event = {
+        "type": event_types.POSITION_CLOSED,
+        "client_id": portfolio.client_id,
+        "portfolio_id": portfolio.id,
+        "instrument_id": portfolio.instrument_id,
+    }
+    return _publish_state("portfolio-events", key=str(portfolio.client_id), event=event)
+
+def publish_loan_updated(loan: MarginLoan):
+    event = {
+        "type": event_types.LOAN_UPDATED,
+        "client_id": loan.client_id,
+        "loan_id": loan.id,
+        "amount": loan.loan_amount,
+        "interest_rate": loan.interest_rate,
+    }
+    return _publish_state("margin-loan-events", key=str(loan.client_id), event=event)
+
+def publish_loan_closed(loan: MarginLoan):
+    event = {
+        "type": event_types.LOAN_CLOSED,
+        "client_id": loan.client_id,
+        "loan_id": loan.id,
+    }
+    return _publish_state("margin-loan-events", key=str(loan.client_id), event=event)
+
+def publish_margin_policy_changed(client_id: int, allow_margin: bool, reason: str):
+    """reason: the audit event that switched it (e.g. MARGIN_CALL_TRIGGERED)"""
+    event = {
+        "type": event_types.MARGIN_POLICY_CHANGED,
+        "client_id": client_id,
+        "allow_margin": allow_margin,
+        "reason": reason,
+    }
+    return _publish_state("margin-loan-events", key=str(client_id), event=event)
@@ -0,0 +1,414 @@
+# core/replay.py
+"""
+Rebuild margin state from the event log (catch-up after a restore).
+
+Events are folded in memory, last write wins per row, and each batch is
+written with one bulk upsert per model:
+
+- MARGIN_REQUEST with a loan_id, LOAN_CREATED,
+  LOAN_UPDATED / LOAN_CLOSED                    → MarginLoan
+- POSITION_UPDATED / POSITION_CLOSED           → Portfolio
+- FORCED_SELL with a quantity                   → Portfolio.quantity
+- MARGIN_POLICY_CHANGED                         → ClientRiskProfile.allow_margin
+
+The MarginLoan and Portfolio signals (core.signals) publish the loan and
+position events on every save / delete, LiquidationPlanner.execute
+publishes its bulk quantity changes and RiskEngine publishes every
+allow_margin switch. These state events go through the outbox only
+(KAFKA_OUTBOX_ENABLED).
+
+Rows are seeded from the database, so a replay only has to cover the
+events after the restore point and partial events (e.g. a FORCED_SELL
+carrying only the remaining quantity) patch the restored row. Every
+fold sets absolute values, so replaying an event twice is harmless.
+
+Bulk writes skip model signals and deletes run under
+core.signals.replaying(): nothing is re-published and the exposure ledger
+and risk context are invalidated for the touched clients afterwards.
+"""
+import logging
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from kafka.structs import TopicPartition
+
+from core import events as event_types
+from core.codecs import Envelope, decode, encode
+from core.kafka_transport import make_consumer
+from core.models import Client, Instrument, MarginLoan, Portfolio
+from core.signals import replaying
+from risk.models import ClientRiskProfile
+from risk.services.context import invalidate_risk_context
+from risk.services.exposure_ledger import exposure_ledger
+
+logger = logging.getLogger(__name__)
+
+REPLAY_TOPICS = ("margin-loan-events", "portfolio-events")
+
+POSITION_FIELDS = ("quantity", "avg_price", "pledged_quantity")
+
+
+def _decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def _datetime(value):
+    return parse_datetime(value) if isinstance(value, str) else value
+
+
+class StateFold:
+    """
+    One batch of folded events: the latest known fields per row
+    """
+
+    def __init__(self):
+        self.loans = {}          # loan_id → {field: value}, None = closed
+        self.positions = {}      # portfolio_id → {field: value}, None = closed
+        self.margin = {}         # client_id → allow_margin
+        self.events = 0
+        self.counts = Counter()  # per event type (+ "skipped")
+
+    def __len__(self):
+        return self.events
+
+    # ------------------------------
+    # FOLD
+    # ------------------------------
+    def apply(self, event: dict):
+        self.events += 1
+        fold = self._FOLDS.get(event.get("type"))
+        try:
+            applied = fold is not None and fold(self, event)
+        except (TypeError, ValueError, ArithmeticError) as e:
+            logger.debug(f"Unreadable {event.get('type')} event {event.get('event_id')}: {e}")
+            applied = False
+        self.counts[event.get("type") if applied else "skipped"] += 1
+
+    def _loan(self, event: dict) -> bool:
+        loan_id = event.get("loan_id")
+        if not loan_id:
+            return False
+
+        fields = self.loans.get(int(loan_id)) or {}
+        self.loans[int(loan_id)] = fields
+        if event.get("client_id") is not None:
+            fields["client_id"] = int(event["client_id"])
+        if event.get("amount") is not None:
+            fields["loan_amount"] = _decimal(event["amount"])
+        if event.get("interest_rate") is not None:
+            fields["interest_rate"] = _decimal(event["interest_rate"])
+        if event.get("created_at"):
+            fields["created_at"] = _datetime(event["created_at"])
+        return True
+
+    def _loan_closed(self, event: dict) -> bool:
+        loan_id = event.get("loan_id")
+        if not loan_id:
+            return False
+        self.loans[int(loan_id)] = None
+        return True
+
+    def _position(self, event: dict, **fields) -> bool:
+        portfolio_id = event.get("portfolio_id")
+        if not portfolio_id:
+            return False
+
+        # A re-opened position starts from the event, not the closed row
+        current = self.positions.get(int(portfolio_id)) or {}
+        for name in ("client_id", "instrument_id"):
+            if event.get(name) is not None:
+                current[name] = int(event[name])
+        current.update(fields)
+        self.positions[int(portfolio_id)] = current
+        return True
+
+    def _position_updated(self, event: dict) -> bool:
+        return self._position(event, **{
+            name: _decimal(event[name]) for name in POSITION_FIELDS if event.get(name) is not None
+        })
+
+    def _position_closed(self, event: dict) -> bool:
+        portfolio_id = event.get("portfolio_id")
+        if not portfolio_id:
+            return False
+        self.positions[int(portfolio_id)] = None
+        return True
+
+    def _forced_sell(self, event: dict) -> bool:
+        if event.get("quantity") is None:
+            return False
+        return self._position(event, quantity=_decimal(event["quantity"]))
+
+    def _margin_policy(self, event: dict) -> bool:
+        if not event.get("client_id") or not isinstance(event.get("allow_margin"), bool):
+            return False
+        self.margin[int(event["client_id"])] = event["allow_margin"]
+        return True
+
+    _FOLDS = {
+        event_types.LOAN_CREATED: _loan,
+        event_types.MARGIN_REQUEST: _loan,
+        event_types.LOAN_UPDATED: _loan,
+        event_types.LOAN_CLOSED: _loan_closed,
+        event_types.POSITION_UPDATED: _position_updated,
+        event_types.POSITION_CLOSED: _position_closed,
+        event_types.FORCED_SELL: _forced_sell,
+        event_types.MARGIN_POLICY_CHANGED: _margin_policy,
+    }
+
+    # ------------------------------
+    # WRITE
+    # ------------------------------
+    @transaction.atomic
+    def flush(self) -> Counter:
+        """
+        Upsert the folded rows (one transaction per batch)
+        """
+        written = Counter()
+        client_ids = (
+            {f["client_id"] for f in self.loans.values() if f and "client_id" in f}
+            | {f["client_id"] for f in self.positions.values() if f and "client_id" in f}
+        )
+        known_clients = set(
+            Client.objects.filter(id__in=client_ids).values_list("id", flat=True)
+        ) if client_ids else set()
+
+        touched = set()
+        with replaying():
+            touched |= self._write_loans(known_clients, written)
+            touched |= self._write_positions(known_clients, written)
+
+        # One update per value
+        for allow in (True, False):
+            client_ids = [c for c, value in self.margin.items() if value is allow]
+            if client_ids:
+                written["risk_profiles"] += ClientRiskProfile.objects.filter(
+                    client_id__in=client_ids
+                ).exclude(allow_margin=allow).update(allow_margin=allow)
+
+        # Bulk writes bypass the ledger / risk context signals
+        for client_id in touched:
+            transaction.on_commit(lambda c=client_id: exposure_ledger.invalidate(c))
+        for client_id in touched | set(self.margin):
+            transaction.on_commit(lambda c=client_id: invalidate_risk_context(c))
+
+        return written
+
+    def _write_loans(self, known_clients: set, written: Counter) -> set:
+        if not self.loans:
+            return set()
+
+        closed = [lid for lid, fields in self.loans.items() if fields is None]
+        changed = {lid: fields for lid, fields in self.loans.items() if fields is not None}
+        touched = set()
+
+        if closed:
+            touched |= set(
+                MarginLoan.objects.filter(id__in=closed).values_list("client_id", flat=True)
+            )
+            written["loans_closed"], _ = MarginLoan.objects.filter(id__in=closed).delete()
+
+        existing = MarginLoan.objects.in_bulk(list(changed))
+        rows, created_at = [], []
+        for loan_id, fields in changed.items():
+            loan = existing.get(loan_id) or MarginLoan(id=loan_id)
+            for name, value in fields.items():
+                setattr(loan, name, value)
+            # New rows need a known client and an amount
+            if loan_id not in existing and (
+                loan.client_id not in known_clients or loan.loan_amount is None
+            ):
+                written["orphaned"] += 1
+                continue
+            rows.append(loan)
+            if "created_at" in fields:
+                created_at.append((loan, fields["created_at"]))
+
+        MarginLoan.objects.bulk_create(
+            rows,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["id"],
+            update_fields=["client", "loan_amount", "interest_rate", "updated_at"],
+        )
+        # auto_now_add stamps every row with "now"; restore the event time
+        if created_at:
+            for loan, value in created_at:
+                loan.created_at = value
+            MarginLoan.objects.bulk_update([loan for loan, _ in created_at], ["created_at"], batch_size=1000)
+
+        written["loans"] = len(rows)
+        return touched | {loan.client_id for loan in rows}
+
+    def _write_positions(self, known_clients: set, written: Counter) -> set:
+        if not self.positions:
+            return set()
+
+        closed = [pid for pid, fields in self.positions.items() if fields is None]
+        changed = {pid: fields for pid, fields in self.positions.items() if fields is not None}
+        touched = set()
+
+        if closed:
+            touched |= set(
+                Portfolio.objects.filter(id__in=closed).values_list("client_id", flat=True)
+            )
+            written["positions_closed"], _ = Portfolio.objects.filter(id__in=closed).delete()
+
+        if changed:
+            existing = Portfolio.objects.in_bulk(list(changed))
+            instrument_ids = {f["instrument_id"] for f in changed.values() if "instrument_id" in f}
+            known_instruments = set(
+                Instrument.objects.filter(id__in=instrument_ids).values_list("id", flat=True)
+            ) if instrument_ids else set()
+
+            rows = []
+            for portfolio_id, fields in changed.items():
+                position = existing.get(portfolio_id) or Portfolio(id=portfolio_id)
+                for name, value in fields.items():
+                    setattr(position, name, value)
+                # New rows need a known client/instrument and a price
+                if portfolio_id not in existing and (
+                    position.client_id not in known_clients
+                    or position.instrument_id not in known_instruments
+                    or position.quantity is None
+                    or position.avg_price is None
+                ):
+                    written["orphaned"] += 1
+                    continue
+                rows.append(position)
+
+            Portfolio.objects.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=list(POSITION_FIELDS),
+            )
+            written["positions"] = len(rows)
+            touched |= {position.client_id for position in rows}
+
+        return touched
+
+
+# ------------------------------
+# SOURCES
+# ------------------------------
+def read_topics(
+    topics=REPLAY_TOPICS,
+    from_offset: int | None = None,
+    from_timestamp: int | None = None,
+    batch_size: int | None = None,
+):
+    """
+    Yield event batches from the start point up to the end offsets seen
+    when the replay started (events published meanwhile are left to the
+    live consumers)
+    """
+    batch_size = batch_size or getattr(settings, "KAFKA_REPLAY_BATCH_SIZE", 50_000)
+    consumer = make_consumer(
+        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+        group_id=None,
+        enable_auto_commit=False,
+        auto_offset_reset="earliest",
+        value_deserializer=lambda raw: decode(raw).event if raw else None,
+        max_poll_records=batch_size,
+    )
+
+    partitions = [
+        TopicPartition(topic, partition)
+        for topic in topics
+        for partition in sorted(consumer.partitions_for_topic(topic) or ())
+    ]
+    consumer.assign(partitions)
+    ends = consumer.end_offsets(partitions)
+
+    if from_timestamp is not None:
+        starts = consumer.offsets_for_times({tp: from_timestamp for tp in partitions})
+        for tp in partitions:
+            consumer.seek(tp, starts[tp].offset if starts[tp] else ends[tp])
+    else:
+        for tp in partitions:
+            consumer.seek(tp, min(from_offset or 0, ends[tp]))
+
+    try:
+        while any(consumer.position(tp) < ends[tp] for tp in partitions):
+            raw_messages = consumer.poll(timeout_ms=1000, max_records=batch_size)
+            if not raw_messages:
+                continue
+            yield [
+                message.value
+                for messages in raw_messages.values()
+                for message in messages
+                if message.offset < ends[TopicPartition(message.topic, message.partition)]
+                and isinstance(message.value, dict)
+            ]
+    finally:
+        consumer.close(autocommit=False)
+
+
+def read_file(path: str, from_timestamp: int | None = None, batch_size: int | None = None):
+    """
+    Yield event batches from an exported log: one encoded event per line
+    (JSON envelope or bare event, as written by export_events)
+    """
+    batch_size = batch_size or getattr(settings, "KAFKA_REPLAY_BATCH_SIZE", 50_000)
+    batch = []
+    with open(path, "rb") as lines:
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            envelope = decode(line)
+            if from_timestamp is not None and envelope.timestamp and envelope.timestamp < from_timestamp:
+                continue
+            batch.append(envelope.event)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def export_events(batches, path: str) -> int:
+    """
+    Write events as JSON envelope lines (input for read_file)
+    """
+    count = 0
+    with open(path, "wb") as out:
+        for batch in batches:
+            for event in batch:
+                out.write(encode(Envelope.from_event(event, key=event.get("client_id")), codec="json"))
+                out.write(b"\n")
+                count += 1
+    return count
+
+
+def replay(batches, dry_run: bool = False) -> dict:
+    """
+    Fold and write each batch; returns totals and events/sec
+    """
+    started = time.perf_counter()
+    counts, written = Counter(), Counter()
+
+    for batch in batches:
+        state = StateFold()
+        for event in batch:
+            state.apply(event)
+        counts.update(state.counts)
+        if not dry_run:
+            written.update(state.flush())
+        logger.info(f"⏩ Replayed {sum(counts.values()):,} event(s)")
+
+    elapsed = time.perf_counter() - started
+    events = sum(counts.values())
+    return {
+        "events": events,
+        "seconds": elapsed,
+        "events_per_second": events / elapsed if elapsed else 0.0,
+        "counts": dict(counts),
+        "written": dict(written),
+    }
@@ -0,0 +1,336 @@
+# core/retry.py
+"""
+Per-message retry with exponential backoff + dead-letter topic.
+
+A failing message no longer stalls its consumer: it goes into an
+in-process delay heap and the poll loop keeps going. Due retries run
+between polls (attempt n waits base * 2^(n-1), capped at max delay).
+After KAFKA_RETRY_MAX_ATTEMPTS the event is published to
+"<topic><KAFKA_DLQ_SUFFIX>" with failure metadata under "dead_letter";
+`manage.py replay_dlq` sends those events back in bulk.
+
+Per-key order holds across retries: while a key has a retry pending,
+later messages with that key are parked behind it and released one at
+a time once it succeeds or is dead-lettered. A failed DLQ publish is
+retried on its own; the handler does not run again.
+
+Commits never pass a message that is still waiting for a retry, parked
+behind one, or running: each partition is committed up to its lowest
+pending offset, so a crash redelivers it (and core.dedupe skips what
+already succeeded after it).
+
+The scheduler is thread-safe: the pooled runtime (core.consumer_pool)
+runs attempts on its worker threads and collects due retries from the
+poll thread.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.codecs import Envelope
+from core.kafka_transport import offset_and_metadata
+from core.metrics import consumer_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def dlq_topic(topic: str) -> str:
+    return f"{topic}{getattr(settings, 'KAFKA_DLQ_SUFFIX', '.dlq')}"
+
+
+@dataclass
+class PendingRetry:
+    tp: object
+    offset: int
+    key: str | None
+    event: dict
+    attempts: int = 1
+    error: str = ""
+    error_type: str = ""
+    traceback: str = field(default="", repr=False)
+    dead_lettering: bool = False    # handler gave up; only the DLQ send is retried
+
+    @property
+    def slot(self):
+        return (self.tp, self.key)
+
+
+class RetryScheduler:
+
+    def __init__(
+        self,
+        topic: str,
+        handler,
+        dedupe=None,
+        max_attempts: int | None = None,
+        base_delay: float | None = None,
+        max_delay: float | None = None,
+        producer=None,
+    ):
+        self.topic = topic
+        self.handler = handler
+        self.dedupe = dedupe
+        self.max_attempts = max_attempts or getattr(settings, "KAFKA_RETRY_MAX_ATTEMPTS", 5)
+        self.base_delay = base_delay if base_delay is not None else getattr(settings, "KAFKA_RETRY_BASE_DELAY", 1.0)
+        self.max_delay = max_delay if max_delay is not None else getattr(settings, "KAFKA_RETRY_MAX_DELAY", 60.0)
+        self._producer = producer
+        self.stats = consumer_metrics(topic)
+        self._heap = []             # (due, seq, PendingRetry)
+        self._running = {}          # id → PendingRetry popped but not finished
+        self._parked = {}           # (tp, key) → deque of messages behind its retry
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def producer(self):
+        if self._producer is None:
+            from core.producers import KafkaProducerWrapper
+            self._producer = KafkaProducerWrapper.get_producer()
+        return self._producer
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap) + sum(len(parked) for parked in self._parked.values())
+
+    # ------------------------------
+    # HANDLE
+    # ------------------------------
+    def attempt(self, message) -> bool:
+        """
+        Handle one consumed record; on failure schedule its retry
+        """
+        if self.dedupe is not None:
+            self.dedupe.event_id(message)
+
+        key = message.key.decode("utf-8") if isinstance(message.key, bytes) else message.key
+        item = PendingRetry(
+            tp=(message.topic, message.partition),
+            offset=message.offset,
+            key=key,
+            event=message.value,
+        )
+        if self._park(item):
+            return False
+        return self._run(item)
+
+    def blocks(self, message) -> bool:
+        """
+        True while the message's key waits behind a retry
+        """
+        key = message.key.decode("utf-8") if isinstance(message.key, bytes) else message.key
+        with self._lock:
+            return key is not None and ((message.topic, message.partition), key) in self._parked
+
+    def run(self, item: PendingRetry) -> bool:
+        """
+        Run one retry returned by due()
+        """
+        return self._run(item)
+
+    def _run(self, item: PendingRetry) -> bool:
+        if item.dead_lettering:
+            try:
+                self._dead_letter(item)
+            finally:
+                self._release([item])
+            return False
+
+        try:
+            with transaction.atomic():
+                if self.dedupe is not None:
+                    self.dedupe.mark([item.event["event_id"]])
+                self.handler(item.event)
+            self._advance(item)
+            return True
+        except Exception as e:
+            self.stats.inc("failures")
+            item.error = str(e)[:1000]
+            item.error_type = type(e).__name__
+            item.traceback = traceback.format_exc(limit=10)
+            self._schedule(item)
+            return False
+        finally:
+            # Rescheduled (or done) before it stops holding the commit
+            self._release([item])
+
+    def _schedule(self, item: PendingRetry):
+        if item.attempts >= self.max_attempts:
+            self._dead_letter(item)
+            return
+
+        delay = min(self.base_delay * 2 ** (item.attempts - 1), self.max_delay)
+        item.attempts += 1
+        self.stats.inc("retries")
+        self._push(item, delay, block=True)
+        logger.warning(
+            f"🔁 {self.topic}[{item.tp[1]}]@{item.offset} failed ({item.error_type}: {item.error}), "
+            f"retry {item.attempts}/{self.max_attempts} in {delay:.1f}s"
+        )
+
+    def due(self) -> list:
+        """
+        Pop the retries whose delay has elapsed; they hold the commit
+        until run() finishes them
+        """
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                item = heapq.heappop(self._heap)[2]
+                self._running[id(item)] = item
+                due.append(item)
+
+        if due and self.dedupe is not None:
+            # Redelivered elsewhere (rebalance) and already handled
+            unseen = self.dedupe.unseen([item.event["event_id"] for item in due])
+            handled = [item for item in due if item.event["event_id"] not in unseen]
+            for item in handled:
+                self._advance(item)
+            self._release(handled)
+            due = [item for item in due if item.event["event_id"] in unseen]
+
+        return due
+
+    def run_due(self) -> int:
+        """
+        Run every retry whose delay has elapsed; returns how many ran
+        """
+        due = self.due()
+        for item in due:
+            self._run(item)
+        return len(due)
+
+    def next_due_in(self, default: float = 1.0) -> float:
+        """
+        Seconds until the next retry is due (caps the poll timeout)
+        """
+        with self._lock:
+            if not self._heap:
+                return default
+            return max(0.0, min(default, self._heap[0][0] - time.monotonic()))
+
+    def forget(self, partitions):
+        """
+        Drop retries of revoked partitions (their new owner redelivers them)
+        """
+        revoked = {(tp[0], tp[1]) for tp in partitions}
+        with self._lock:
+            self._heap = [entry for entry in self._heap if entry[2].tp not in revoked]
+            heapq.heapify(self._heap)
+            self._parked = {slot: parked for slot, parked in self._parked.items() if slot[0] not in revoked}
+
+    def _push(self, item: PendingRetry, delay: float, block: bool = False):
+        with self._lock:
+            if block and item.key is not None:
+                # Later messages with this key now queue up behind it
+                self._parked.setdefault(item.slot, deque())
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), item))
+
+    # ------------------------------
+    # KEY ORDER
+    # ------------------------------
+    def _park(self, item: PendingRetry) -> bool:
+        """
+        Queue the message behind its key's pending retry, if there is one
+        """
+        with self._lock:
+            parked = self._parked.get(item.slot) if item.key is not None else None
+            if parked is None:
+                return False
+            parked.append(item)
+
+        logger.debug(f"⏸️ {self.topic}[{item.tp[1]}]@{item.offset} parked behind key {item.key}'s retry")
+        return True
+
+    def _advance(self, item: PendingRetry):
+        """
+        item is done with: release the next message parked behind its key
+        """
+        if item.key is None:
+            return
+        with self._lock:
+            parked = self._parked.get(item.slot)
+            if parked is None:
+                return
+            if parked:
+                heapq.heappush(self._heap, (time.monotonic(), next(self._seq), parked.popleft()))
+            else:
+                del self._parked[item.slot]
+
+    def _release(self, items):
+        with self._lock:
+            for item in items:
+                self._running.pop(id(item), None)
+
+    # ------------------------------
+    # DEAD LETTER
+    # ------------------------------
+    def _dead_letter(self, item: PendingRetry):
+        envelope = Envelope.from_event(item.event, key=item.key)
+        envelope.payload["dead_letter"] = {
+            "original_topic": self.topic,
+            "partition": item.tp[1],
+            "offset": item.offset,
+            "attempts": item.attempts,
+            "error": item.error,
+            "error_type": item.error_type,
+            "traceback": item.traceback,
+            "failed_at": timezone.now().isoformat(),
+        }
+
+        try:
+            self.producer.send(dlq_topic(self.topic), key=item.key, value=envelope).get(timeout=10)
+        except Exception as e:
+            # Never drop it: keep retrying the DLQ publish (only) at the max delay
+            logger.error(f"❌ DLQ publish failed for {self.topic}@{item.offset}: {e}")
+            item.dead_lettering = True
+            self._push(item, self.max_delay, block=True)
+            return
+
+        self._advance(item)
+        self.stats.inc("dead_letters")
+        logger.error(
+            f"☠️ {self.topic}[{item.tp[1]}]@{item.offset} dead-lettered after "
+            f"{item.attempts} attempt(s): {item.error_type}: {item.error}"
+        )
+
+    # ------------------------------
+    # COMMIT
+    # ------------------------------
+    def commit_floor(self) -> dict:
+        """
+        {(topic, partition): lowest offset still waiting for (or in) a retry}
+        """
+        with self._lock:
+            items = [entry[2] for entry in self._heap] + list(self._running.values())
+            items += [item for parked in self._parked.values() for item in parked]
+
+        floor = {}
+        for item in items:
+            floor[item.tp] = min(item.offset, floor.get(item.tp, item.offset))
+        return floor
+
+    def commit(self, consumer, asynchronous: bool = False):
+        """
+        Commit consumed positions, held back below pending retries
+        """
+        floor = self.commit_floor()
+        offsets = {}
+        for tp in consumer.assignment():
+            position = consumer.position(tp)
+            offsets[tp] = offset_and_metadata(min(position, floor.get((tp.topic, tp.partition), position)))
+        if not offsets:
+            return
+        if asynchronous:
+            consumer.commit_async(offsets)
+        else:
+            consumer.commit(offsets)
@@ -23,4 +23,36 @@ class MarginLoanSerializer(serializers.ModelSerializer):
 class AuditLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = AuditLog
-        fields = "__all__"
\ No newline at end of file
+        fields = "__all__"
+
+class PreTradeOrderSerializer(serializers.Serializer):
+    instrument = serializers.IntegerField()
+    side = serializers.CharField(default="BUY")
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=4)
+    price = serializers.DecimalField(max_digits=20, decimal_places=4)
+    is_margin = serializers.BooleanField(default=True)
+
+    def validate_side(self, value):
+        side = value.upper()
+        if side not in ("BUY", "SELL"):
+            raise serializers.ValidationError("side must be BUY or SELL")
+        return side
+
+
+class PreTradeBasketSerializer(serializers.Serializer):
+    client_id = serializers.IntegerField()
+    orders = PreTradeOrderSerializer(many=True, allow_empty=False)
+
+    def validate(self, attrs):
+        # One query for every instrument in the basket
+        ids = {order["instrument"] for order in attrs["orders"]}
+        instruments = Instrument.objects.in_bulk(ids)
+
+        missing = sorted(ids - set(instruments))
+        if missing:
+            raise serializers.ValidationError({"orders": f"Unknown instrument id(s): {missing}"})
+
+        for order in attrs["orders"]:
+            order["instrument"] = instruments[order["instrument"]]
+
+        return attrs
@@ -0,0 +1,114 @@
+"""
+Process-local table of instrument id / symbol → effective margin rate.
+
+Instrument reference data changes a few times a day but is read on every
+position loop, so the board rules are evaluated once per instrument and
+kept here. Instrument post_save/post_delete invalidate it (core.signals);
+MARGIN_RATE_TABLE_TTL bounds staleness for writes made by other processes,
+so pre-trade hard blocks read the Instrument row they are given instead.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+
+from core.models import Instrument
+
+
+@dataclass(frozen=True)
+class MarginRate:
+    instrument_id: int
+    symbol: str
+    effective_rate: Decimal
+    is_marginable: bool
+    is_z_board: bool
+
+
+def _entry(instrument: Instrument) -> MarginRate:
+    return MarginRate(
+        instrument_id=instrument.id,
+        symbol=instrument.symbol,
+        effective_rate=instrument.effective_margin_rate(),
+        is_marginable=instrument.is_marginable,
+        is_z_board=instrument.board == "Z",
+    )
+
+
+class MarginRateTable:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = None    # (by_id, by_symbol)
+        self._loaded_at = 0.0
+
+    # ------------------------------
+    # LOOKUP
+    # ------------------------------
+    def get(self, instrument_id: int) -> MarginRate:
+        by_id, _ = self._table()
+
+        entry = by_id.get(instrument_id)
+        if entry is None:
+            # Instrument created after the last load
+            entry = self._load_one(id=instrument_id)
+
+        return entry
+
+    def by_symbol(self, symbol: str) -> MarginRate:
+        _, by_symbol = self._table()
+
+        entry = by_symbol.get(symbol)
+        if entry is None:
+            entry = self._load_one(symbol=symbol)
+
+        return entry
+
+    def effective_rate(self, instrument_id: int) -> Decimal:
+        return self.get(instrument_id).effective_rate
+
+    # ------------------------------
+    # LOAD / INVALIDATE
+    # ------------------------------
+    def reload(self):
+        entries = [_entry(i) for i in Instrument.objects.all()]
+
+        tables = (
+            {e.instrument_id: e for e in entries},
+            {e.symbol: e for e in entries},
+        )
+
+        with self._lock:
+            self._tables = tables
+            self._loaded_at = time.monotonic()
+
+        return tables
+
+    def invalidate(self):
+        with self._lock:
+            self._tables = None
+
+    def _table(self) -> tuple[dict, dict]:
+        ttl = getattr(settings, "MARGIN_RATE_TABLE_TTL", None)
+
+        tables = self._tables
+        if tables is None or (ttl and time.monotonic() - self._loaded_at > ttl):
+            tables = self.reload()
+
+        return tables
+
+    def _load_one(self, **lookup) -> MarginRate:
+        entry = _entry(Instrument.objects.get(**lookup))
+
+        with self._lock:
+            if self._tables is not None:
+                by_id, by_symbol = self._tables
+                by_id[entry.instrument_id] = entry
+                by_symbol[entry.symbol] = entry
+
+        return entry
+
+
+# Process-wide instance
+margin_rates = MarginRateTable()
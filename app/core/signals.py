@@ -1,28 +1,87 @@
 # core/signals.py
 import logging
-from django.db.models.signals import post_save
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from core.models import MarginLoan, Portfolio
-from core.producers import publish_margin_request, publish_forced_sell
+from core.models import Instrument, MarginLoan, Portfolio
+from core.producers import (
+    publish_forced_sell,
+    publish_loan_closed,
+    publish_loan_updated,
+    publish_margin_request,
+    publish_position_closed,
+    publish_position_updated,
+)
+from core.services.margin_rates import margin_rates
 
 logger = logging.getLogger(__name__)
 
+_replaying: ContextVar[bool] = ContextVar("replaying", default=False)
+
+
+@contextmanager
+def replaying():
+    """Writes in the block come from the log: don't publish them again"""
+    token = _replaying.set(True)
+    try:
+        yield
+    finally:
+        _replaying.reset(token)
+
 
 @receiver(post_save, sender=MarginLoan)
 def marginloan_created(sender, instance, created, **kwargs):
-    """Send Kafka event when a MarginLoan is created"""
+    """Send Kafka event when a MarginLoan is created or updated"""
+    if _replaying.get():
+        return
     if created:
-        logger.info(f"📢 MarginLoan created for client={instance.client.id} amount={instance.loan_amount}")
-        publish_margin_request(client_id=instance.client.id, amount=float(instance.loan_amount))
+        logger.info(f"📢 MarginLoan created for client={instance.client_id} amount={instance.loan_amount}")
+        # Outbox row in the loan's transaction (or publish after commit)
+        publish_margin_request(
+            client_id=instance.client_id,
+            amount=float(instance.loan_amount),
+            loan=instance,
+            on_commit=True,
+        )
+    else:
+        publish_loan_updated(instance)
+
+
+@receiver(post_delete, sender=MarginLoan)
+def marginloan_closed(sender, instance, **kwargs):
+    """Closed loans leave the log too (core.replay deletes them)"""
+    if not _replaying.get():
+        publish_loan_closed(instance)
 
 
 @receiver(post_save, sender=Portfolio)
 def portfolio_updated(sender, instance, created, **kwargs):
-    """Example: If portfolio quantity < 0, force sell event"""
+    """Publish the position; if portfolio quantity < 0, force sell event"""
+    if _replaying.get():
+        return
+    publish_position_updated(instance)
     if not created and instance.quantity < 0:
-        logger.warning(f"⚠️ Forced sell triggered for client={instance.client.id}, portfolio={instance.id}")
+        logger.warning(f"⚠️ Forced sell triggered for client={instance.client_id}, portfolio={instance.id}")
         publish_forced_sell(
-            client_id=instance.client.id,
+            client_id=instance.client_id,
             portfolio_id=instance.id,
-            reason="Negative quantity"
+            reason="Negative quantity",
+            quantity=instance.quantity,
+            on_commit=True,
         )
+
+
+@receiver(post_delete, sender=Portfolio)
+def portfolio_closed(sender, instance, **kwargs):
+    if not _replaying.get():
+        publish_position_closed(instance)
+
+
+@receiver(post_save, sender=Instrument)
+@receiver(post_delete, sender=Instrument)
+def instrument_changed(sender, instance, **kwargs):
+    """Drop the memoized margin-rate table (again once the write is visible)"""
+    margin_rates.invalidate()
+    transaction.on_commit(margin_rates.invalidate)
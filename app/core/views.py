@@ -10,10 +10,13 @@ from rest_framework import status
 
 from .models import MarginLoan, AuditLog
 from .serializers import MarginLoanSerializer, AuditLogSerializer
-from .producers import KafkaProducerWrapper
+from .producers import KafkaProducerWrapper, publish_forced_sell
 
 from .models import Portfolio, MarginLoan, AuditLog,Client, Instrument
-from risk.services.risk_engine import RiskEngine, RiskViolation
+from risk.models import ClientRiskProfile
+from risk.services.risk_engine import PreTradeOrder, RiskEngine, RiskViolation
+from risk.services.context import risk_context
+from risk.services.recompute import recompute_scheduler
 
 
 from .serializers import (
@@ -22,6 +25,7 @@ from .serializers import (
     PortfolioSerializer,
     MarginLoanSerializer,
     AuditLogSerializer,  # 🔹 New
+    PreTradeBasketSerializer,
 )
 
 
@@ -99,34 +103,127 @@ class PortfolioViewSet(viewsets.ModelViewSet):
         quantity = Decimal(serializer.validated_data["quantity"])
         price = Decimal(serializer.validated_data["avg_price"])
 
-        try:
-            RiskEngine.check_pre_trade(
-                client_id=client.id,
-                instrument=instrument,
-                side="BUY",
-                quantity=quantity,
-                price=price,
-                is_margin=True,
-            )
-        except RiskViolation as e:
-            return Response(
-                {"error": str(e)},
-                status=status.HTTP_400_BAD_REQUEST,
+        # One risk context: the snapshot is loaded once for the pre-trade
+        # check and once more after the position write
+        with risk_context():
+            try:
+                RiskEngine.check_pre_trade(
+                    client_id=client.id,
+                    instrument=instrument,
+                    side="BUY",
+                    quantity=quantity,
+                    price=price,
+                    is_margin=True,
+                )
+            except RiskViolation as e:
+                return Response(
+                    {"error": str(e)},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            # Already validated above: save without a second validation pass
+            self.perform_create(serializer)
+            response = Response(
+                serializer.data,
+                status=status.HTTP_201_CREATED,
+                headers=self.get_success_headers(serializer.data),
             )
 
-        response = super().create(request, *args, **kwargs)
+            # 🔒 Post-trade safety net (debounced per client, see
+            # risk.services.recompute; breaches are audited there)
+            recompute_scheduler.mark(client.id, post_trade=True)
+
+        return response
+
+    @extend_schema(
+        tags=["Portfolio"],
+        description="Pre-trade check a basket of orders cumulatively (orders are checked in sequence)",
+        examples=[
+            OpenApiExample(
+                "Basket Request Example",
+                value={
+                    "client_id": 1,
+                    "orders": [
+                        {"instrument": 1, "side": "BUY", "quantity": "100", "price": "150.00"},
+                        {"instrument": 2, "side": "BUY", "quantity": "50", "price": "90.00", "is_margin": True},
+                    ],
+                },
+                request_only=True,
+            ),
+            OpenApiExample(
+                "Basket Response Example",
+                value={
+                    "client_id": 1,
+                    "available_exposure": "10000.00",
+                    "accepted": 1,
+                    "rejected": 1,
+                    "orders": [
+                        {
+                            "index": 0,
+                            "instrument": "AAPL",
+                            "side": "BUY",
+                            "accepted": True,
+                            "required": "7500.00",
+                            "remaining": "2500.00",
+                            "reason": "",
+                        },
+                        {
+                            "index": 1,
+                            "instrument": "MSFT",
+                            "side": "BUY",
+                            "accepted": False,
+                            "required": "0.00",
+                            "remaining": "2500.00",
+                            "reason": "Exposure exceeded. Required=2700.00, Available=2500.00",
+                        },
+                    ],
+                },
+                response_only=True,
+            ),
+        ],
+    )
+    @action(detail=False, methods=["post"], url_path="pre-trade-basket")
+    def pre_trade_basket(self, request):
+        serializer = PreTradeBasketSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        client_id = serializer.validated_data["client_id"]
+        orders = [PreTradeOrder(**order) for order in serializer.validated_data["orders"]]
 
-        # 🔒 Post-trade safety net
         try:
-            RiskEngine.enforce_post_trade(client.id)
-        except RiskViolation as e:
-            AuditLog.log_event(
-                event_type="POST_TRADE_RISK_BREACH",
-                client=client,
-                details={"reason": str(e)},
-            )
+            snapshot = RiskEngine.snapshot(client_id)
+        except ClientRiskProfile.DoesNotExist:
+            return Response({"error": "Risk profile not found"}, status=404)
+
+        decisions = RiskEngine.check_pre_trade_basket(
+            client_id=snapshot.client_id,
+            orders=orders,
+            snapshot=snapshot,
+        )
+
+        accepted = sum(1 for d in decisions if d.accepted)
+
+        return Response(
+            {
+                "client_id": snapshot.client_id,
+                "available_exposure": str(snapshot.available_exposure),
+                "accepted": accepted,
+                "rejected": len(decisions) - accepted,
+                "orders": [
+                    {
+                        "index": i,
+                        "instrument": d.order.instrument.symbol,
+                        "side": d.order.side.upper(),
+                        "accepted": d.accepted,
+                        "required": str(d.required),
+                        "remaining": str(d.remaining),
+                        "reason": d.reason,
+                    }
+                    for i, d in enumerate(decisions)
+                ],
+            }
+        )
 
-        return response
     @extend_schema(
         tags=["Portfolio"],
         description="Check margin loan eligibility for a client",
@@ -201,7 +298,7 @@ class PortfolioViewSet(viewsets.ModelViewSet):
                     "client_id": 1,
                     "status": "force-sell executed",
                     "sold_positions": [
-                        {"instrument": "AAPL", "quantity_sold": "50.0000", "reason": "loan exceeds eligibility"}
+                        {"portfolio_id": 1, "instrument": "AAPL", "quantity_sold": "50.0000", "reason": "loan exceeds eligibility"}
                     ],
                 },
                 response_only=True,
@@ -237,6 +334,7 @@ class PortfolioViewSet(viewsets.ModelViewSet):
                             p.save()
                             sold_positions.append(
                                 {
+                                    "portfolio_id": p.id,
                                     "instrument": p.instrument.symbol,
                                     "quantity_sold": f"{sell_qty:.4f}",
                                     "reason": "loan exceeds eligibility",
@@ -252,6 +350,17 @@ class PortfolioViewSet(viewsets.ModelViewSet):
                     details={"sold_positions": sold_positions},
                 )
 
+                # Event commits (or rolls back) with the sells
+                remaining = {p.id: p.quantity for p in portfolios}
+                for position in sold_positions:
+                    publish_forced_sell(
+                        client_id=int(client_id),
+                        portfolio_id=position["portfolio_id"],
+                        reason=position["reason"],
+                        quantity=remaining[position["portfolio_id"]],
+                        on_commit=True,
+                    )
+
             return Response({"client_id": client_id, "status": "force-sell executed", "sold_positions": sold_positions})
 
         return Response({"client_id": client_id, "status": "no action needed"})
@@ -289,17 +398,17 @@ class MarginLoanViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         loan = serializer.save()
 
-        # 1️⃣ Publish Kafka event
-        KafkaProducerWrapper.send_event(
+        # 1️⃣ Publish Kafka event (after commit)
+        KafkaProducerWrapper.publish_on_commit(
             topic="margin-loan-events",
             key=str(loan.client.id),
             event={
                 "type": "LOAN_CREATED",
                 "loan_id": loan.id,
                 "client_id": loan.client.id,
-                "amount": str(loan.loan_amount),
-                "interest_rate": str(loan.interest_rate),
-                "created_at": str(loan.created_at),
+                "amount": loan.loan_amount,
+                "interest_rate": loan.interest_rate,
+                "created_at": loan.created_at,
             },
         )
 
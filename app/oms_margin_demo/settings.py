@@ -119,6 +119,81 @@ DATABASES = {
 # Kafka Settings
 KAFKA_BOOTSTRAP_SERVERS = ["kafka:9092"]  # Docker service name for kafka
 
+# "kafka": real broker, "memory": in-process partitioned log
+# (core.kafka_transport) for tests and `manage.py benchmark_pipeline`
+KAFKA_TRANSPORT = os.environ.get("KAFKA_TRANSPORT", "kafka")
+KAFKA_MEMORY_PARTITIONS = 8
+
+# Event envelope codec for producers (core.codecs): "json" or "binary"
+# (msgpack). Consumers in this repo decode both, plus legacy bare-JSON
+# events; switch to "binary" only once every external reader does too.
+KAFKA_EVENT_CODEC = os.environ.get("KAFKA_EVENT_CODEC", "json")
+
+# "sync": wait for the broker ack on every event (send_event's True = acked),
+# "async": send_event returns once queued (delivery via callbacks); opt-in
+KAFKA_PUBLISH_MODE = os.environ.get("KAFKA_PUBLISH_MODE", "sync")
+KAFKA_MAX_IN_FLIGHT = 1000      # unacknowledged records before send_event waits
+KAFKA_IN_FLIGHT_TIMEOUT = 5     # seconds to wait for an in-flight slot
+
+# Transactional outbox: write events with the business change and let
+# `manage.py relay_outbox` send them in batches
+KAFKA_OUTBOX_ENABLED = os.environ.get("KAFKA_OUTBOX_ENABLED", "false").lower() == "true"
+KAFKA_OUTBOX_BATCH_SIZE = 5000
+KAFKA_OUTBOX_LINGER_MS = 50
+KAFKA_OUTBOX_COMPRESSION = "gzip"
+KAFKA_OUTBOX_MAX_ATTEMPTS = 10  # failed sends before a row is parked
+
+# Records per poll handed to batch consumers (core.consumers)
+KAFKA_CONSUMER_MAX_RECORDS = 500
+
+# Pooled consumers (core.consumer_pool): worker threads per process and
+# seconds between partition watermark commits
+KAFKA_CONSUMER_WORKERS = 8
+KAFKA_CONSUMER_COMMIT_INTERVAL = 1.0
+
+# Async consumers (core.async_consumers): keys handled concurrently per topic
+KAFKA_ASYNC_CONCURRENCY = 32
+
+# Consumer dedupe (core.dedupe): skip already-processed event ids.
+# Recent ids are cached in-process; ProcessedEvent rows older than the
+# retention are removed by `manage.py prune_processed_events`
+KAFKA_CONSUMER_DEDUPE = True
+KAFKA_DEDUPE_CACHE_SIZE = 100_000
+KAFKA_DEDUPE_RETENTION_DAYS = 7
+
+# Consumer retries (core.retry): attempts before an event goes to
+# "<topic>.dlq", backoff base/cap in seconds (base * 2^(attempt-1))
+KAFKA_RETRY_MAX_ATTEMPTS = 5
+KAFKA_RETRY_BASE_DELAY = 1.0
+KAFKA_RETRY_MAX_DELAY = 60.0
+KAFKA_DLQ_SUFFIX = ".dlq"
+
+# Consumer metrics (core.metrics): stats log line every N seconds (0 = off),
+# Prometheus text endpoint on KAFKA_METRICS_PORT (/metrics, unset = off),
+# partition lag refresh period and 1-in-N sampling of per-message debug logs
+KAFKA_METRICS_INTERVAL = 60
+KAFKA_METRICS_PORT = os.environ.get("KAFKA_METRICS_PORT")
+KAFKA_METRICS_LAG_INTERVAL = 10
+KAFKA_LOG_SAMPLE_RATE = 1000
+
+# Event replay (`manage.py replay_events`): events folded in memory per
+# bulk write when rebuilding state from the topics or an exported log
+KAFKA_REPLAY_BATCH_SIZE = 50_000
+
+# Risk Settings
+# Serve pre-trade used exposure from the in-process exposure ledger
+RISK_EXPOSURE_LEDGER = False
+
+# Debounce window for post-trade / profile recomputation per client
+# (risk.services.recompute); 0 = recompute immediately
+RISK_RECOMPUTE_WINDOW_MS = int(os.environ.get("RISK_RECOMPUTE_WINDOW_MS", "0"))
+# Clients loaded per profile/positions query when recomputing
+RISK_RECOMPUTE_BATCH_SIZE = 500
+
+# Seconds before the memoized instrument margin-rate table is reloaded
+# (local Instrument writes invalidate it immediately)
+MARGIN_RATE_TABLE_TTL = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -24,10 +24,21 @@ class ClientRiskProfileAdmin(admin.ModelAdmin):
     readonly_fields = ["max_exposure"]
     
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("client")
+
     # ---------- COMPUTED COLUMNS ----------
-    
+
+    # One snapshot per row, shared by the four risk columns
+    def _snapshot(self, obj):
+        snapshot = getattr(obj, "_risk_snapshot", None)
+        if snapshot is None:
+            snapshot = RiskEngine.snapshot(obj.client_id, profile=obj)
+            obj._risk_snapshot = snapshot
+        return snapshot
+
     def loan_amount(self, obj):
-        loan = RiskEngine.loan_amount(obj.client_id)
+        loan = self._snapshot(obj).loan_amount
 
         if loan == 0:
             return format_html('<span style="color:green;">0.00</span>')
@@ -40,13 +51,13 @@ class ClientRiskProfileAdmin(admin.ModelAdmin):
     loan_amount.short_description = "Loan Amount"
 
     def used_exposure(self, obj):
-        used = RiskEngine.calculate_current_exposure(obj.client_id)
+        used = self._snapshot(obj).used_exposure
         return f"{used:.2f}"
 
     used_exposure.short_description = "Used Exposure"
 
     def edr_percent(self, obj):
-        utilization = RiskEngine.margin_utilization(obj.client_id)
+        utilization = self._snapshot(obj).edr_percent
 
         # Color rules
         if utilization < 50:
@@ -67,7 +78,7 @@ class ClientRiskProfileAdmin(admin.ModelAdmin):
     edr_percent.short_description = "EDR %"
 
     def edr_status(self, obj):
-        status = RiskEngine.utilization_status(obj.client_id)
+        status = self._snapshot(obj).edr_status
 
         color_map = {
             "SAFE": "green",
@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from risk.services.mtm_sweep import (
+    SweepCheckpoint,
+    client_ids_to_sweep,
+    init_worker,
+    shard,
+    stragglers,
+    sweep_shard,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Run post-trade / MTM enforcement for all clients across worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes (0 = run in this process)",
+        )
+        parser.add_argument(
+            "--shard-size",
+            type=int,
+            default=500,
+            help="Clients per shard (default: 500)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            type=str,
+            default=None,
+            help="JSON file recording finished shards",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip shards already recorded in --checkpoint",
+        )
+        parser.add_argument(
+            "--straggler-factor",
+            type=float,
+            default=2.0,
+            help="Flag shards slower than this × the median (default: 2.0)",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        path = options["checkpoint"]
+
+        if options["resume"] and not path:
+            self.stderr.write("--resume needs --checkpoint")
+            return
+
+        if options["resume"]:
+            checkpoint = SweepCheckpoint.load(path)
+        else:
+            checkpoint = SweepCheckpoint(path)
+
+        client_ids = client_ids_to_sweep(completed=checkpoint.completed)
+        shards = shard(client_ids, max(options["shard_size"], 1))
+
+        self.stdout.write(
+            f"🧮 MTM sweep: {len(client_ids)} client(s) in {len(shards)} shard(s), "
+            f"{len(checkpoint.shards)} shard(s) already done, workers={workers}"
+        )
+
+        started = time.perf_counter()
+
+        if workers == 0:
+            for ids in shards:
+                self._record(checkpoint, sweep_shard(ids))
+        else:
+            # Children must open their own connections
+            connections.close_all()
+
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+            ) as pool:
+                futures = [pool.submit(sweep_shard, ids) for ids in shards]
+                for future in as_completed(futures):
+                    self._record(checkpoint, future.result())
+
+        self._report(checkpoint.results(), time.perf_counter() - started, options)
+
+    def _record(self, checkpoint, result):
+        checkpoint.record(result)
+
+        self.stdout.write(
+            f"  shard {result.key}: {result.clients} clients in {result.elapsed:.2f}s "
+            f"({result.throughput:.0f}/s) enforced={result.enforced} "
+            f"margin_call={result.margin_calls} force_sell={result.force_sells} "
+            f"breaches={result.breaches} errors={len(result.errors)} "
+            f"pid={result.worker_pid}"
+        )
+
+    def _report(self, results, wall, options):
+        total = sum(r.clients for r in results)
+
+        self.stdout.write(
+            f"📊 {total} client(s) in {wall:.2f}s wall: "
+            f"enforced={sum(r.enforced for r in results)} "
+            f"margin_call={sum(r.margin_calls for r in results)} "
+            f"force_sell={sum(r.force_sells for r in results)} "
+            f"breaches={sum(r.breaches for r in results)} "
+            f"errors={sum(len(r.errors) for r in results)}"
+        )
+
+        for r in stragglers(results, options["straggler_factor"]):
+            self.stdout.write(
+                self.style.WARNING(
+                    f"🐢 Straggler shard {r.key}: {r.elapsed:.2f}s "
+                    f"({r.clients} clients, pid={r.worker_pid})"
+                )
+            )
+
+        for r in results:
+            for client_id, message in r.errors:
+                self.stderr.write(f"❌ client {client_id}: {message}")
+
+        self.stdout.write(self.style.SUCCESS("✅ MTM sweep finished"))
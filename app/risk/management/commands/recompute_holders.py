@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Instrument
+from risk.services.holders import recompute_holders
+
+
+class Command(BaseCommand):
+    help = "Recompute the holders of instruments changed outside Instrument.save() (e.g. bulk updates)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("symbols", nargs="+", help="Instrument symbols")
+
+    def handle(self, *args, **options):
+        instruments = dict(
+            Instrument.objects.filter(symbol__in=options["symbols"]).values_list("symbol", "id")
+        )
+        unknown = sorted(set(options["symbols"]) - set(instruments))
+        if unknown:
+            raise CommandError(f"Unknown symbols: {', '.join(unknown)}")
+
+        for symbol, instrument_id in instruments.items():
+            count = recompute_holders(instrument_id)
+            self.stdout.write(self.style.SUCCESS(f"✅ {symbol}: recomputed {count} holder(s)"))
@@ -0,0 +1,55 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from risk.services.settlement import BalanceChange, CashSettlement
+
+
+class Command(BaseCommand):
+    help = "Apply cash / collateral balances in bulk (CSV: client_id,cash_balance,collateral_value)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV file with a header row; blank cells are left unchanged")
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help="Treat the values as increments instead of new balances",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report band changes without writing",
+        )
+
+    def handle(self, *args, **options):
+        changes = []
+
+        with open(options["path"], newline="") as f:
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    changes.append(BalanceChange(
+                        client_id=int(row["client_id"]),
+                        cash_balance=self._amount(row.get("cash_balance")),
+                        collateral_value=self._amount(row.get("collateral_value")),
+                    ))
+                except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+                    raise CommandError(f"{options['path']}:{line}: {e!r}")
+
+        result = CashSettlement.apply(changes, delta=options["delta"], dry_run=options["dry_run"])
+        summary = result.summary()
+
+        verb = "Would settle" if options["dry_run"] else "Settled"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {verb} {summary['clients']} client(s), {summary['profiles']} profile(s); "
+            f"{summary['queued']} queued for margin policy"
+        ))
+        for change, count in sorted(summary["band_changes"].items()):
+            self.stdout.write(f"   {change}: {count}")
+        if result.missing:
+            self.stdout.write(self.style.WARNING(f"⚠️ Unknown client ids: {result.missing[:20]}"))
+
+    @staticmethod
+    def _amount(value):
+        value = (value or "").strip()
+        return Decimal(value) if value else None
@@ -35,20 +35,26 @@ class ClientRiskProfileSerializer(serializers.ModelSerializer):
     ]
 
 
+    # Risk metrics come from one RiskSnapshot per client: list views
+    # precompute them for the whole page into context["risk_snapshots"]
+    def _snapshot(self, obj):
+        snapshots = self.context.setdefault("risk_snapshots", {})
+
+        snapshot = snapshots.get(obj.client_id)
+        if snapshot is None:
+            snapshot = RiskEngine.snapshot(obj.client_id, profile=obj)
+            snapshots[obj.client_id] = snapshot
+
+        return snapshot
+
     def get_loan_amount(self, obj):
-        return str(
-            RiskEngine.loan_amount(obj.client_id)
-        )
-        
+        return str(self._snapshot(obj).loan_amount)
+
     def get_used_exposure(self, obj):
-        return str(
-            RiskEngine.calculate_current_exposure(obj.client_id)
-        )
+        return str(self._snapshot(obj).used_exposure)
 
     def get_edr_percent(self, obj):
-        return str(
-            RiskEngine.margin_utilization(obj.client_id)
-        )
+        return str(self._snapshot(obj).edr_percent)
 
     def get_edr_status(self, obj):
-        return RiskEngine.utilization_status(obj.client_id)
+        return self._snapshot(obj).edr_status
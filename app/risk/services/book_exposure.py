@@ -0,0 +1,296 @@
+# risk/services/book_exposure.py
+"""
+Book-wide exposure in one vectorized pass.
+
+All money/rate columns are held as scaled int64 so the results match the
+per-client Decimal path in RiskEngine exactly:
+
+    quantity, avg_price   → 4 dp   (× 10^4)
+    margin_rate, leverage → 2 dp   (× 10^2)
+    cash, max_exposure    → cents  (× 10^2)
+    utilization           → hundredths of a percent (× 10^2)
+
+Board rates come from the memoized margin-rate table, the same source
+RiskEngine.build_snapshot reads, so both paths agree on every client.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+
+import numpy as np
+
+from core.models import Portfolio
+from core.services.margin_rates import margin_rates
+from risk.models import ClientRiskProfile
+from risk.constants import UTILIZATION_LEVELS
+
+
+QTY_SCALE = 10**4
+PRICE_SCALE = 10**4
+RATE_SCALE = 10**2
+CENT_SCALE = 10**2
+
+# quantity × price is scale 10^8; split it at 10^8 so (part × rate)
+# stays well inside int64 before the per-client sums
+_SPLIT = QTY_SCALE * PRICE_SCALE
+_HALF = _SPLIT // 2
+
+_INT64_SAFE = float(2**62)
+
+# used (cents) × 10^4 must stay inside int64 for the EDR division
+_EDR_SAFE = 9 * 10**14
+
+STATUS_LABELS = ("SAFE", "WARNING", "MARGIN_CALL", "FORCE_SELL")
+
+_THRESHOLDS = tuple(
+    int(UTILIZATION_LEVELS[label] * CENT_SCALE) for label in STATUS_LABELS[:3]
+)
+
+
+def _scaled(values, places: int, count: int) -> np.ndarray:
+    """
+    Decimal column → exact int64 at 10^places
+    """
+    return np.fromiter(
+        (int(Decimal(v or 0).scaleb(places)) for v in values),
+        dtype=np.int64,
+        count=count,
+    )
+
+
+def _round_half_up(hi: np.ndarray, lo: np.ndarray) -> np.ndarray:
+    """
+    value = hi + lo / _SPLIT with 0 <= lo < _SPLIT → ROUND_HALF_UP to hi units
+    (away from zero, same as Decimal)
+    """
+    up = np.where(hi >= 0, lo >= _HALF, lo > _HALF)
+    return hi + up.astype(np.int64)
+
+
+def _divide_half_even(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    """
+    round(num / den) with ROUND_HALF_EVEN (Decimal's default context),
+    den != 0
+    """
+    sign = np.sign(num) * np.sign(den)
+    n = np.abs(num)
+    d = np.abs(den)
+
+    q, r = np.divmod(n, d)
+    twice = 2 * r
+    up = (twice > d) | ((twice == d) & (q % 2 == 1))
+
+    return sign * (q + up.astype(np.int64))
+
+
+def _divide_half_even_int(num: int, den: int) -> int:
+    sign = -1 if (num < 0) != (den < 0) else 1
+    q, r = divmod(abs(num), abs(den))
+    if 2 * r > abs(den) or (2 * r == abs(den) and q % 2 == 1):
+        q += 1
+    return sign * q
+
+
+@dataclass(frozen=True)
+class BookColumns:
+    """
+    Columnar inputs for one book computation
+    """
+
+    # per client (sorted by client_id)
+    client_ids: np.ndarray
+    leverage: np.ndarray        # × 10^2
+    max_exposure: np.ndarray    # cents
+    cash_balance: np.ndarray    # cents
+    allow_margin: np.ndarray    # bool
+
+    # per position
+    position_client_ids: np.ndarray
+    quantity: np.ndarray        # × 10^4
+    avg_price: np.ndarray       # × 10^4
+    margin_rate: np.ndarray     # effective board rate × 10^2, 0 if blocked
+
+
+@dataclass(frozen=True)
+class BookExposure:
+    """
+    Per-client results, aligned on client_ids
+    """
+
+    client_ids: np.ndarray
+    used_exposure: np.ndarray   # cents
+    loan_amount: np.ndarray     # cents
+    max_exposure: np.ndarray    # cents
+    edr_percent: np.ndarray     # hundredths of a percent
+    edr_status: np.ndarray      # STATUS_LABELS
+    allow_margin: np.ndarray    # bool
+
+    def __len__(self):
+        return len(self.client_ids)
+
+    def index_of(self, client_id: int) -> int:
+        i = int(np.searchsorted(self.client_ids, client_id))
+        if i >= len(self.client_ids) or self.client_ids[i] != client_id:
+            raise KeyError(client_id)
+        return i
+
+    def row(self, client_id: int) -> dict:
+        return self._row(self.index_of(client_id))
+
+    def rows(self):
+        for i in range(len(self.client_ids)):
+            yield self._row(i)
+
+    def status_counts(self) -> dict:
+        labels, counts = np.unique(self.edr_status, return_counts=True)
+        result = {label: 0 for label in STATUS_LABELS}
+        result.update({str(k): int(v) for k, v in zip(labels, counts)})
+        return result
+
+    def _row(self, i: int) -> dict:
+        cents = Decimal("0.01")
+        return {
+            "client_id": int(self.client_ids[i]),
+            "used_exposure": int(self.used_exposure[i]) * cents,
+            "loan_amount": int(self.loan_amount[i]) * cents,
+            "max_exposure": int(self.max_exposure[i]) * cents,
+            "edr_percent": int(self.edr_percent[i]) * cents,
+            "edr_status": str(self.edr_status[i]),
+        }
+
+
+class BookExposureEngine:
+
+    # ------------------------------
+    # LOAD (2 queries)
+    # ------------------------------
+    @staticmethod
+    def load(client_ids=None) -> BookColumns:
+        profiles = ClientRiskProfile.objects.order_by("client_id")
+        positions = Portfolio.objects.filter(
+            client__risk_profile__isnull=False
+        ).order_by("client_id")
+
+        if client_ids is not None:
+            profiles = profiles.filter(client_id__in=client_ids)
+            positions = positions.filter(client_id__in=client_ids)
+
+        profile_rows = list(
+            profiles.values_list(
+                "client_id",
+                "leverage_multiplier",
+                "max_exposure",
+                "client__cash_balance",
+                "allow_margin",
+            )
+        )
+        position_rows = list(
+            positions.values_list(
+                "client_id",
+                "quantity",
+                "avg_price",
+                "instrument_id",
+            )
+        )
+
+        n = len(profile_rows)
+        m = len(position_rows)
+        pc = list(zip(*profile_rows)) or [(), (), (), (), ()]
+        pp = list(zip(*position_rows)) or [(), (), (), ()]
+        rates = [margin_rates.effective_rate(instrument_id) for instrument_id in pp[3]]
+
+        return BookColumns(
+            client_ids=np.fromiter(pc[0], dtype=np.int64, count=n),
+            leverage=_scaled(pc[1], 2, n),
+            max_exposure=_scaled(pc[2], 2, n),
+            cash_balance=_scaled(pc[3], 2, n),
+            allow_margin=np.fromiter(pc[4], dtype=bool, count=n),
+            position_client_ids=np.fromiter(pp[0], dtype=np.int64, count=m),
+            quantity=_scaled(pp[1], 4, m),
+            avg_price=_scaled(pp[2], 4, m),
+            margin_rate=_scaled(rates, 2, m),
+        )
+
+    # ------------------------------
+    # COMPUTE (vectorized)
+    # ------------------------------
+    @staticmethod
+    def compute(cols: BookColumns) -> BookExposure:
+        n = len(cols.client_ids)
+
+        # Position → client row (positions of clients without a profile drop out)
+        idx = np.searchsorted(cols.client_ids, cols.position_client_ids)
+        idx_clipped = np.minimum(idx, max(n - 1, 0))
+        known = (idx < n) & (
+            cols.client_ids[idx_clipped] == cols.position_client_ids
+            if n else np.zeros(len(idx), dtype=bool)
+        )
+
+        rate = cols.margin_rate
+
+        # ❌ Non-marginable / Z-board skipped, then min(board_rate, leverage)
+        live = known & (rate > 0)
+        pos_idx = idx_clipped[live]
+        applied = np.minimum(rate[live], cols.leverage[pos_idx])
+
+        qty = cols.quantity[live]
+        price = cols.avg_price[live]
+
+        # q × p stays exact in int64 below 2^62; anything larger is
+        # summed with Python ints (rare, but never silently wrong)
+        overflow = np.abs(qty.astype(np.float64) * price.astype(np.float64)) >= _INT64_SAFE
+        safe = ~overflow
+
+        notional = qty[safe] * price[safe]
+        hi, lo = np.divmod(notional, _SPLIT)
+
+        used_hi = np.zeros(n, dtype=np.int64)
+        used_lo = np.zeros(n, dtype=np.int64)
+        np.add.at(used_hi, pos_idx[safe], hi * applied[safe])
+        np.add.at(used_lo, pos_idx[safe], lo * applied[safe])
+
+        for i, q, p, a in zip(pos_idx[overflow], qty[overflow], price[overflow], applied[overflow]):
+            h, l = divmod(int(q) * int(p) * int(a), _SPLIT)
+            used_hi[i] += h
+            used_lo[i] += l
+
+        carry, used_lo = np.divmod(used_lo, _SPLIT)
+        used = _round_half_up(used_hi + carry, used_lo)
+
+        # Loan = max(0, used − cash)
+        loan = np.maximum(used - cols.cash_balance, 0)
+
+        # EDR% = used / max × 100, quantized to 0.01
+        edr = np.zeros(n, dtype=np.int64)
+        has_max = cols.max_exposure != 0
+        huge = has_max & (np.abs(used) >= _EDR_SAFE)
+        fast = has_max & ~huge
+        edr[fast] = _divide_half_even(
+            used[fast] * 100 * CENT_SCALE,
+            cols.max_exposure[fast],
+        )
+
+        for i in np.flatnonzero(huge):
+            edr[i] = _divide_half_even_int(
+                int(used[i]) * 100 * CENT_SCALE,
+                int(cols.max_exposure[i]),
+            )
+
+        status = np.select(
+            [edr < _THRESHOLDS[0], edr < _THRESHOLDS[1], edr < _THRESHOLDS[2]],
+            STATUS_LABELS[:3],
+            default=STATUS_LABELS[3],
+        )
+
+        return BookExposure(
+            client_ids=cols.client_ids,
+            used_exposure=used,
+            loan_amount=loan,
+            max_exposure=cols.max_exposure,
+            edr_percent=edr,
+            edr_status=status,
+            allow_margin=cols.allow_margin,
+        )
+
+    @staticmethod
+    def run(client_ids=None) -> BookExposure:
+        return BookExposureEngine.compute(BookExposureEngine.load(client_ids))
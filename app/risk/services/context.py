@@ -0,0 +1,67 @@
+# risk/services/context.py
+"""
+Per-request risk evaluation context.
+
+Inside `with risk_context():` RiskEngine.snapshot() is memoized per
+client, so one request's pre-trade check, loan sync, margin policy and
+breach check share a single profile + positions load.
+
+Any write that moves a client's risk state drops that client's entry:
+RiskEngine writes (allow_margin flips, liquidations) call
+invalidate_risk_context() directly, and Portfolio / ClientRiskProfile /
+Client / Instrument saves do so through risk.signals.
+
+The active context lives in a ContextVar, so threads and async tasks
+never see each other's snapshots.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_current: ContextVar["RiskContext | None"] = ContextVar("risk_context", default=None)
+
+
+class RiskContext:
+
+    def __init__(self):
+        self._snapshots = {}    # client_id → RiskSnapshot
+
+    def get(self, client_id: int):
+        return self._snapshots.get(client_id)
+
+    def put(self, client_id: int, snapshot):
+        self._snapshots[client_id] = snapshot
+
+    def invalidate(self, client_id: int | None = None):
+        if client_id is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(client_id, None)
+
+
+def current_risk_context() -> RiskContext | None:
+    return _current.get()
+
+
+@contextmanager
+def risk_context():
+    """
+    Open a memoizing context (nested calls reuse the outer one)
+    """
+    context = _current.get()
+    if context is not None:
+        yield context
+        return
+
+    context = RiskContext()
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+def invalidate_risk_context(client_id: int | None = None):
+    context = _current.get()
+    if context is not None:
+        context.invalidate(client_id)
@@ -0,0 +1,162 @@
+# risk/services/event_evaluation.py
+"""
+Consumer-side risk evaluation.
+
+The margin / portfolio consumers hand whole poll batches here. Events are
+grouped per client, all clients of the batch are loaded with one profile
+query + one positions query, and each client is evaluated once however
+many events it has in the batch:
+
+- MARGIN_REQUEST: approved while the requested amounts (in event order)
+  fit the client's available exposure; rejected when margin is disabled,
+  the EDR is at MARGIN_CALL or worse, or the amount does not fit.
+- FORCED_SELL: one RiskEngine.auto_liquidate per client.
+"""
+import logging
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+
+from risk.models import ClientRiskProfile
+from risk.services.context import risk_context
+from risk.services.risk_engine import RiskEngine, RiskSnapshot
+
+logger = logging.getLogger(__name__)
+
+BLOCKING_STATUSES = ("MARGIN_CALL", "FORCE_SELL")
+
+
+@dataclass(frozen=True)
+class MarginDecision:
+    client_id: int
+    amount: Decimal
+    approved: bool
+    available_exposure: Decimal
+    reason: str = ""
+
+    def as_dict(self) -> dict:
+        return {
+            "approved": self.approved,
+            "amount": str(self.amount),
+            "available_exposure": str(self.available_exposure),
+            "reason": self.reason,
+        }
+
+
+class RiskEventEvaluator:
+
+    @staticmethod
+    def _by_client(events) -> dict[int, list]:
+        """
+        {client_id: [events]} in first-seen order (events without a
+        usable client_id are left out)
+        """
+        grouped = {}
+        for event in events:
+            try:
+                client_id = int(event.get("client_id"))
+            except (TypeError, ValueError):
+                continue
+            grouped.setdefault(client_id, []).append(event)
+        return grouped
+
+    @staticmethod
+    def _snapshots(client_ids) -> dict[int, RiskSnapshot]:
+        profiles = ClientRiskProfile.objects.select_related("client").filter(
+            client_id__in=list(client_ids)
+        )
+        return RiskEngine.snapshots(profiles)
+
+    # ------------------------------
+    # MARGIN REQUESTS
+    # ------------------------------
+    @staticmethod
+    def margin_requests(events) -> list[MarginDecision]:
+        """
+        Approve / reject each request; the decision is also stored on the
+        event as "decision" (it lands in the request's audit row)
+        """
+        by_client = RiskEventEvaluator._by_client(events)
+        if not by_client:
+            return []
+
+        snapshots = RiskEventEvaluator._snapshots(by_client)
+        decisions = []
+
+        for client_id, requests in by_client.items():
+            snapshot = snapshots.get(client_id)
+            available = snapshot.available_exposure if snapshot else Decimal("0.00")
+
+            for event in requests:
+                try:
+                    amount = Decimal(str(event.get("amount") or 0))
+                except InvalidOperation:
+                    amount = None
+
+                if amount is None or amount < 0:
+                    reason = "invalid amount"
+                elif snapshot is None:
+                    reason = "no risk profile"
+                elif not snapshot.allow_margin:
+                    reason = "margin disabled"
+                elif snapshot.edr_status in BLOCKING_STATUSES:
+                    reason = f"EDR {snapshot.edr_status}"
+                elif amount > available:
+                    reason = "exceeds available exposure"
+                else:
+                    reason = ""
+
+                decision = MarginDecision(
+                    client_id=client_id,
+                    amount=amount if amount is not None else Decimal("0.00"),
+                    approved=not reason,
+                    available_exposure=available,
+                    reason=reason,
+                )
+                # Later requests in the batch see what this one consumed
+                if decision.approved:
+                    available -= amount
+
+                event["decision"] = decision.as_dict()
+                decisions.append(decision)
+
+        rejected = sum(1 for d in decisions if not d.approved)
+        if rejected:
+            logger.warning(f"⛔ Rejected {rejected}/{len(decisions)} margin request(s)")
+
+        return decisions
+
+    # ------------------------------
+    # FORCED SELLS
+    # ------------------------------
+    @staticmethod
+    def forced_sells(events) -> dict:
+        """
+        One auto_liquidate per client in the batch
+        ({client_id: LiquidationPlan | None})
+        """
+        by_client = RiskEventEvaluator._by_client(events)
+        if not by_client:
+            return {}
+
+        snapshots = RiskEventEvaluator._snapshots(by_client)
+        plans = {}
+
+        with risk_context() as context:
+            for client_id in by_client:
+                snapshot = snapshots.get(client_id)
+                if snapshot is None:
+                    logger.warning(f"⚠️ Forced sell for client {client_id} without a risk profile")
+                    plans[client_id] = None
+                    continue
+
+                # Plan from the bulk-loaded snapshot
+                if context.get(client_id) is None:
+                    context.put(client_id, snapshot)
+
+                plans[client_id] = RiskEngine.auto_liquidate(client_id)
+
+        sold = sum(1 for plan in plans.values() if plan is not None and plan.orders)
+        if sold:
+            logger.warning(f"🚨 Liquidated positions for {sold}/{len(plans)} client(s)")
+
+        return plans
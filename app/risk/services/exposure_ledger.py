@@ -0,0 +1,214 @@
+# risk/services/exposure_ledger.py
+"""
+Resident per-client used-exposure totals.
+
+Each position's contribution (quantity × avg_price × min(board_rate,
+leverage)) is kept next to the client's running total, so a position
+change is an O(1) replace-and-adjust instead of a re-scan.
+
+The ledger is process-local: it only sees writes made in this process
+(Portfolio signals and explicit calls). Use verify()/rebuild() to detect
+and repair drift against the database.
+"""
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+
+from core.models import Portfolio
+from core.services.margin_rates import margin_rates
+from risk.models import ClientRiskProfile
+
+logger = logging.getLogger(__name__)
+
+
+def position_exposure(quantity: Decimal, avg_price: Decimal, rate: Decimal, leverage: Decimal) -> Decimal:
+    """
+    Unrounded contribution of one position (0 for non-marginable / Z-board)
+    """
+    if rate <= 0:
+        return Decimal("0.00")
+    return quantity * avg_price * min(rate, leverage)
+
+
+class ExposureLedger:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._leverage = {}    # client_id → leverage_multiplier
+        self._positions = {}   # client_id → {instrument_id: (quantity, avg_price, rate)}
+        self._totals = {}      # client_id → unrounded used exposure
+
+    # ------------------------------
+    # READ
+    # ------------------------------
+    def used_exposure(self, client_id: int) -> Decimal:
+        with self._lock:
+            if client_id not in self._totals:
+                self.load_client(client_id)
+            if client_id not in self._totals:
+                raise ClientRiskProfile.DoesNotExist(
+                    f"No risk profile for client {client_id}"
+                )
+            total = self._totals[client_id]
+
+        return total.quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+    def is_loaded(self, client_id: int) -> bool:
+        return client_id in self._totals
+
+    def __len__(self):
+        return len(self._totals)
+
+    # ------------------------------
+    # DELTAS (O(1))
+    # ------------------------------
+    def apply_position(
+        self,
+        client_id: int,
+        instrument_id: int,
+        quantity: Decimal,
+        avg_price: Decimal,
+        rate: Decimal,
+    ):
+        """
+        Replace one position's contribution with its new state
+        """
+        with self._lock:
+            positions = self._positions.get(client_id)
+            if positions is None:
+                # Not resident yet → loaded from DB on first read
+                return
+
+            leverage = self._leverage[client_id]
+            old = positions.get(instrument_id)
+            if old is not None:
+                self._totals[client_id] -= position_exposure(*old, leverage)
+
+            positions[instrument_id] = (quantity, avg_price, rate)
+            self._totals[client_id] += position_exposure(quantity, avg_price, rate, leverage)
+
+    def remove_position(self, client_id: int, instrument_id: int):
+        with self._lock:
+            positions = self._positions.get(client_id)
+            if positions is None:
+                return
+
+            old = positions.pop(instrument_id, None)
+            if old is not None:
+                self._totals[client_id] -= position_exposure(*old, self._leverage[client_id])
+
+    def record_portfolio(self, portfolio: Portfolio, deleted: bool = False):
+        """
+        Apply a saved/deleted Portfolio row once the surrounding
+        transaction commits (rolled-back writes never reach the ledger)
+        """
+        client_id = portfolio.client_id
+        instrument_id = portfolio.instrument_id
+
+        if deleted:
+            transaction.on_commit(lambda: self.remove_position(client_id, instrument_id))
+            return
+
+        quantity = portfolio.quantity
+        avg_price = portfolio.avg_price
+        rate = margin_rates.effective_rate(instrument_id)
+
+        transaction.on_commit(
+            lambda: self.apply_position(client_id, instrument_id, quantity, avg_price, rate)
+        )
+
+    # ------------------------------
+    # LOAD / INVALIDATE
+    # ------------------------------
+    def load_client(self, client_id: int):
+        self.rebuild(client_ids=[client_id])
+
+    def invalidate(self, client_id: int | None = None):
+        with self._lock:
+            if client_id is None:
+                self._leverage.clear()
+                self._positions.clear()
+                self._totals.clear()
+                return
+
+            self._leverage.pop(client_id, None)
+            self._positions.pop(client_id, None)
+            self._totals.pop(client_id, None)
+
+    def rebuild(self, client_ids=None):
+        """
+        (Re)load totals from the DB: 2 queries for any number of clients
+        """
+        leverage, positions, totals = self._load(client_ids)
+
+        with self._lock:
+            if client_ids is None:
+                self._leverage = leverage
+                self._positions = positions
+                self._totals = totals
+            else:
+                self._leverage.update(leverage)
+                self._positions.update(positions)
+                self._totals.update(totals)
+
+        logger.info(f"📒 Exposure ledger loaded {len(totals)} client(s)")
+
+    def verify(self, client_ids=None) -> dict:
+        """
+        Compare resident totals with the DB.
+        Returns {client_id: (ledger_used, db_used)} for every drifted client.
+        """
+        with self._lock:
+            resident = dict(self._totals)
+
+        if client_ids is None:
+            client_ids = list(resident)
+        else:
+            client_ids = [c for c in client_ids if c in resident]
+
+        _, _, db_totals = self._load(client_ids)
+
+        drift = {}
+        for client_id in client_ids:
+            ledger_used = resident[client_id].quantize(Decimal("0.01"), ROUND_HALF_UP)
+            db_used = db_totals.get(client_id, Decimal("0.00")).quantize(
+                Decimal("0.01"), ROUND_HALF_UP
+            )
+            if ledger_used != db_used:
+                drift[client_id] = (ledger_used, db_used)
+
+        if drift:
+            logger.warning(f"⚠️ Exposure ledger drift for {len(drift)} client(s)")
+
+        return drift
+
+    @staticmethod
+    def _load(client_ids=None):
+        profiles = ClientRiskProfile.objects.all()
+        portfolios = Portfolio.objects.all()
+
+        if client_ids is not None:
+            profiles = profiles.filter(client_id__in=client_ids)
+            portfolios = portfolios.filter(client_id__in=client_ids)
+
+        leverage = dict(profiles.values_list("client_id", "leverage_multiplier"))
+        positions = {client_id: {} for client_id in leverage}
+        totals = {client_id: Decimal("0.00") for client_id in leverage}
+
+        for p in portfolios:
+            if p.client_id not in leverage:
+                continue
+
+            rate = margin_rates.effective_rate(p.instrument_id)
+            positions[p.client_id][p.instrument_id] = (p.quantity, p.avg_price, rate)
+            totals[p.client_id] += position_exposure(
+                p.quantity, p.avg_price, rate, leverage[p.client_id]
+            )
+
+        return leverage, positions, totals
+
+
+# Process-wide instance
+exposure_ledger = ExposureLedger()
@@ -0,0 +1,66 @@
+# risk/services/holders.py
+"""
+Instrument → holding clients.
+
+A change to an instrument's margin_rate, board or is_marginable moves the
+exposure of every client holding it, and nobody else's. holder_ids()
+answers "who holds X" from the Portfolio (instrument, client) index, so
+recompute_holders() touches those clients only (a Z-board downgrade of
+one symbol recomputes its holders, not the whole book):
+
+- their exposure-ledger entries are dropped (the rest stay resident)
+- post-trade evaluation is queued for them through the recompute
+  scheduler, which loads and evaluates them in batches
+"""
+import logging
+
+from core.models import Instrument, Portfolio
+from core.services.margin_rates import margin_rates
+from risk.services.exposure_ledger import exposure_ledger
+from risk.services.recompute import recompute_scheduler
+
+logger = logging.getLogger(__name__)
+
+RISK_FIELDS = ("margin_rate", "board", "is_marginable")
+
+
+def holder_ids(instrument_id: int) -> list[int]:
+    """
+    Clients with a position in the instrument (index-only scan)
+    """
+    return list(
+        Portfolio.objects.filter(instrument_id=instrument_id)
+        .order_by("client_id")
+        .values_list("client_id", flat=True)
+    )
+
+
+def risk_fields(instrument_id: int) -> dict | None:
+    return Instrument.objects.filter(pk=instrument_id).values(*RISK_FIELDS).first()
+
+
+def risk_fields_changed(instance: Instrument) -> bool:
+    """
+    Compare with the values stashed by the pre_save receiver
+    """
+    before = getattr(instance, "_risk_fields_before", None)
+    if before is None:
+        return False
+    return any(before[name] != getattr(instance, name) for name in RISK_FIELDS)
+
+
+def recompute_holders(instrument_id: int) -> int:
+    """
+    Re-evaluate the instrument's holders (call after commit)
+    """
+    client_ids = holder_ids(instrument_id)
+
+    # Holders must see the new board rate, whatever ran first
+    margin_rates.invalidate()
+    for client_id in client_ids:
+        exposure_ledger.invalidate(client_id)
+
+    recompute_scheduler.mark_many(client_ids, post_trade=True)
+
+    logger.info(f"🔁 Instrument {instrument_id} changed: recomputing {len(client_ids)} holder(s)")
+    return len(client_ids)
@@ -0,0 +1,188 @@
+# risk/services/liquidation.py
+"""
+Liquidation planner: simulate the 25% tranches of RiskEngine.auto_liquidate
+in memory, then apply the whole plan with one bulk_update + one bulk_create.
+"""
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+
+from core.models import AuditLog, Portfolio
+from core.outbox import enqueue_batch
+from core.producers import publish_position_updated
+from risk.constants import UTILIZATION_LEVELS
+from risk.services.exposure_ledger import exposure_ledger
+
+
+TRANCHE = Decimal("0.25")
+
+
+@dataclass(frozen=True)
+class LiquidationOrder:
+    portfolio_id: int
+    instrument_id: int
+    symbol: str
+    margin_rate: Decimal
+    avg_price: Decimal
+    quantity_before: Decimal
+    quantity_sold: Decimal
+    quantity_after: Decimal
+
+
+@dataclass(frozen=True)
+class LiquidationPlan:
+    client_id: int
+    max_exposure: Decimal
+    used_before: Decimal
+    used_after: Decimal
+    utilization_before: Decimal
+    utilization_after: Decimal
+    orders: tuple[LiquidationOrder, ...] = ()
+
+    def as_dict(self) -> dict:
+        return {
+            "client_id": self.client_id,
+            "max_exposure": str(self.max_exposure),
+            "used_before": str(self.used_before),
+            "used_after": str(self.used_after),
+            "utilization_before": str(self.utilization_before),
+            "utilization_after": str(self.utilization_after),
+            "orders": [
+                {
+                    "instrument": order.symbol,
+                    "quantity_before": str(order.quantity_before),
+                    "quantity_sold": str(order.quantity_sold),
+                    "quantity_after": str(order.quantity_after),
+                }
+                for order in self.orders
+            ],
+        }
+
+
+def _utilization(exposure: Decimal, max_exposure: Decimal) -> tuple[Decimal, Decimal]:
+    used = exposure.quantize(Decimal("0.01"), ROUND_HALF_UP)
+    return used, ((used / max_exposure) * Decimal("100")).quantize(Decimal("0.01"))
+
+
+class LiquidationPlanner:
+
+    @staticmethod
+    def plan(client_id: int, snapshot=None) -> LiquidationPlan | None:
+        """
+        Build the sell plan from one snapshot (None when max exposure is 0)
+        """
+        from risk.services.risk_engine import RiskEngine
+
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
+        max_exposure = snapshot.max_exposure
+
+        if max_exposure == 0:
+            return None
+
+        warning_limit = UTILIZATION_LEVELS["WARNING"]
+
+        # Highest board-rate exposure first (same order as before)
+        candidates = [pos for pos in snapshot.positions if pos.margin_rate > 0]
+        candidates.sort(
+            key=lambda pos: pos.quantity * pos.avg_price * pos.margin_rate,
+            reverse=True,
+        )
+
+        exposure = sum((pos.exposure for pos in snapshot.positions), Decimal("0.00"))
+        used_before, utilization_before = _utilization(exposure, max_exposure)
+        used, utilization = used_before, utilization_before
+
+        orders = []
+
+        for pos in candidates:
+
+            if utilization < warning_limit:
+                break
+
+            if pos.quantity <= 0:
+                continue
+
+            # Sell 25% of position per iteration (controlled liquidation)
+            sell_qty = (pos.quantity * TRANCHE).quantize(Decimal("0.0001"))
+
+            if sell_qty <= 0:
+                sell_qty = pos.quantity
+
+            orders.append(
+                LiquidationOrder(
+                    portfolio_id=pos.portfolio_id,
+                    instrument_id=pos.instrument_id,
+                    symbol=pos.symbol,
+                    margin_rate=pos.margin_rate,
+                    avg_price=pos.avg_price,
+                    quantity_before=pos.quantity,
+                    quantity_sold=sell_qty,
+                    quantity_after=pos.quantity - sell_qty,
+                )
+            )
+
+            exposure -= sell_qty * pos.avg_price * pos.applied_rate
+            used, utilization = _utilization(exposure, max_exposure)
+
+        return LiquidationPlan(
+            client_id=client_id,
+            max_exposure=max_exposure,
+            used_before=used_before,
+            used_after=used,
+            utilization_before=utilization_before,
+            utilization_after=utilization,
+            orders=tuple(orders),
+        )
+
+    @staticmethod
+    @transaction.atomic
+    def execute(plan: LiquidationPlan):
+        """
+        Apply a plan: one bulk_update of quantities, one bulk_create of audits
+        """
+        if not plan.orders:
+            return
+
+        positions = [
+            Portfolio(
+                id=order.portfolio_id,
+                client_id=plan.client_id,
+                instrument_id=order.instrument_id,
+                quantity=order.quantity_after,
+            )
+            for order in plan.orders
+        ]
+        Portfolio.objects.bulk_update(positions, ["quantity"])
+
+        # bulk_update skips Portfolio signals → publish the new quantities here
+        with enqueue_batch():
+            for position in positions:
+                publish_position_updated(position, quantity=position.quantity)
+
+        AuditLog.objects.bulk_create(
+            [
+                AuditLog(
+                    event_type="AUTO_LIQUIDATION_EXECUTED",
+                    client_id=plan.client_id,
+                    details={
+                        "instrument": order.symbol,
+                        "quantity_sold": str(order.quantity_sold),
+                    },
+                )
+                for order in plan.orders
+            ]
+        )
+
+        # bulk_update skips Portfolio signals → feed the ledger directly
+        def _apply_to_ledger():
+            for order in plan.orders:
+                exposure_ledger.apply_position(
+                    plan.client_id,
+                    order.instrument_id,
+                    order.quantity_after,
+                    order.avg_price,
+                    order.margin_rate,
+                )
+
+        transaction.on_commit(_apply_to_ledger)
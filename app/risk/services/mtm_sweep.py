@@ -0,0 +1,257 @@
+# risk/services/mtm_sweep.py
+"""
+End-of-day MTM sweep: RiskEngine.enforce_post_trade over every client,
+sharded by client id across worker processes.
+
+Each shard is triaged with BookExposureEngine (3 queries, vectorized):
+only clients whose loan, margin flag or breach state would change are
+loaded as snapshots and enforced; everyone else is counted and skipped.
+Both the triage and the snapshots read board rates from margin_rates.
+
+Shards are contiguous ranges of the sorted client ids, so a checkpoint
+can record finished shards as (first_id, last_id) and a resumed sweep
+skips every client inside them.
+
+Workers are spawned, so this module imports no models at load time
+(Django is set up by init_worker before any shard runs).
+"""
+import bisect
+import json
+import logging
+import os
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal
+
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ShardResult:
+    first_id: int
+    last_id: int
+    clients: int = 0
+    enforced: int = 0
+    elapsed: float = 0.0
+    margin_calls: int = 0
+    force_sells: int = 0
+    breaches: int = 0
+    errors: list = field(default_factory=list)    # [(client_id, message)]
+    worker_pid: int = 0
+
+    @property
+    def key(self) -> str:
+        return f"{self.first_id}-{self.last_id}"
+
+    @property
+    def throughput(self) -> float:
+        return self.clients / self.elapsed if self.elapsed else 0.0
+
+
+# ------------------------------
+# SHARDING
+# ------------------------------
+def client_ids_to_sweep(completed=()) -> list[int]:
+    """
+    Sorted ids of clients with a risk profile, minus finished ranges
+    """
+    from risk.models import ClientRiskProfile
+
+    ids = ClientRiskProfile.objects.order_by("client_id").values_list(
+        "client_id", flat=True
+    )
+
+    ranges = sorted(completed)
+    starts = [lo for lo, _ in ranges]
+
+    def done(client_id):
+        i = bisect.bisect_right(starts, client_id) - 1
+        return i >= 0 and client_id <= ranges[i][1]
+
+    return [client_id for client_id in ids if not done(client_id)]
+
+
+def shard(client_ids: list[int], shard_size: int) -> list[list[int]]:
+    return [
+        client_ids[i:i + shard_size]
+        for i in range(0, len(client_ids), shard_size)
+    ]
+
+
+# ------------------------------
+# WORKER
+# ------------------------------
+def init_worker():
+    """
+    Process-pool initializer: make Django usable in the child and make
+    sure it never reuses a connection inherited from the parent
+    """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+    connections.close_all()
+
+
+def sweep_shard(client_ids: list[int]) -> ShardResult:
+    """
+    Enforce post-trade policy for one shard: the book engine finds the
+    clients that need it, their profiles and positions are preloaded
+    with 2 queries, then each of them runs on its snapshot
+    """
+    from risk.models import ClientRiskProfile
+    from risk.services.book_exposure import BookExposureEngine
+    from risk.services.risk_engine import RiskEngine, RiskViolation
+
+    result = ShardResult(
+        first_id=client_ids[0],
+        last_id=client_ids[-1],
+        worker_pid=os.getpid(),
+    )
+    started = time.perf_counter()
+
+    # Clients whose profile was removed since the ids were listed drop out
+    book = BookExposureEngine.run(client_ids)
+    result.clients = len(book)
+
+    counted = book.edr_status[book.max_exposure != 0]
+    result.margin_calls = int((counted == "MARGIN_CALL").sum())
+    result.force_sells = int((counted == "FORCE_SELL").sum())
+
+    due = book.client_ids[needs_enforcement(book, stored_loans(book.client_ids))].tolist()
+
+    profiles = ClientRiskProfile.objects.select_related("client").filter(
+        client_id__in=due
+    )
+    snapshots = RiskEngine.snapshots(profiles) if due else {}
+
+    for client_id in due:
+        snapshot = snapshots.get(client_id)
+        if snapshot is None:
+            continue
+
+        result.enforced += 1
+
+        try:
+            RiskEngine.enforce_post_trade(client_id, snapshot=snapshot)
+        except RiskViolation:
+            result.breaches += 1
+        except Exception as e:
+            logger.exception(f"❌ MTM sweep failed for client {client_id}")
+            result.errors.append((client_id, str(e)))
+
+    result.elapsed = time.perf_counter() - started
+
+    return result
+
+
+# ------------------------------
+# TRIAGE
+# ------------------------------
+def stored_loans(client_ids):
+    """
+    Latest MarginLoan per client in cents (-1 for none), aligned on
+    client_ids (1 query)
+    """
+    import numpy as np
+    from core.models import MarginLoan
+
+    latest = {}
+    rows = (
+        MarginLoan.objects.filter(client_id__in=client_ids.tolist())
+        .order_by("client_id", "-created_at")
+        .values_list("client_id", "loan_amount")
+    )
+    for client_id, amount in rows:
+        latest.setdefault(client_id, amount)
+
+    return np.fromiter(
+        (
+            int(Decimal(latest[c]).scaleb(2)) if c in latest else -1
+            for c in client_ids.tolist()
+        ),
+        dtype=np.int64,
+        count=len(client_ids),
+    )
+
+
+def needs_enforcement(book, loans):
+    """
+    Mask of the book's clients RiskEngine.enforce_post_trade would act
+    on: a loan to sync, a margin flag to flip, a liquidation or a breach
+    (loans: stored_loans() for book.client_ids)
+    """
+    import numpy as np
+
+    loan_out_of_sync = np.where(
+        book.loan_amount > 0,
+        loans != book.loan_amount,
+        loans >= 0,
+    )
+
+    status = book.edr_status
+    policy = (book.max_exposure != 0) & (
+        (status == "FORCE_SELL")
+        | ((status == "MARGIN_CALL") & book.allow_margin)
+        | (np.isin(status, ("SAFE", "WARNING")) & ~book.allow_margin)
+    )
+
+    breach = book.used_exposure > book.max_exposure
+
+    return loan_out_of_sync | policy | breach
+
+
+# ------------------------------
+# CHECKPOINT
+# ------------------------------
+class SweepCheckpoint:
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.shards = {}    # "first-last" → ShardResult as dict
+
+    @classmethod
+    def load(cls, path: str) -> "SweepCheckpoint":
+        checkpoint = cls(path)
+
+        if os.path.exists(path):
+            with open(path) as f:
+                checkpoint.shards = json.load(f).get("shards", {})
+
+        return checkpoint
+
+    @property
+    def completed(self) -> list[tuple[int, int]]:
+        return [(s["first_id"], s["last_id"]) for s in self.shards.values()]
+
+    def results(self) -> list[ShardResult]:
+        return [ShardResult(**s) for s in self.shards.values()]
+
+    def record(self, result: ShardResult):
+        self.shards[result.key] = asdict(result)
+
+        if not self.path:
+            return
+
+        # Write-then-rename: a crash never leaves a half-written file
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"shards": self.shards}, f)
+        os.replace(tmp, self.path)
+
+
+def stragglers(results: list[ShardResult], factor: float) -> list[ShardResult]:
+    """
+    Shards that took more than factor × the median shard time
+    """
+    if len(results) < 2:
+        return []
+
+    median = statistics.median(r.elapsed for r in results)
+
+    return [r for r in results if median and r.elapsed > factor * median]
@@ -0,0 +1,201 @@
+# risk/services/recompute.py
+"""
+Per-client debounce of risk recomputation.
+
+Writes that move a client's risk state mark the client dirty instead of
+recomputing on the spot:
+
+- "profile"    → ClientRiskProfile.recalculate() (max exposure from cash)
+- "post_trade" → RiskEngine.enforce_post_trade() (loan sync + margin policy)
+
+A burst of fills for one client then costs one recomputation:
+
+- RISK_RECOMPUTE_WINDOW_MS > 0: dirty clients are recomputed together
+  once the window elapses (after commit, on a timer thread)
+- RISK_RECOMPUTE_WINDOW_MS = 0: recomputed immediately (previous behaviour)
+- inside `with recompute_scheduler.batch():` recomputed once at the end of
+  the block (after commit), whatever the window
+
+Pre-trade checks don't wait for it: RiskEngine.pre_trade_snapshot()
+applies both recomputes inline, so a client still pending (here or in
+another process) is checked against its current cash and utilization.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from core.models import AuditLog
+from risk.models import ClientRiskProfile
+from risk.services.context import invalidate_risk_context
+
+logger = logging.getLogger(__name__)
+
+PROFILE = "profile"
+POST_TRADE = "post_trade"
+
+_batch: ContextVar["dict | None"] = ContextVar("recompute_batch", default=None)
+
+
+class RecomputeScheduler:
+
+    def __init__(self, window_ms: int | None = None):
+        self._window_ms = window_ms
+        self._pending = {}       # client_id → {tasks}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def window_ms(self) -> int:
+        if self._window_ms is not None:
+            return self._window_ms
+        return getattr(settings, "RISK_RECOMPUTE_WINDOW_MS", 0)
+
+    def pending(self) -> dict:
+        with self._lock:
+            pending = {client_id: set(tasks) for client_id, tasks in self._pending.items()}
+        for client_id, tasks in (_batch.get() or {}).items():
+            pending.setdefault(client_id, set()).update(tasks)
+        return pending
+
+    # ------------------------------
+    # MARK
+    # ------------------------------
+    def mark(self, client_id: int, profile: bool = False, post_trade: bool = False):
+        self.mark_many([client_id], profile=profile, post_trade=post_trade)
+
+    def mark_many(self, client_ids, profile: bool = False, post_trade: bool = False):
+        tasks = {task for task, wanted in ((PROFILE, profile), (POST_TRADE, post_trade)) if wanted}
+        marked = {client_id: set(tasks) for client_id in client_ids}
+        if not tasks or not marked:
+            return
+
+        batch = _batch.get()
+        if batch is not None:
+            for client_id, client_tasks in marked.items():
+                batch.setdefault(client_id, set()).update(client_tasks)
+            return
+
+        if self.window_ms <= 0:
+            self._run(marked)
+            return
+
+        # Recompute only from committed state
+        transaction.on_commit(lambda: self._enqueue(marked))
+
+    @contextmanager
+    def batch(self):
+        """
+        Defer every mark in the block to one recomputation per client at
+        its end (nested blocks join the outer one)
+        """
+        if _batch.get() is not None:
+            yield
+            return
+
+        marked = {}
+        token = _batch.set(marked)
+        try:
+            yield
+        finally:
+            _batch.reset(token)
+            if marked:
+                # Runs at once in autocommit; dropped if the block rolls back
+                transaction.on_commit(lambda: self._run(marked))
+
+    # ------------------------------
+    # FLUSH
+    # ------------------------------
+    def flush(self, client_ids=None):
+        """
+        Recompute dirty clients now (all, or only client_ids)
+        """
+        due = {}
+        batch = _batch.get()
+
+        with self._lock:
+            for source in (self._pending, batch or {}):
+                ids = list(source) if client_ids is None else [c for c in client_ids if c in source]
+                for client_id in ids:
+                    due.setdefault(client_id, set()).update(source.pop(client_id))
+            if not self._pending and self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if due:
+            self._run(due)
+
+    def _enqueue(self, marked: dict):
+        with self._lock:
+            for client_id, tasks in marked.items():
+                self._pending.setdefault(client_id, set()).update(tasks)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window_ms / 1000, self._flush_due)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_due(self):
+        with self._lock:
+            due, self._pending = self._pending, {}
+            self._timer = None
+
+        # Timer thread: own DB connection, errors logged not raised
+        close_old_connections()
+        try:
+            self._run(due, raise_errors=False)
+        finally:
+            close_old_connections()
+
+    # ------------------------------
+    # RUN
+    # ------------------------------
+    @staticmethod
+    def _run(due: dict, raise_errors: bool = True):
+        """
+        Recompute in chunks of RISK_RECOMPUTE_BATCH_SIZE clients: one
+        profile query + one positions query per chunk
+        """
+        from risk.services.risk_engine import RiskEngine, RiskViolation
+
+        batch_size = max(1, getattr(settings, "RISK_RECOMPUTE_BATCH_SIZE", 500))
+        client_ids = list(due)
+
+        for start in range(0, len(client_ids), batch_size):
+            chunk = client_ids[start:start + batch_size]
+            profiles = list(
+                ClientRiskProfile.objects.select_related("client").filter(client_id__in=chunk)
+            )
+
+            # Profile first: post-trade reads the new max exposure
+            recalculated = [p for p in profiles if PROFILE in due[p.client_id]]
+            for profile in recalculated:
+                profile.recalculate(save=False)
+                invalidate_risk_context(profile.client_id)
+            if recalculated:
+                ClientRiskProfile.objects.bulk_update(recalculated, ["max_exposure"])
+
+            post_trade = [p for p in profiles if POST_TRADE in due[p.client_id]]
+            snapshots = RiskEngine.snapshots(post_trade) if post_trade else {}
+
+            for profile in post_trade:
+                client_id = profile.client_id
+                try:
+                    RiskEngine.enforce_post_trade(client_id, snapshot=snapshots[client_id])
+                except RiskViolation as e:
+                    AuditLog.objects.create(
+                        event_type="POST_TRADE_RISK_BREACH",
+                        client_id=client_id,
+                        details={"reason": str(e)},
+                    )
+                except Exception as e:
+                    if raise_errors:
+                        raise
+                    logger.error(f"❌ Risk recompute failed for client {client_id}: {e}", exc_info=True)
+
+        logger.debug(f"🔁 Recomputed risk for {len(due)} client(s)")
+
+
+recompute_scheduler = RecomputeScheduler()
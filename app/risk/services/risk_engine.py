@@ -1,88 +1,303 @@
+from dataclasses import dataclass, replace
 from decimal import Decimal, ROUND_HALF_UP
-from core.models import Client, Portfolio, Instrument, AuditLog, MarginLoan
+from core.models import Portfolio, Instrument, AuditLog, MarginLoan
+from core.producers import publish_margin_policy_changed
+from core.services.margin_rates import margin_rates
+from django.conf import settings
 from django.db import transaction
 from risk.models import ClientRiskProfile
 from risk.constants import BOARD_LEVERAGE, UTILIZATION_LEVELS
+from risk.services.context import (
+    current_risk_context,
+    invalidate_risk_context,
+    risk_context,
+)
+from risk.services.exposure_ledger import exposure_ledger
+from risk.services.liquidation import LiquidationPlanner
 
 
 class RiskViolation(Exception):
     pass
 
 
+# ------------------------------
+# SNAPSHOT (READ MODEL)
+# ------------------------------
+
+@dataclass(frozen=True)
+class PositionExposure:
+    portfolio_id: int
+    instrument_id: int
+    symbol: str
+    quantity: Decimal
+    avg_price: Decimal
+    margin_rate: Decimal   # board rate (Instrument.effective_margin_rate)
+    applied_rate: Decimal  # min(board_rate, client_leverage), 0 if blocked
+    exposure: Decimal      # unrounded quantity × avg_price × applied_rate
+
+
+@dataclass(frozen=True)
+class RiskSnapshot:
+    """
+    Immutable view of one client's risk state, loaded in a single pass
+    """
+
+    client_id: int
+    client_name: str
+    cash_balance: Decimal
+    max_exposure: Decimal
+    leverage_multiplier: Decimal
+    allow_margin: bool
+    used_exposure: Decimal
+    loan_amount: Decimal
+    edr_percent: Decimal
+    edr_status: str
+    positions: tuple[PositionExposure, ...] = ()
+
+    @property
+    def available_exposure(self) -> Decimal:
+        available = self.max_exposure - self.used_exposure
+
+        if available < 0:
+            return Decimal("0.00")
+
+        return available.quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+
+@dataclass(frozen=True)
+class PreTradeOrder:
+    instrument: Instrument
+    side: str
+    quantity: Decimal
+    price: Decimal
+    is_margin: bool = True
+
+
+@dataclass(frozen=True)
+class PreTradeDecision:
+    order: PreTradeOrder
+    accepted: bool
+    required: Decimal      # exposure this order consumes (0 for SELL)
+    remaining: Decimal     # available exposure after this order
+    reason: str = ""
+
+
 class RiskEngine:
-    
+
     # ------------------------------
-    # LOAN CALCULATION
+    # SNAPSHOT
     # ------------------------------
-    
-    
+
     @staticmethod
-    def loan_amount(client_id: int) -> Decimal:
+    def snapshot(
+        client_id: int,
+        profile: ClientRiskProfile | None = None,
+    ) -> RiskSnapshot:
         """
-        Loan = max(0, Used Exposure − Cash Balance)
+        Load profile, client, positions and instruments once
+        (2 queries, or 1 when an already-loaded profile is passed).
+        Memoized per client inside risk_context().
         """
 
-        client = Client.objects.get(id=client_id)
+        context = current_risk_context()
+        if context is not None:
+            cached = context.get(client_id)
+            if cached is not None:
+                return cached
 
-        used = RiskEngine.calculate_current_exposure(client_id)
-        cash = client.cash_balance or Decimal("0.00")
+        if profile is None:
+            profile = ClientRiskProfile.objects.select_related("client").get(
+                client_id=client_id
+            )
 
-        loan = used - cash
+        portfolios = Portfolio.objects.filter(client_id=client_id)
 
-        if loan < 0:
-            loan = Decimal("0.00")
-
-        return loan.quantize(Decimal("0.01"), ROUND_HALF_UP)
+        snapshot = RiskEngine.build_snapshot(profile, portfolios)
 
+        if context is not None:
+            context.put(client_id, snapshot)
 
+        return snapshot
 
-    # ------------------------------
-    # EXPOSURE CALCULATION
-    # ------------------------------
-        
     @staticmethod
-    def calculate_current_exposure(client_id: int) -> Decimal:
+    def snapshots(profiles) -> dict[int, RiskSnapshot]:
         """
-        Used Exposure =
-        Σ(position_value × min(board_rate, client_leverage))
+        Snapshots for many already-loaded profiles with one positions
+        query ({client_id: RiskSnapshot})
         """
 
-        exposure = Decimal("0.00")
+        profiles = list(profiles)
 
-        profile = ClientRiskProfile.objects.get(client_id=client_id)
+        by_client = {profile.client_id: [] for profile in profiles}
 
-        portfolios = (
-            Portfolio.objects
-            .select_related("instrument")
-            .filter(client_id=client_id)
-        )
+        portfolios = Portfolio.objects.filter(client_id__in=list(by_client))
+        for p in portfolios:
+            by_client[p.client_id].append(p)
+
+        return {
+            profile.client_id: RiskEngine.build_snapshot(profile, by_client[profile.client_id])
+            for profile in profiles
+        }
+
+    @staticmethod
+    def build_snapshot(profile: ClientRiskProfile, portfolios) -> RiskSnapshot:
+        """
+        Fold already-loaded positions into a RiskSnapshot; board rates
+        come from the memoized margin-rate table
+        """
+
+        leverage = profile.leverage_multiplier
+
+        exposure = Decimal("0.00")
+        positions = []
 
         for p in portfolios:
-            instrument = p.instrument
-            rate = instrument.effective_margin_rate()
+            instrument = margin_rates.get(p.instrument_id)
+            rate = instrument.effective_rate
 
             # ❌ Non-marginable or Z-board
             if rate <= 0:
-                continue
+                applied_rate = Decimal("0.00")
+                position_exposure = Decimal("0.00")
+            else:
+                applied_rate = min(rate, leverage)
+                position_exposure = p.quantity * p.avg_price * applied_rate
+                exposure += position_exposure
+
+            positions.append(
+                PositionExposure(
+                    portfolio_id=p.id,
+                    instrument_id=p.instrument_id,
+                    symbol=instrument.symbol,
+                    quantity=p.quantity,
+                    avg_price=p.avg_price,
+                    margin_rate=rate,
+                    applied_rate=applied_rate,
+                    exposure=position_exposure,
+                )
+            )
+
+        used = exposure.quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+        return RiskEngine._snapshot_from(profile, used, tuple(positions))
+
+    @staticmethod
+    def ledger_snapshot(
+        client_id: int,
+        profile: ClientRiskProfile | None = None,
+    ) -> RiskSnapshot:
+        """
+        Snapshot whose used exposure comes from the resident exposure
+        ledger (profile lookup only, no position scan, no breakdown)
+        """
 
-            effective_rate = min(rate, profile.leverage_multiplier)
+        if profile is None:
+            profile = ClientRiskProfile.objects.select_related("client").get(
+                client_id=client_id
+            )
+        used = exposure_ledger.used_exposure(client_id)
 
-            exposure += p.quantity * p.avg_price * effective_rate
+        return RiskEngine._snapshot_from(profile, used, ())
 
-        return exposure.quantize(Decimal("0.01"), ROUND_HALF_UP)
+    @staticmethod
+    def pre_trade_snapshot(client_id: int) -> RiskSnapshot:
+        """
+        Snapshot with the deferred recomputes applied inline: max exposure
+        from the current cash, and margin off when the current utilization
+        calls for it (re-enabling is left to enforce_margin_policy). Pending
+        recomputes (in this process or another) don't go stale here.
+        """
+
+        profile = ClientRiskProfile.objects.select_related("client").get(
+            client_id=client_id
+        )
+        profile.recalculate(save=False)
+
+        if getattr(settings, "RISK_EXPOSURE_LEDGER", False):
+            # Resident totals: no position scan on the order path
+            snapshot = RiskEngine.ledger_snapshot(client_id, profile=profile)
+        else:
+            snapshot = RiskEngine.build_snapshot(
+                profile, Portfolio.objects.filter(client_id=client_id)
+            )
+
+        # Same disable rule as enforce_margin_policy
+        if (
+            snapshot.allow_margin
+            and snapshot.max_exposure != 0
+            and snapshot.edr_status in ("MARGIN_CALL", "FORCE_SELL")
+        ):
+            snapshot = replace(snapshot, allow_margin=False)
+        return snapshot
 
     @staticmethod
-    def available_exposure(client_id: int) -> Decimal:
-        profile = ClientRiskProfile.objects.get(client_id=client_id)
+    def _snapshot_from(profile: ClientRiskProfile, used: Decimal, positions: tuple) -> RiskSnapshot:
+        client = profile.client
+        cash = client.cash_balance or Decimal("0.00")
 
-        used = RiskEngine.calculate_current_exposure(client_id)
+        loan = used - cash
+        if loan < 0:
+            loan = Decimal("0.00")
+        loan = loan.quantize(Decimal("0.01"), ROUND_HALF_UP)
 
-        available = profile.max_exposure - used
+        if profile.max_exposure == 0:
+            utilization = Decimal("0.00")
+        else:
+            utilization = (
+                (used / profile.max_exposure) * Decimal("100")
+            ).quantize(Decimal("0.01"))
+
+        return RiskSnapshot(
+            client_id=profile.client_id,
+            client_name=client.name,
+            cash_balance=cash,
+            max_exposure=profile.max_exposure,
+            leverage_multiplier=profile.leverage_multiplier,
+            allow_margin=profile.allow_margin,
+            used_exposure=used,
+            loan_amount=loan,
+            edr_percent=utilization,
+            edr_status=RiskEngine.status_for_utilization(utilization),
+            positions=positions,
+        )
 
-        if available < 0:
-            return Decimal("0.00")
+    # ------------------------------
+    # LOAN CALCULATION
+    # ------------------------------
 
-        return available.quantize(Decimal("0.01"), ROUND_HALF_UP)
+    @staticmethod
+    def loan_amount(client_id: int, snapshot: RiskSnapshot | None = None) -> Decimal:
+        """
+        Loan = max(0, Used Exposure − Cash Balance)
+        """
+
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
+        return snapshot.loan_amount
+
+    # ------------------------------
+    # EXPOSURE CALCULATION
+    # ------------------------------
+
+    @staticmethod
+    def calculate_current_exposure(
+        client_id: int,
+        snapshot: RiskSnapshot | None = None,
+    ) -> Decimal:
+        """
+        Used Exposure =
+        Σ(position_value × min(board_rate, client_leverage))
+        """
+
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
+        return snapshot.used_exposure
+
+    @staticmethod
+    def available_exposure(
+        client_id: int,
+        snapshot: RiskSnapshot | None = None,
+    ) -> Decimal:
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
+        return snapshot.available_exposure
 
 
 
@@ -98,6 +313,7 @@ class RiskEngine:
         quantity: Decimal,
         price: Decimal,
         is_margin: bool,
+        snapshot: RiskSnapshot | None = None,
     ):
         side = side.upper()
 
@@ -105,14 +321,87 @@ class RiskEngine:
         if side == "SELL":
             return
 
-        profile = ClientRiskProfile.objects.get(client_id=client_id)
+        # Strictly current, whether or not the deferred recompute has run
+        snapshot = snapshot or RiskEngine.pre_trade_snapshot(client_id)
+
+        required = RiskEngine._required_exposure(
+            snapshot, instrument, quantity, price, is_margin
+        )
+
+        # --- RULE 5: exposure availability ---
+        available = snapshot.available_exposure
+
+        if required > available:
+            raise RiskViolation(
+                f"Exposure exceeded. Required={required}, Available={available}"
+            )
+
+    @staticmethod
+    def check_pre_trade_basket(
+        *,
+        client_id: int,
+        orders,
+        snapshot: RiskSnapshot | None = None,
+    ) -> list[PreTradeDecision]:
+        """
+        Check a basket of orders in sequence against one snapshot:
+        every accepted BUY consumes exposure for the orders after it
+        """
+
+        snapshot = snapshot or RiskEngine.pre_trade_snapshot(client_id)
+
+        remaining = snapshot.available_exposure
+        decisions = []
+
+        for order in orders:
+
+            # ✅ SELL always allowed
+            if order.side.upper() == "SELL":
+                decisions.append(
+                    PreTradeDecision(order, True, Decimal("0.00"), remaining)
+                )
+                continue
+
+            try:
+                required = RiskEngine._required_exposure(
+                    snapshot, order.instrument, order.quantity, order.price, order.is_margin
+                )
+                if required > remaining:
+                    raise RiskViolation(
+                        f"Exposure exceeded. Required={required}, Available={remaining}"
+                    )
+            except RiskViolation as e:
+                decisions.append(
+                    PreTradeDecision(order, False, Decimal("0.00"), remaining, str(e))
+                )
+                continue
+
+            remaining -= required
+            decisions.append(PreTradeDecision(order, True, required, remaining))
+
+        return decisions
+
+    @staticmethod
+    def _required_exposure(
+        snapshot: RiskSnapshot,
+        instrument: Instrument,
+        quantity: Decimal,
+        price: Decimal,
+        is_margin: bool,
+    ) -> Decimal:
+        """
+        Hard rules 1–4 for one BUY; returns the exposure it would consume
+        """
 
         # --- RULE 1: client margin disabled ---
-        if is_margin and not profile.allow_margin:
+        if is_margin and not snapshot.allow_margin:
             raise RiskViolation(
                 "Margin disabled due to FORCE SELL"
             )
 
+        # Hard blocks read the instrument row passed in, not the
+        # per-process rate table (a board change must apply at once)
+
         # --- RULE 2: instrument marginable ---
         if is_margin and not instrument.is_marginable:
             raise RiskViolation(
@@ -127,37 +416,30 @@ class RiskEngine:
 
         # --- RULE 4: effective rate ---
         rate = instrument.effective_margin_rate()
-        effective_rate = min(rate, profile.leverage_multiplier)
+        effective_rate = min(rate, snapshot.leverage_multiplier)
 
         if effective_rate <= 0:
             raise RiskViolation("Margin rate is zero")
 
-        # --- RULE 5: exposure availability ---
         trade_value = (quantity * price).quantize(Decimal("0.01"))
-        required = (trade_value * effective_rate).quantize(Decimal("0.01"))
-
-        available = RiskEngine.available_exposure(client_id)
-
-        if required > available:
-            raise RiskViolation(
-                f"Exposure exceeded. Required={required}, Available={available}"
-            )
+        return (trade_value * effective_rate).quantize(Decimal("0.01"))
 
 
 
 
     @staticmethod
     @transaction.atomic
-    def sync_margin_loan(client_id: int):
+    def sync_margin_loan(client_id: int, snapshot: RiskSnapshot | None = None):
         """
         Auto-create / update / close MarginLoan
         based on Loan = max(0, Used − Cash)
         """
 
-        loan_amount = RiskEngine.loan_amount(client_id)
+        loan_amount = RiskEngine.loan_amount(client_id, snapshot=snapshot)
 
         loan = (
             MarginLoan.objects
+            .select_related("client")
             .filter(client_id=client_id)
             .order_by("-created_at")
             .first()
@@ -212,23 +494,27 @@ class RiskEngine:
     # POST-TRADE / MTM
     # ------------------------------
     @staticmethod
-    def enforce_post_trade(client_id: int):
+    def enforce_post_trade(client_id: int, snapshot: RiskSnapshot | None = None):
         """
         Post-trade / MTM enforcement
+        (one snapshot for all steps unless a step writes risk state)
         """
 
-        # 1️⃣ Sync loan first
-        RiskEngine.sync_margin_loan(client_id)
+        with risk_context() as context:
+            if snapshot is not None and context.get(client_id) is None:
+                context.put(client_id, snapshot)
 
-        # 2️⃣ Apply margin policy
-        RiskEngine.enforce_margin_policy(client_id)
+            # 1️⃣ Sync loan first
+            RiskEngine.sync_margin_loan(client_id)
 
-        profile = ClientRiskProfile.objects.get(client_id=client_id)
-        used = RiskEngine.calculate_current_exposure(client_id)
+            # 2️⃣ Apply margin policy
+            RiskEngine.enforce_margin_policy(client_id)
 
-        if used > profile.max_exposure:
+            snapshot = RiskEngine.snapshot(client_id)
+
+        if snapshot.used_exposure > snapshot.max_exposure:
             raise RiskViolation(
-                f"Exposure breach: {used} > {profile.max_exposure}"
+                f"Exposure breach: {snapshot.used_exposure} > {snapshot.max_exposure}"
             )
 
 
@@ -237,48 +523,31 @@ class RiskEngine:
     # MARGIN POLICY ENFORCEMENT
     # ------------------------------
     @staticmethod
-    def enforce_margin_policy(client_id: int):
+    def enforce_margin_policy(client_id: int, snapshot: RiskSnapshot | None = None):
         """
         Enable / Disable margin based on utilization
         """
 
-        profile = ClientRiskProfile.objects.select_related("client").get(
-            client_id=client_id
-        )
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
 
-        if profile.max_exposure == 0:
+        if snapshot.max_exposure == 0:
             return
 
-        used = RiskEngine.calculate_current_exposure(client_id)
+        used = snapshot.used_exposure
+        utilization = snapshot.edr_percent
+        status = snapshot.edr_status
 
-        utilization = (
-            (used / profile.max_exposure) * Decimal("100")
-        ).quantize(Decimal("0.01"))
-
-        # 🔥 No double recalculation
-        if utilization < UTILIZATION_LEVELS["SAFE"]:
-            status = "SAFE"
-        elif utilization < UTILIZATION_LEVELS["WARNING"]:
-            status = "WARNING"
-        elif utilization < UTILIZATION_LEVELS["MARGIN_CALL"]:
-            status = "MARGIN_CALL"
-        else:
-            status = "FORCE_SELL"
+        details = {
+            "utilization": str(utilization),
+            "used": str(used),
+        }
 
         # ---------------- FORCE SELL ----------------
         if status == "FORCE_SELL":
 
-            if profile.allow_margin:
-                profile.allow_margin = False
-                profile.save(update_fields=["allow_margin"])
-
-                AuditLog.log_event(
-                    event_type="FORCE_SELL_TRIGGERED",
-                    client=profile.client,
-                    details={
-                        "utilization": str(utilization),
-                        "used": str(used),
-                    },
+            if snapshot.allow_margin:
+                RiskEngine._set_allow_margin(
+                    client_id, False, "FORCE_SELL_TRIGGERED", details
                 )
 
             # 🚨 EXECUTE LIQUIDATION
@@ -289,61 +558,54 @@ class RiskEngine:
 
         # ---------------- MARGIN CALL ----------------
         if status == "MARGIN_CALL":
-            if profile.allow_margin:
-                profile.allow_margin = False
-                profile.save(update_fields=["allow_margin"])
-
-                AuditLog.log_event(
-                    event_type="MARGIN_CALL_TRIGGERED",
-                    client=profile.client,
-                    details={
-                        "utilization": str(utilization),
-                        "used": str(used),
-                    },
+            if snapshot.allow_margin:
+                RiskEngine._set_allow_margin(
+                    client_id, False, "MARGIN_CALL_TRIGGERED", details
                 )
             return
 
         # ---------------- SAFE / WARNING ----------------
-        if not profile.allow_margin:
-            profile.allow_margin = True
-            profile.save(update_fields=["allow_margin"])
-
-            AuditLog.log_event(
-                event_type="MARGIN_RE_ENABLED",
-                client=profile.client,
-                details={
-                    "utilization": str(utilization),
-                    "used": str(used),
-                },
+        if not snapshot.allow_margin:
+            RiskEngine._set_allow_margin(
+                client_id, True, "MARGIN_RE_ENABLED", details
             )
 
+    @staticmethod
+    def _set_allow_margin(client_id: int, allow: bool, event_type: str, details: dict):
+        # save(), not update(): the ClientRiskProfile receivers must run
+        profile = ClientRiskProfile.objects.get(client_id=client_id)
+        profile.allow_margin = allow
+        profile.save(update_fields=["allow_margin"])
+        publish_margin_policy_changed(client_id, allow, event_type)
+
+        AuditLog.objects.create(
+            event_type=event_type,
+            client_id=client_id,
+            details=details,
+        )
 
-
-
-        
     # ------------------------------
     # UTILIZATION / EDR
     # ------------------------------
-    # ==============================
-    # UTILIZATION / EDR
-    # ==============================
 
     @staticmethod
-    def margin_utilization(client_id: int) -> Decimal:
-        profile = ClientRiskProfile.objects.get(client_id=client_id)
-
-        if profile.max_exposure == 0:
-            return Decimal("0.00")
-
-        used = RiskEngine.calculate_current_exposure(client_id)
-        return (
-            (used / profile.max_exposure) * Decimal("100")
-        ).quantize(Decimal("0.01"))
+    def margin_utilization(
+        client_id: int,
+        snapshot: RiskSnapshot | None = None,
+    ) -> Decimal:
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
+        return snapshot.edr_percent
 
     @staticmethod
-    def utilization_status(client_id: int) -> str:
-        u = RiskEngine.margin_utilization(client_id)
+    def utilization_status(
+        client_id: int,
+        snapshot: RiskSnapshot | None = None,
+    ) -> str:
+        snapshot = snapshot or RiskEngine.snapshot(client_id)
+        return snapshot.edr_status
 
+    @staticmethod
+    def status_for_utilization(u: Decimal) -> str:
         if u < UTILIZATION_LEVELS["SAFE"]:
             return "SAFE"
         elif u < UTILIZATION_LEVELS["WARNING"]:
@@ -352,84 +614,26 @@ class RiskEngine:
             return "MARGIN_CALL"
         return "FORCE_SELL"
 
-
-
-
-
     @staticmethod
     @transaction.atomic
-    def auto_liquidate(client_id: int):
+    def auto_liquidate(client_id: int, dry_run: bool = False):
         """
         Force-sell positions until utilization
         falls below WARNING threshold
-        """
-
-        profile = ClientRiskProfile.objects.select_related("client").get(
-            client_id=client_id
-        )
-
-        max_exposure = profile.max_exposure
 
-        if max_exposure == 0:
-            return
-
-        warning_limit = UTILIZATION_LEVELS["WARNING"]
-
-        # Sort positions by highest margin exposure first
-        portfolios = (
-            Portfolio.objects
-            .select_related("instrument")
-            .filter(client_id=client_id)
-        )
-
-        positions = []
-
-        for p in portfolios:
-            rate = p.instrument.effective_margin_rate()
-            if rate <= 0:
-                continue
-
-            exposure = p.quantity * p.avg_price * rate
-
-            positions.append({
-                "obj": p,
-                "exposure": exposure,
-                "rate": rate,
-            })
-
-        # Sort descending exposure
-        positions.sort(key=lambda x: x["exposure"], reverse=True)
-
-        for pos in positions:
-
-            current_util = RiskEngine.margin_utilization(client_id)
-
-            if current_util < warning_limit:
-                break
-
-            p = pos["obj"]
-            rate = pos["rate"]
-
-            if p.quantity <= 0:
-                continue
-
-            # Sell 25% of position per iteration (controlled liquidation)
-            sell_qty = (p.quantity * Decimal("0.25")).quantize(Decimal("0.0001"))
+        The sell plan is simulated in memory from one snapshot and applied
+        in bulk; dry_run=True only returns the plan.
+        """
 
-            if sell_qty <= 0:
-                sell_qty = p.quantity
+        plan = LiquidationPlanner.plan(client_id)
 
-            p.quantity -= sell_qty
-            p.save(update_fields=["quantity"])
+        if plan is None or dry_run:
+            return plan
 
-            AuditLog.log_event(
-                event_type="AUTO_LIQUIDATION_EXECUTED",
-                client=profile.client,
-                details={
-                    "instrument": p.instrument.symbol,
-                    "quantity_sold": str(sell_qty),
-                },
-            )
+        LiquidationPlanner.execute(plan)
+        invalidate_risk_context(client_id)
 
         # Final sync after liquidation
         RiskEngine.sync_margin_loan(client_id)
+
+        return plan
@@ -1,9 +1,14 @@
 from decimal import Decimal
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 
-from core.models import Client
+from core.models import Client, Instrument, Portfolio
 from risk.models import ClientRiskProfile
+from risk.services.context import invalidate_risk_context
+from risk.services.exposure_ledger import exposure_ledger
+from risk.services.holders import RISK_FIELDS, recompute_holders, risk_fields, risk_fields_changed
+from risk.services.recompute import recompute_scheduler
 
 
 # @receiver(post_save, sender=Client)
@@ -49,12 +54,72 @@ def sync_client_risk_profile(sender, instance, created, **kwargs):
         return
 
     try:
-        risk = instance.risk_profile
+        instance.risk_profile
     except ClientRiskProfile.DoesNotExist:
         risk = ClientRiskProfile.objects.create(
             client=instance,
             allow_margin=True,
             leverage_multiplier=Decimal("1.50"),
         )
+        risk.recalculate()
+        return
+
+    # Debounced: a burst of cash updates recalculates once
+    recompute_scheduler.mark(instance.id, profile=True)
+
+
+# ------------------------------
+# EXPOSURE LEDGER DELTAS
+# ------------------------------
+@receiver(post_save, sender=Portfolio)
+def ledger_portfolio_saved(sender, instance, **kwargs):
+    exposure_ledger.record_portfolio(instance)
+
+
+@receiver(post_delete, sender=Portfolio)
+def ledger_portfolio_deleted(sender, instance, **kwargs):
+    exposure_ledger.record_portfolio(instance, deleted=True)
+
+
+@receiver(post_save, sender=ClientRiskProfile)
+def ledger_profile_saved(sender, instance, update_fields=None, **kwargs):
+    # Only leverage changes move exposure (max_exposure recalcs do not)
+    if update_fields is None or "leverage_multiplier" in update_fields:
+        exposure_ledger.invalidate(instance.client_id)
+
+
+@receiver(pre_save, sender=Instrument)
+def instrument_risk_fields_loaded(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (
+        update_fields is not None and not set(update_fields) & set(RISK_FIELDS)
+    ):
+        instance._risk_fields_before = None
+        return
+    instance._risk_fields_before = risk_fields(instance.pk)
+
+
+@receiver(post_save, sender=Instrument)
+def ledger_instrument_saved(sender, instance, created, **kwargs):
+    # Only the holders move; recompute them once the change is visible
+    if not created and risk_fields_changed(instance):
+        transaction.on_commit(lambda: recompute_holders(instance.id))
+
+
+# ------------------------------
+# RISK CONTEXT INVALIDATION
+# ------------------------------
+@receiver(post_save, sender=Portfolio)
+@receiver(post_delete, sender=Portfolio)
+@receiver(post_save, sender=ClientRiskProfile)
+def risk_context_client_changed(sender, instance, **kwargs):
+    invalidate_risk_context(instance.client_id)
+
+
+@receiver(post_save, sender=Client)
+def risk_context_client_saved(sender, instance, **kwargs):
+    invalidate_risk_context(instance.id)
+
 
-    risk.recalculate()
+@receiver(post_save, sender=Instrument)
+def risk_context_instrument_saved(sender, instance, **kwargs):
+    invalidate_risk_context()
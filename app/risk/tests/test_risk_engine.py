@@ -3,7 +3,7 @@ from django.test import TestCase
 
 from core.models import Client, Instrument, Portfolio
 from risk.models import ClientRiskProfile
-from risk.services.risk_engine import RiskEngine, RiskViolation
+from risk.services.risk_engine import PreTradeOrder, RiskEngine, RiskViolation
 from risk.constants import UTILIZATION_LEVELS
 
 class RiskEngineBaseTest(TestCase):
@@ -14,11 +14,11 @@ class RiskEngineBaseTest(TestCase):
             cash_balance=Decimal("100000.00"),
         )
 
-        self.risk = ClientRiskProfile.objects.create(
-            client=self.client_obj,
-            allow_margin=True,
-            leverage_multiplier=Decimal("1.50"),
-        )
+        # Created by risk.signals.sync_client_risk_profile
+        self.risk = self.client_obj.risk_profile
+        self.risk.allow_margin = True
+        self.risk.leverage_multiplier = Decimal("1.50")
+        self.risk.save(update_fields=["allow_margin", "leverage_multiplier"])
         self.risk.recalculate()
 
         self.a_board = Instrument.objects.create(
@@ -164,3 +164,673 @@ class TestLoanAmount(RiskEngineBaseTest):
         # Used = 50,000
         # Cash = 100,000
         self.assertEqual(loan, Decimal("0.00"))
+
+
+class TestRiskSnapshot(RiskEngineBaseTest):
+
+    def test_snapshot_matches_individual_calls(self):
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("100"),
+            avg_price=Decimal("1000"),
+        )
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.z_board,
+            quantity=Decimal("10"),
+            avg_price=Decimal("100"),
+        )
+
+        with self.assertNumQueries(2):
+            snapshot = RiskEngine.snapshot(self.client_obj.id)
+
+        self.assertEqual(snapshot.used_exposure, Decimal("50000.00"))
+        self.assertEqual(snapshot.loan_amount, Decimal("0.00"))
+        self.assertEqual(snapshot.edr_percent, Decimal("33.33"))
+        self.assertEqual(snapshot.edr_status, "SAFE")
+        self.assertEqual(len(snapshot.positions), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                RiskEngine.calculate_current_exposure(self.client_obj.id, snapshot=snapshot),
+                snapshot.used_exposure,
+            )
+            self.assertEqual(
+                RiskEngine.margin_utilization(self.client_obj.id, snapshot=snapshot),
+                snapshot.edr_percent,
+            )
+            self.assertEqual(
+                RiskEngine.available_exposure(self.client_obj.id, snapshot=snapshot),
+                Decimal("100000.00"),
+            )
+
+        z_position = next(p for p in snapshot.positions if p.symbol == "ZBAD")
+        self.assertEqual(z_position.exposure, Decimal("0.00"))
+
+
+class TestBookExposure(RiskEngineBaseTest):
+
+    def test_book_matches_per_client_engine(self):
+        from risk.services.book_exposure import BookExposureEngine
+
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("120"),
+            avg_price=Decimal("999.9999"),
+        )
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.b_board,
+            quantity=Decimal("33.3333"),
+            avg_price=Decimal("10.0005"),
+        )
+
+        book = BookExposureEngine.run()
+        row = book.row(self.client_obj.id)
+        snapshot = RiskEngine.snapshot(self.client_obj.id)
+
+        self.assertEqual(row["used_exposure"], snapshot.used_exposure)
+        self.assertEqual(row["loan_amount"], snapshot.loan_amount)
+        self.assertEqual(row["edr_percent"], snapshot.edr_percent)
+        self.assertEqual(row["edr_status"], snapshot.edr_status)
+
+    def test_book_matches_snapshots_across_clients_and_boards(self):
+        from risk.services.book_exposure import BookExposureEngine
+
+        frozen = Instrument.objects.create(
+            symbol="NOMRG",
+            name="Not marginable",
+            exchange="DSE",
+            board="A",
+            is_marginable=False,
+            margin_rate=Decimal("0.50"),
+        )
+        instruments = [self.a_board, self.b_board, self.z_board, frozen]
+
+        for i, (cash, leverage) in enumerate([
+            ("0.00", "1.00"),
+            ("2500.55", "0.40"),
+            ("100000.00", "1.50"),
+            ("999.99", "0.75"),
+        ]):
+            client = Client.objects.create(
+                name=f"Book {i}",
+                email=f"book{i}@example.com",
+                cash_balance=Decimal(cash),
+            )
+            profile = client.risk_profile
+            profile.leverage_multiplier = Decimal(leverage)
+            profile.save(update_fields=["leverage_multiplier"])
+            profile.recalculate()
+
+            for j, instrument in enumerate(instruments[: i + 1]):
+                Portfolio.objects.create(
+                    client=client,
+                    instrument=instrument,
+                    quantity=Decimal("17.3333") * (j + 1),
+                    avg_price=Decimal("101.0101") * (i + 1),
+                )
+
+        book = BookExposureEngine.run()
+        self.assertEqual(len(book), ClientRiskProfile.objects.count())
+
+        for row in book.rows():
+            snapshot = RiskEngine.snapshot(row["client_id"])
+            self.assertEqual(row["used_exposure"], snapshot.used_exposure)
+            self.assertEqual(row["loan_amount"], snapshot.loan_amount)
+            self.assertEqual(row["max_exposure"], snapshot.max_exposure)
+            self.assertEqual(row["edr_percent"], snapshot.edr_percent)
+            self.assertEqual(row["edr_status"], snapshot.edr_status)
+
+    def test_book_reads_the_same_rate_table_as_snapshots(self):
+        from core.services.margin_rates import margin_rates
+        from risk.services.book_exposure import BookExposureEngine
+
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("100"),
+            avg_price=Decimal("1000"),
+        )
+        margin_rates.reload()
+
+        # Written by another process: the table keeps the old rate until its TTL
+        Instrument.objects.filter(pk=self.a_board.pk).update(board="Z")
+
+        row = BookExposureEngine.run([self.client_obj.id]).row(self.client_obj.id)
+        snapshot = RiskEngine.snapshot(self.client_obj.id)
+
+        self.assertEqual(snapshot.used_exposure, Decimal("50000.00"))
+        self.assertEqual(row["used_exposure"], snapshot.used_exposure)
+        self.assertEqual(row["edr_status"], snapshot.edr_status)
+
+
+class TestExposureLedger(RiskEngineBaseTest):
+
+    def test_ledger_tracks_portfolio_deltas(self):
+        from risk.services.exposure_ledger import exposure_ledger
+
+        exposure_ledger.invalidate()
+        self.assertEqual(exposure_ledger.used_exposure(self.client_obj.id), Decimal("0.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            position = Portfolio.objects.create(
+                client=self.client_obj,
+                instrument=self.a_board,
+                quantity=Decimal("100"),
+                avg_price=Decimal("1000"),
+            )
+        self.assertEqual(exposure_ledger.used_exposure(self.client_obj.id), Decimal("50000.00"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            position.quantity = Decimal("40")
+            position.save(update_fields=["quantity"])
+        self.assertEqual(exposure_ledger.used_exposure(self.client_obj.id), Decimal("20000.00"))
+        self.assertEqual(exposure_ledger.verify([self.client_obj.id]), {})
+
+        # Writes that bypass signals show up as drift until rebuilt
+        Portfolio.objects.filter(id=position.id).update(quantity=Decimal("10"))
+        self.assertIn(self.client_obj.id, exposure_ledger.verify([self.client_obj.id]))
+
+        exposure_ledger.rebuild([self.client_obj.id])
+        self.assertEqual(
+            exposure_ledger.used_exposure(self.client_obj.id),
+            RiskEngine.calculate_current_exposure(self.client_obj.id),
+        )
+
+
+class TestAnnotatedExposure(RiskEngineBaseTest):
+
+    def test_client_queryset_matches_engine(self):
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("250"),
+            avg_price=Decimal("1000"),
+        )
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.b_board,
+            quantity=Decimal("100"),
+            avg_price=Decimal("10"),
+        )
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.z_board,
+            quantity=Decimal("100"),
+            avg_price=Decimal("10"),
+        )
+
+        annotated = Client.objects.with_risk_metrics().get(id=self.client_obj.id)
+        snapshot = RiskEngine.snapshot(self.client_obj.id)
+
+        self.assertEqual(annotated.used_exposure, snapshot.used_exposure)
+        self.assertEqual(annotated.loan_amount, snapshot.loan_amount)
+        self.assertEqual(annotated.edr_percent, snapshot.edr_percent)
+        self.assertEqual(annotated.edr_status, snapshot.edr_status)
+        self.assertEqual(
+            Portfolio.objects.filter(client=self.client_obj).used_exposure(),
+            snapshot.used_exposure,
+        )
+
+
+class TestRiskProfileListEndpoint(RiskEngineBaseTest):
+
+    def test_list_query_count_is_flat(self):
+        for i in range(5):
+            other = Client.objects.create(
+                name=f"Client {i}",
+                email=f"client{i}@example.com",
+                cash_balance=Decimal("1000.00"),
+            )
+            self.assertIsNotNone(other.risk_profile)    # via sync_client_risk_profile
+            Portfolio.objects.create(
+                client=other,
+                instrument=self.a_board,
+                quantity=Decimal("10"),
+                avg_price=Decimal("10"),
+            )
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/risk/risk-profiles/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 6)
+
+
+class TestLiquidationPlanner(RiskEngineBaseTest):
+
+    def test_dry_run_then_execute(self):
+        from core.models import AuditLog
+
+        position = Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("300"),
+            avg_price=Decimal("1000"),
+        )
+
+        plan = RiskEngine.auto_liquidate(self.client_obj.id, dry_run=True)
+
+        position.refresh_from_db()
+        self.assertEqual(position.quantity, Decimal("300"))
+        self.assertEqual(len(plan.orders), 1)
+        self.assertEqual(plan.orders[0].quantity_sold, Decimal("75.0000"))
+        self.assertEqual(plan.utilization_after, Decimal("75.00"))
+
+        executed = RiskEngine.auto_liquidate(self.client_obj.id)
+
+        position.refresh_from_db()
+        self.assertEqual(position.quantity, Decimal("225.0000"))
+        self.assertEqual(executed.orders, plan.orders)
+        self.assertEqual(
+            AuditLog.objects.filter(
+                client=self.client_obj, event_type="AUTO_LIQUIDATION_EXECUTED"
+            ).count(),
+            1,
+        )
+
+
+class TestMarginRateTable(RiskEngineBaseTest):
+
+    def test_table_matches_board_rules_and_invalidates(self):
+        from core.services.margin_rates import margin_rates
+
+        margin_rates.reload()
+
+        self.assertEqual(margin_rates.effective_rate(self.a_board.id), Decimal("0.50"))
+        self.assertEqual(margin_rates.effective_rate(self.b_board.id), Decimal("0.38"))
+        self.assertEqual(margin_rates.effective_rate(self.z_board.id), Decimal("0.00"))
+        self.assertTrue(margin_rates.by_symbol("ZBAD").is_z_board)
+
+        self.a_board.is_marginable = False
+        self.a_board.save()
+
+        entry = margin_rates.get(self.a_board.id)
+        self.assertFalse(entry.is_marginable)
+        self.assertEqual(entry.effective_rate, Decimal("0.00"))
+
+    def test_pre_trade_blocks_read_the_instrument_not_the_table(self):
+        from core.services.margin_rates import margin_rates
+
+        margin_rates.reload()
+
+        # Downgrade saved by another process: this table is still stale
+        Instrument.objects.filter(pk=self.a_board.pk).update(board="Z")
+        self.assertFalse(margin_rates.get(self.a_board.id).is_z_board)
+
+        with self.assertRaisesMessage(RiskViolation, "Z-board"):
+            RiskEngine.check_pre_trade(
+                client_id=self.client_obj.id,
+                instrument=Instrument.objects.get(pk=self.a_board.pk),
+                side="BUY",
+                quantity=Decimal("1"),
+                price=Decimal("100"),
+                is_margin=True,
+            )
+
+
+class TestMtmSweep(RiskEngineBaseTest):
+
+    def test_inline_sweep_checkpoints_and_resumes(self):
+        import json
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        from core.models import MarginLoan
+
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("240"),
+            avg_price=Decimal("1000"),
+        )
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sweep.json")
+
+            call_command("mtm_sweep", workers=0, checkpoint=path, stdout=StringIO())
+
+            self.assertTrue(MarginLoan.objects.filter(client=self.client_obj).exists())
+            with open(path) as f:
+                shards = json.load(f)["shards"]
+            self.assertEqual(sum(s["clients"] for s in shards.values()), 1)
+            self.assertEqual(sum(s["margin_calls"] for s in shards.values()), 1)
+
+            out = StringIO()
+            call_command(
+                "mtm_sweep", workers=0, checkpoint=path, resume=True, stdout=out
+            )
+            self.assertIn("0 client(s) in 0 shard(s), 1 shard(s) already done", out.getvalue())
+
+    def test_shard_enforces_only_clients_that_changed(self):
+        from risk.services.mtm_sweep import sweep_shard
+
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("240"),
+            avg_price=Decimal("1000"),
+        )
+        idle = Client.objects.create(name="Idle", email="idle@example.com")
+
+        first = sweep_shard([self.client_obj.id, idle.id])
+        self.assertEqual((first.clients, first.enforced), (2, 1))
+
+        # Loan synced and margin switched off: nothing left to do
+        second = sweep_shard([self.client_obj.id, idle.id])
+        self.assertEqual((second.clients, second.enforced), (2, 0))
+        self.assertEqual(second.margin_calls, 1)
+
+
+class TestRiskContext(RiskEngineBaseTest):
+
+    def test_snapshot_memoized_until_position_write(self):
+        from risk.services.context import risk_context
+
+        with risk_context():
+            first = RiskEngine.snapshot(self.client_obj.id)
+
+            with self.assertNumQueries(0):
+                self.assertIs(RiskEngine.snapshot(self.client_obj.id), first)
+
+            Portfolio.objects.create(
+                client=self.client_obj,
+                instrument=self.a_board,
+                quantity=Decimal("100"),
+                avg_price=Decimal("100"),
+            )
+
+            self.assertEqual(
+                RiskEngine.snapshot(self.client_obj.id).used_exposure,
+                Decimal("5000.00"),
+            )
+
+    def test_portfolio_create_loads_risk_state_twice(self):
+        from core.services.margin_rates import margin_rates
+
+        margin_rates.reload()
+
+        # validation (3) + pre-trade snapshot (2) + insert (1)
+        # + post-trade snapshot (2) + loan lookup (1) + savepoint (2)
+        with self.assertNumQueries(11):
+            response = self.client.post(
+                "/api/core/portfolios/",
+                {
+                    "client": self.client_obj.id,
+                    "instrument": self.a_board.id,
+                    "quantity": "100",
+                    "avg_price": "100",
+                },
+                content_type="application/json",
+            )
+
+        self.assertEqual(response.status_code, 201)
+
+
+class TestPreTradeBasket(RiskEngineBaseTest):
+
+    def test_orders_are_checked_cumulatively(self):
+        # available = 150000; each A-board order needs 100 × 1000 × 0.50
+        response = self.client.post(
+            "/api/core/portfolios/pre-trade-basket/",
+            {
+                "client_id": self.client_obj.id,
+                "orders": [
+                    {"instrument": self.a_board.id, "quantity": "100", "price": "1000"},
+                    {"instrument": self.z_board.id, "quantity": "1", "price": "1"},
+                    {"instrument": self.a_board.id, "quantity": "100", "price": "1000"},
+                    {"instrument": self.a_board.id, "quantity": "100", "price": "1000"},
+                    {"instrument": self.a_board.id, "side": "SELL", "quantity": "10", "price": "1"},
+                ],
+            },
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        orders = response.json()["orders"]
+        self.assertEqual(
+            [o["accepted"] for o in orders], [True, False, True, True, True]
+        )
+        self.assertEqual(orders[3]["remaining"], "0.00")
+
+        single = RiskEngine.check_pre_trade_basket(
+            client_id=self.client_obj.id,
+            orders=[
+                PreTradeOrder(self.a_board, "BUY", Decimal("301"), Decimal("1000")),
+            ],
+        )
+        self.assertFalse(single[0].accepted)
+        self.assertIn("Exposure exceeded", single[0].reason)
+
+    def test_orders_are_validated_by_serializer(self):
+        ClientRiskProfile.objects.filter(client=self.client_obj).update(allow_margin=False)
+
+        def post(**order):
+            return self.client.post(
+                "/api/core/portfolios/pre-trade-basket/",
+                {
+                    "client_id": self.client_obj.id,
+                    "orders": [{"instrument": self.a_board.id, "quantity": "1", "price": "10", **order}],
+                },
+                content_type="application/json",
+            )
+
+        # "false" is a cash order, not a truthy string
+        response = post(is_margin="false")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["orders"][0]["accepted"])
+
+        response = post(is_margin="true")
+        self.assertFalse(response.json()["orders"][0]["accepted"])
+
+        self.assertEqual(post(is_margin="maybe").status_code, 400)
+        self.assertEqual(post(price="ten").status_code, 400)
+        self.assertEqual(post(instrument=999999).status_code, 400)
+
+
+class TestRiskEventEvaluator(RiskEngineBaseTest):
+
+    def test_margin_requests_are_decided_cumulatively(self):
+        from risk.services.event_evaluation import RiskEventEvaluator
+
+        # used 50000 of 150000 → 100000 available
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("100"),
+            avg_price=Decimal("1000"),
+        )
+        events = [
+            {"type": "MARGIN_REQUEST", "client_id": self.client_obj.id, "amount": 60000.0},
+            {"type": "MARGIN_REQUEST", "client_id": str(self.client_obj.id), "amount": "50000"},
+            {"type": "MARGIN_REQUEST", "client_id": self.client_obj.id, "amount": 30000.0},
+            {"type": "MARGIN_REQUEST", "client_id": 999999, "amount": 1.0},
+        ]
+
+        decisions = RiskEventEvaluator.margin_requests(events)
+
+        self.assertEqual([d.approved for d in decisions], [True, False, True, False])
+        self.assertEqual(decisions[1].reason, "exceeds available exposure")
+        self.assertEqual(decisions[3].reason, "no risk profile")
+        self.assertEqual(events[2]["decision"]["available_exposure"], "40000.00")
+
+        self.risk.allow_margin = False
+        self.risk.save(update_fields=["allow_margin"])
+        [decision] = RiskEventEvaluator.margin_requests(events[:1])
+        self.assertEqual(decision.reason, "margin disabled")
+
+    def test_forced_sells_liquidate_once_per_client(self):
+        from unittest import mock
+        from risk.services.event_evaluation import RiskEventEvaluator
+
+        # 130000 / 150000 → FORCE_SELL
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("260"),
+            avg_price=Decimal("1000"),
+        )
+        events = [
+            {"type": "FORCED_SELL", "client_id": self.client_obj.id, "portfolio_id": 1},
+            {"type": "FORCED_SELL", "client_id": self.client_obj.id, "portfolio_id": 1},
+        ]
+
+        with mock.patch.object(
+            RiskEngine, "auto_liquidate", wraps=RiskEngine.auto_liquidate
+        ) as auto_liquidate:
+            plans = RiskEventEvaluator.forced_sells(events)
+
+        auto_liquidate.assert_called_once_with(self.client_obj.id)
+        self.assertTrue(plans[self.client_obj.id].orders)
+        self.assertLess(
+            RiskEngine.margin_utilization(self.client_obj.id),
+            UTILIZATION_LEVELS["WARNING"],
+        )
+
+
+class TestRecomputeScheduler(RiskEngineBaseTest):
+
+    def test_batch_recomputes_each_client_once(self):
+        from unittest import mock
+        from risk.services.recompute import recompute_scheduler
+
+        with mock.patch.object(RiskEngine, "enforce_post_trade") as enforce:
+            with self.captureOnCommitCallbacks(execute=True):
+                with recompute_scheduler.batch():
+                    for _ in range(200):
+                        recompute_scheduler.mark(self.client_obj.id, post_trade=True)
+                    enforce.assert_not_called()
+
+        enforce.assert_called_once()
+        self.assertEqual(enforce.call_args.args, (self.client_obj.id,))
+
+    def test_pre_trade_does_not_wait_for_pending_recompute(self):
+        from django.test import override_settings
+        from risk.services.recompute import recompute_scheduler
+
+        with override_settings(RISK_RECOMPUTE_WINDOW_MS=60_000):
+            with self.captureOnCommitCallbacks(execute=True):
+                Client.objects.filter(id=self.client_obj.id).update(cash_balance=Decimal("200000.00"))
+                recompute_scheduler.mark(self.client_obj.id, profile=True)
+
+            self.risk.refresh_from_db()
+            self.assertEqual(self.risk.max_exposure, Decimal("150000.00"))
+
+            # needs 250000 of the recomputed 300000
+            RiskEngine.check_pre_trade(
+                client_id=self.client_obj.id,
+                instrument=self.a_board,
+                side="BUY",
+                quantity=Decimal("500"),
+                price=Decimal("1000"),
+                is_margin=True,
+            )
+
+            # Left to the scheduler
+            self.assertIn(self.client_obj.id, recompute_scheduler.pending())
+            recompute_scheduler.flush()
+
+        self.risk.refresh_from_db()
+        self.assertEqual(self.risk.max_exposure, Decimal("300000.00"))
+
+    def test_pre_trade_applies_margin_policy_inline(self):
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("200"),
+            avg_price=Decimal("1000"),
+        )
+        buy = dict(
+            client_id=self.client_obj.id,
+            instrument=self.a_board,
+            side="BUY",
+            quantity=Decimal("1"),
+            price=Decimal("100"),
+            is_margin=True,
+        )
+
+        # Cash drops with no recompute marked (e.g. another process):
+        # 100000 used of 90000 → FORCE_SELL, margin is off at once
+        Client.objects.filter(id=self.client_obj.id).update(cash_balance=Decimal("60000.00"))
+        with self.assertRaises(RiskViolation) as ctx:
+            RiskEngine.check_pre_trade(**buy)
+        self.assertIn("Margin disabled", str(ctx.exception))
+        self.assertTrue(ClientRiskProfile.objects.get(client=self.client_obj).allow_margin)
+
+
+class TestCashSettlement(RiskEngineBaseTest):
+
+    def test_bulk_settlement_requeues_only_moved_clients(self):
+        from unittest import mock
+        from risk.services.settlement import BalanceChange, CashSettlement
+
+        other = Client.objects.create(name="Other", email="other@example.com")
+        # Created by risk.signals.sync_client_risk_profile
+        other_risk = other.risk_profile
+        other_risk.leverage_multiplier = Decimal("1.50")
+        other_risk.save(update_fields=["leverage_multiplier"])
+        other_risk.recalculate()
+
+        # used 50000: SAFE at 150000 max, MARGIN_CALL at 60000
+        Portfolio.objects.create(
+            client=self.client_obj,
+            instrument=self.a_board,
+            quantity=Decimal("100"),
+            avg_price=Decimal("1000"),
+        )
+        changes = [
+            BalanceChange(self.client_obj.id, cash_balance=Decimal("-60000")),
+            BalanceChange(other.id, cash_balance=Decimal("500.00"), collateral_value=Decimal("250.00")),
+            BalanceChange(999999, cash_balance=Decimal("1.00")),
+        ]
+
+        with mock.patch.object(RiskEngine, "enforce_post_trade") as enforce:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = CashSettlement.apply(changes, delta=True)
+
+        enforce.assert_called_once()
+        self.assertEqual(enforce.call_args.args, (self.client_obj.id,))
+        self.assertEqual(result.band_changes, {self.client_obj.id: ("SAFE", "MARGIN_CALL")})
+        self.assertEqual(result.missing, [999999])
+
+        self.risk.refresh_from_db()
+        other_risk.refresh_from_db()
+        self.assertEqual(self.risk.max_exposure, Decimal("60000.00"))
+        self.assertEqual(other_risk.max_exposure, Decimal("1125.00"))   # (500 + 250) × 1.50
+        self.assertEqual(Client.objects.get(id=other.id).cash_balance, Decimal("500.00"))
+
+
+class TestInstrumentHolders(RiskEngineBaseTest):
+
+    def test_board_change_recomputes_only_holders(self):
+        from unittest import mock
+        from risk.services.holders import holder_ids
+
+        other = Client.objects.create(name="Other", email="other@example.com")
+        self.assertIsNotNone(other.risk_profile)    # via sync_client_risk_profile
+
+        Portfolio.objects.create(
+            client=self.client_obj, instrument=self.a_board, quantity=Decimal("10"), avg_price=Decimal("100")
+        )
+        Portfolio.objects.create(
+            client=other, instrument=self.b_board, quantity=Decimal("10"), avg_price=Decimal("100")
+        )
+        self.assertEqual(holder_ids(self.a_board.id), [self.client_obj.id])
+
+        with mock.patch.object(RiskEngine, "enforce_post_trade") as enforce:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.a_board.name = "Apple Inc."
+                self.a_board.save()
+            enforce.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.a_board.board = "Z"
+                self.a_board.save()
+
+        enforce.assert_called_once()
+        self.assertEqual(enforce.call_args.args, (self.client_obj.id,))
+        self.assertEqual(enforce.call_args.kwargs["snapshot"].used_exposure, Decimal("0.00"))
@@ -1,3 +1,5 @@
+from decimal import Decimal, ROUND_HALF_UP
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -6,6 +8,7 @@ from drf_spectacular.utils import extend_schema
 from risk.models import ClientRiskProfile
 from risk.serializers import ClientRiskProfileSerializer
 from risk.services.risk_engine import RiskEngine
+from risk.services.liquidation import LiquidationPlanner
 
 
 class ClientRiskProfileViewSet(viewsets.ModelViewSet):
@@ -16,6 +19,25 @@ class ClientRiskProfileViewSet(viewsets.ModelViewSet):
     serializer_class = ClientRiskProfileSerializer
     http_method_names = ["get", "post"]  # 🔒 no PUT/PATCH/DELETE
 
+    # --------------------------------
+    # LIST (risk metrics for the whole page in 2 queries)
+    # --------------------------------
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        profiles = list(page if page is not None else queryset)
+
+        context = self.get_serializer_context()
+        context["risk_snapshots"] = RiskEngine.snapshots(profiles)
+
+        serializer = self.get_serializer_class()(profiles, many=True, context=context)
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data)
+
     # --------------------------------
     # RECALCULATE MAX EXPOSURE
     # --------------------------------
@@ -47,28 +69,59 @@ class ClientRiskProfileViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["get"])
     def utilization(self, request, pk=None):
         risk = self.get_object()
-        client = risk.client
 
-        used = RiskEngine.calculate_current_exposure(client.id)
-        loan = RiskEngine.loan_amount(client.id)
-        edr = RiskEngine.margin_utilization(client.id)
+        # Single pass: profile/client already loaded, one positions query
+        snapshot = RiskEngine.snapshot(risk.client_id, profile=risk)
 
         return Response(
             {
-                "client_id": client.id,
-                "client_name": client.name,
-                "cash_balance": str(client.cash_balance),
-                "used_exposure": str(used),
-                "loan_amount": str(loan),              # ✅
-                "max_exposure": str(risk.max_exposure),
-                "edr_percent": str(edr),
-                "edr_status": RiskEngine.utilization_status(client.id),
-                "allow_margin": risk.allow_margin,
+                "client_id": snapshot.client_id,
+                "client_name": snapshot.client_name,
+                "cash_balance": str(snapshot.cash_balance),
+                "used_exposure": str(snapshot.used_exposure),
+                "loan_amount": str(snapshot.loan_amount),              # ✅
+                "max_exposure": str(snapshot.max_exposure),
+                "edr_percent": str(snapshot.edr_percent),
+                "edr_status": snapshot.edr_status,
+                "allow_margin": snapshot.allow_margin,
+                "positions": [
+                    {
+                        "instrument": pos.symbol,
+                        "quantity": str(pos.quantity),
+                        "avg_price": str(pos.avg_price),
+                        "margin_rate": str(pos.margin_rate),
+                        "applied_rate": str(pos.applied_rate),
+                        "exposure": str(
+                            pos.exposure.quantize(Decimal("0.01"), ROUND_HALF_UP)
+                        ),
+                    }
+                    for pos in snapshot.positions
+                ],
             }
         )
 
 
 
+    # --------------------------------
+    # LIQUIDATION PREVIEW (DRY RUN)
+    # --------------------------------
+    @extend_schema(
+        description="Preview the forced-sell plan without executing it",
+    )
+    @action(detail=True, methods=["get"], url_path="liquidation-preview")
+    def liquidation_preview(self, request, pk=None):
+        risk = self.get_object()
+
+        snapshot = RiskEngine.snapshot(risk.client_id, profile=risk)
+        plan = LiquidationPlanner.plan(risk.client_id, snapshot=snapshot)
+
+        if plan is None:
+            return Response(
+                {"client_id": risk.client_id, "orders": [], "reason": "max_exposure is 0"}
+            )
+
+        return Response(plan.as_dict())
+
     # --------------------------------
     # MANUAL MARGIN TOGGLE (ADMIN)
     # --------------------------------
@@ -0,0 +1,19 @@
+import pytest
+
+from core.kafka_transport import broker
+from core.producers import KafkaProducerWrapper
+
+
+@pytest.fixture
+def memory_transport(request, settings):
+    """
+    In-process Kafka (core.kafka_transport) with a fresh broker; topics get
+    @pytest.mark.memory_partitions(n) partitions (default 1)
+    """
+    marker = request.node.get_closest_marker("memory_partitions")
+    settings.KAFKA_TRANSPORT = "memory"
+    settings.KAFKA_PUBLISH_MODE = "sync"
+    KafkaProducerWrapper.close()
+    broker.reset(partitions=marker.args[0] if marker else 1)
+    yield broker
+    KafkaProducerWrapper.close()
@@ -0,0 +1,69 @@
+import asyncio
+from collections import namedtuple
+
+from core.async_consumers import AsyncConsumerRuntime, TopicRunner
+
+Record = namedtuple("Record", "topic partition offset key value")
+
+
+class _ScriptedConsumer:
+    """Returns the scripted batches, then asks the runtime to stop"""
+
+    def __init__(self, batches, on_drained):
+        self.batches = list(batches)
+        self.on_drained = on_drained
+        self.commits = 0
+        self.closed = False
+
+    def poll(self, timeout_ms=0, max_records=None):
+        if self.batches:
+            return self.batches.pop(0)
+        self.on_drained()
+        return {}
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        self.closed = True
+
+
+def _batch(topic, keys):
+    tp = (topic, 0)
+    return {tp: [Record(topic, 0, i, key, {"key": key, "seq": i}) for i, key in enumerate(keys)]}
+
+
+def test_two_topics_run_concurrently_and_drain():
+    seen = {"a": [], "b": []}
+    consumers = {}
+
+    async def slow_handler(event):
+        await asyncio.sleep(0.01 if event["seq"] == 0 else 0)
+        seen[event["topic_name"]].append((event["key"], event["seq"]))
+
+    def make_handler(name):
+        async def handler(event):
+            event = dict(event, topic_name=name)
+            await slow_handler(event)
+        return handler
+
+    runtime = AsyncConsumerRuntime([])
+
+    def factory(name, batches):
+        def build():
+            consumers[name] = _ScriptedConsumer(batches, runtime.request_stop)
+            return consumers[name]
+        return build
+
+    runtime.runners = [
+        TopicRunner("a", "g", make_handler("a"), consumer_factory=factory("a", [_batch("a", [b"1", b"2", b"1"])])),
+        TopicRunner("b", "g", make_handler("b"), consumer_factory=factory("b", [_batch("b", [b"1"])])),
+    ]
+
+    asyncio.run(runtime.run())
+
+    # Same key stays in order even though seq 0 is the slow one
+    assert [s for k, s in seen["a"] if k == b"1"] == [0, 2]
+    assert len(seen["b"]) == 1
+    assert consumers["a"].commits == 1 and consumers["b"].commits == 1
+    assert consumers["a"].closed and consumers["b"].closed
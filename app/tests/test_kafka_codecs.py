@@ -0,0 +1,80 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from core.codecs import CodecError, Envelope, decode, encode, get_codec
+from core.consumers import safe_deserializer
+
+EVENT = {
+    "type": "LOAN_CREATED",
+    "loan_id": 7,
+    "client_id": 3,
+    "amount": Decimal("250000.10"),
+    "interest_rate": Decimal("12.50"),
+    "created_at": datetime(2025, 9, 7, 10, 30, tzinfo=timezone.utc),
+}
+
+
+@pytest.mark.parametrize("codec", ["binary", "json"])
+def test_round_trip_restores_decimals(codec):
+    data = encode(Envelope.from_event(EVENT, key=3, timestamp=1700000000000, event_id="e-1"), codec=codec)
+    envelope = decode(data)
+
+    assert envelope.id == envelope.event["event_id"] == "e-1"
+
+    assert (envelope.type, envelope.key, envelope.version, envelope.timestamp) == (
+        "LOAN_CREATED", "3", 1, 1700000000000
+    )
+    assert envelope.event["amount"] == Decimal("250000.10")
+    assert isinstance(envelope.event["interest_rate"], Decimal)
+    assert envelope.event["created_at"].startswith("2025-09-07T10:30:00")
+
+
+def test_binary_is_smaller_than_json_envelope():
+    envelope = Envelope.from_event(EVENT, key=3)
+    assert len(get_codec("binary").encode(envelope)) < len(get_codec("json").encode(envelope))
+
+
+def test_binary_decimals_are_exact():
+    amounts = [Decimal("-0.0001"), Decimal("0"), Decimal("1E+200"), Decimal("12345678901234567890123456789.123"), Decimal("NaN")]
+    event = {"type": "X", **{f"a{i}": value for i, value in enumerate(amounts)}}
+
+    payload = decode(encode(event, codec="binary")).payload
+    decoded = [payload[f"a{i}"] for i in range(len(amounts))]
+
+    assert [str(value) for value in decoded] == [str(value) for value in amounts]
+    assert all(isinstance(value, Decimal) for value in decoded)
+
+    nested = decode(encode({"type": "X", "legs": [{"price": Decimal("384.70")}]}, codec="binary"))
+    assert nested.payload["legs"][0]["price"] == Decimal("384.70")
+
+
+def test_binary_reads_struct_frames_already_on_topics():
+    import struct
+
+    body = json.dumps({"amount": "5.10", "client_id": 1}).encode()
+    frame_v2 = struct.pack(">cBHqBHHH", b"\xe7", 2, 1, 1700000000000, 3, 1, 1, 6) + b"e-1X7amount" + body
+
+    envelope = decode(frame_v2)
+    assert (envelope.id, envelope.type, envelope.key) == ("e-1", "X", "7")
+    assert envelope.payload == {"amount": Decimal("5.10"), "client_id": 1}
+
+
+def test_binary_keeps_missing_and_empty_keys_apart():
+    assert decode(encode(Envelope.from_event({"type": "X"}), codec="binary")).key is None
+    assert decode(encode(Envelope.from_event({"type": "X"}, key=""), codec="binary")).key == ""
+
+
+def test_safe_deserializer_reads_legacy_and_rejects_garbage():
+    legacy = json.dumps({"type": "MARGIN_REQUEST", "client_id": 1, "amount": "5000.0"}).encode()
+    assert safe_deserializer(legacy) == {"type": "MARGIN_REQUEST", "client_id": 1, "amount": "5000.0"}
+
+    assert safe_deserializer(b"\xe7\x01") is None
+    assert safe_deserializer(b"[1, 2]") is None
+
+
+def test_unknown_codec_is_an_error():
+    with pytest.raises(CodecError):
+        encode({"type": "X"}, codec="avro")
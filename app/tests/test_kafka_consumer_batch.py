@@ -0,0 +1,70 @@
+import pytest
+from collections import namedtuple
+
+from core.consumers import handle_margin_events, process_batch, save_audit_logs
+from core.models import AuditLog, Client, MarginLoan
+
+Record = namedtuple("Record", "topic partition offset value")
+
+
+class _BatchConsumer:
+    def __init__(self, batch):
+        self.batch = batch
+        self.commits = 0
+        self.seeks = []
+
+    def poll(self, timeout_ms=0, max_records=None):
+        self.max_records = max_records
+        batch, self.batch = self.batch, {}
+        return batch
+
+    def commit(self):
+        self.commits += 1
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp, offset))
+
+
+@pytest.mark.django_db
+def test_save_audit_logs_resolves_fks_in_bulk(django_assert_num_queries):
+    client = Client.objects.create(name="Batch", email="batch@example.com")
+    loan = MarginLoan.objects.create(client=client, loan_amount=100)
+    AuditLog.objects.all().delete()
+
+    events = [
+        {"type": "MARGIN_REQUEST", "client_id": client.id, "loan_id": loan.id},
+        {"type": "MARGIN_REQUEST", "client_id": str(client.id)},
+        {"type": "MARGIN_REQUEST", "client_id": 999999},
+    ] * 10
+
+    # client lookup + loan lookup + one INSERT
+    with django_assert_num_queries(3):
+        assert save_audit_logs(events) == 30
+
+    logs = list(AuditLog.objects.order_by("id")[:3])
+    assert logs[0].client_id == client.id and logs[0].loan_id == loan.id
+    assert logs[1].client_id == client.id
+    assert logs[2].client_id is None
+
+
+@pytest.mark.django_db
+def test_offsets_committed_only_after_batch_is_persisted():
+    records = [Record("margin-loan-events", 0, i, {"type": "MARGIN_REQUEST"}) for i in range(3)]
+    consumer = _BatchConsumer({("margin-loan-events", 0): records})
+
+    assert process_batch(consumer, handle_margin_events, max_records=50) == 3
+    assert consumer.max_records == 50
+    assert consumer.commits == 1
+    assert AuditLog.objects.count() == 3
+
+    def failing_handler(events):
+        save_audit_logs(events)
+        raise RuntimeError("db down")
+
+    consumer = _BatchConsumer({("margin-loan-events", 0): records})
+    with pytest.raises(RuntimeError):
+        process_batch(consumer, failing_handler)
+
+    assert consumer.commits == 0
+    assert consumer.seeks == [(("margin-loan-events", 0), 0)]
+    assert AuditLog.objects.count() == 3
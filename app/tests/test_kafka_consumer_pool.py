@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import namedtuple
+
+from core.consumer_pool import KeyedWorkerPool, OffsetTracker
+
+Record = namedtuple("Record", "topic partition offset key value")
+
+
+def test_watermark_stops_at_lowest_unfinished_offset():
+    tracker = OffsetTracker()
+    tp = ("margin-loan-events", 0)
+    for offset in range(5):
+        tracker.track(tp, offset)
+
+    tracker.mark_done(tp, 0)
+    tracker.mark_done(tp, 2)
+    tracker.mark_done(tp, 3)
+    assert tracker.committable() == {tp: 1}
+
+    # Nothing new below the gap → nothing to commit
+    assert tracker.committable() == {}
+
+    tracker.mark_done(tp, 1)
+    assert tracker.committable() == {tp: 4}
+
+
+def test_same_key_is_processed_in_order_across_workers():
+    seen = {}
+    lock = threading.Lock()
+
+    def handler(event):
+        # Slow early events would overtake later ones without key routing
+        time.sleep(0.002 * (5 - event["seq"] % 5))
+        with lock:
+            seen.setdefault(event["client_id"], []).append(event["seq"])
+
+    tracker = OffsetTracker()
+    pool = KeyedWorkerPool(handler, tracker, workers=4)
+    pool.start()
+
+    tp = ("margin-loan-events", 0)
+    for offset in range(60):
+        client_id = offset % 6
+        pool.submit(
+            tp,
+            Record(tp[0], 0, offset, str(client_id).encode(), {"client_id": client_id, "seq": offset}),
+        )
+
+    pool.join()
+    pool.stop()
+
+    for client_id, seqs in seen.items():
+        assert seqs == sorted(seqs)
+    assert sum(len(s) for s in seen.values()) == 60
+    assert tracker.committable() == {tp: 60}
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+from kafka.structs import TopicPartition
+
+from core.consumers import create_kafka_consumer, handle_margin_events, process_batch
+from core.dedupe import Deduplicator
+from core.kafka_transport import InMemoryProducer
+from core.models import AuditLog, ProcessedEvent
+from core.producers import publish_margin_request
+
+TOPIC = "margin-loan-events"
+
+
+pytestmark = pytest.mark.usefixtures("memory_transport")
+
+
+@pytest.mark.django_db
+def test_redelivered_batch_is_not_handled_twice():
+    for client_id in (1, 2, 3):
+        publish_margin_request(client_id=client_id, amount=1000.0)
+    AuditLog.objects.all().delete()
+
+    consumer = create_kafka_consumer(TOPIC, "oms-margin-group", enable_auto_commit=False)
+    dedupe = Deduplicator("oms-margin-group")
+    assert process_batch(consumer, handle_margin_events, dedupe=dedupe) == 3
+    assert AuditLog.objects.count() == 3
+
+    # Rebalance / crash before commit: the same records come back, and a
+    # fresh process (empty LRU) must still recognise them
+    consumer.seek(TopicPartition(TOPIC, 0), 0)
+    assert process_batch(consumer, handle_margin_events, dedupe=Deduplicator("oms-margin-group")) == 3
+
+    assert AuditLog.objects.count() == 3
+    assert ProcessedEvent.objects.filter(group="oms-margin-group").count() == 3
+
+
+@pytest.mark.django_db
+def test_legacy_events_dedupe_on_log_position():
+    producer = InMemoryProducer()
+    for _ in range(2):
+        # Same payload twice = two distinct events
+        producer.send(TOPIC, key=b"1", value=json.dumps({"type": "MARGIN_REQUEST", "client_id": 1}).encode())
+
+    consumer = create_kafka_consumer(TOPIC, "legacy-group", enable_auto_commit=False)
+    dedupe = Deduplicator("legacy-group")
+    process_batch(consumer, handle_margin_events, dedupe=dedupe)
+
+    assert set(ProcessedEvent.objects.values_list("event_id", flat=True)) == {
+        f"{TOPIC}:0:0", f"{TOPIC}:0:1"
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+def test_recent_ids_are_answered_without_a_query(django_assert_num_queries):
+    dedupe = Deduplicator("g")
+    dedupe.mark(["a", "b"])
+
+    with django_assert_num_queries(0):
+        assert dedupe.unseen(["a", "b"]) == set()
+
+    with django_assert_num_queries(1):
+        assert dedupe.unseen(["a", "c"]) == {"c"}
@@ -0,0 +1,53 @@
+import pytest
+
+from core import metrics
+from core.consumers import create_kafka_consumer, handle_margin_events, process_batch
+from core.producers import KafkaProducerWrapper
+
+TOPIC = "margin-loan-events"
+
+
+pytestmark = [pytest.mark.usefixtures("memory_transport"), pytest.mark.memory_partitions(2)]
+
+
+def _publish(n):
+    producer = KafkaProducerWrapper.get_producer()
+    for i in range(n):
+        producer.send(TOPIC, key=str(i), value={"type": "MARGIN_REQUEST", "client_id": i})
+
+
+def test_histogram_quantiles_use_bucket_bounds():
+    histogram = metrics.Histogram(metrics.LATENCY_BUCKETS_MS)
+    for value in [0.5] * 90 + [40] * 9 + [20000]:
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.95) == 50
+    assert histogram.quantile(1.0) == float("inf")
+
+
+@pytest.mark.django_db
+def test_batch_consumer_reports_throughput_latency_and_lag():
+    stats = metrics.ConsumerMetrics(TOPIC)
+    _publish(10)
+
+    consumer = create_kafka_consumer(TOPIC, "metrics-group", enable_auto_commit=False)
+    process_batch(consumer, handle_margin_events, max_records=4, stats=stats)
+
+    stats.update_lag(consumer, force=True)
+    snapshot = stats.snapshot()
+
+    assert snapshot["counters"] == {"messages": 4, "batches": 1}
+    assert snapshot["handler_ms"]["count"] == 1
+    assert snapshot["commit_ms"]["count"] == 1
+    assert snapshot["total_lag"] == 6
+
+    text = "\n".join(stats.prometheus_lines())
+    assert f'oms_consumer_messages_total{{consumer="{TOPIC}"}} 4' in text
+    assert f'oms_consumer_batch_size_bucket{{consumer="{TOPIC}",le="+Inf"}} 1' in text
+    assert 'oms_consumer_lag{consumer="margin-loan-events",partition="0"}' in text
+
+
+def test_log_sampler_lets_one_in_n_through():
+    sample = metrics.LogSampler(every=3)
+    assert [sample() for _ in range(7)] == [True, False, False, True, False, False, True]
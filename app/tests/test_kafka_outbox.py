@@ -0,0 +1,178 @@
+from decimal import Decimal
+
+import pytest
+from django.db import transaction
+from kafka.structs import TopicPartition
+
+from core.codecs import decode
+from core.models import AuditLog, Client, Instrument, MarginLoan, OutboxEvent, Portfolio
+from core.outbox import OutboxRelay, enqueue, enqueue_batch
+
+
+class _AckedFuture:
+    def __init__(self, error=None):
+        self.error = error
+
+    def get(self, timeout=None):
+        if self.error:
+            raise self.error
+        return None
+
+
+class _BatchProducer:
+    def __init__(self, fail_topics=()):
+        self.sent = []
+        self.flushes = 0
+        self.fail_topics = fail_topics
+
+    def send(self, topic, key=None, value=None):
+        self.sent.append((topic, key, value))
+        error = RuntimeError("broker down") if topic in self.fail_topics else None
+        return _AckedFuture(error)
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+
+    def close(self):
+        pass
+
+
+@pytest.mark.django_db
+def test_loan_event_is_written_with_the_loan(settings):
+    settings.KAFKA_OUTBOX_ENABLED = True
+    client = Client.objects.create(name="Outbox", email="outbox@example.com")
+
+    with pytest.raises(RuntimeError):
+        with transaction.atomic():
+            MarginLoan.objects.create(client=client, loan_amount=100)
+            raise RuntimeError("rollback")
+
+    assert OutboxEvent.objects.count() == 0
+
+    MarginLoan.objects.create(client=client, loan_amount=100)
+
+    event = OutboxEvent.objects.get()
+    assert event.topic == "margin-loan-events"
+    assert event.payload["type"] == "MARGIN_REQUEST"
+
+
+@pytest.mark.django_db
+def test_relay_sends_batches_and_marks_sent_in_bulk():
+    for i in range(5):
+        OutboxEvent.objects.create(topic="margin-loan-events", key=str(i), payload={"type": "X"})
+    OutboxEvent.objects.create(topic="portfolio-events", key="9", payload={"type": "Y"})
+
+    producer = _BatchProducer(fail_topics={"portfolio-events"})
+    relay = OutboxRelay(batch_size=4, producer=producer)
+
+    assert relay.drain() == 5
+    assert producer.flushes == 2
+    assert OutboxRelay.lag()["pending"] == 1
+
+    failed = OutboxEvent.objects.get(topic="portfolio-events")
+    assert failed.sent_at is None
+    assert failed.attempts == 1
+    assert "broker down" in failed.last_error
+
+
+class _FlakyKeyProducer(_BatchProducer):
+    """
+    Fails every send for the keys in down
+    """
+
+    def __init__(self, down=()):
+        super().__init__()
+        self.down = set(down)
+
+    def send(self, topic, key=None, value=None):
+        self.sent.append((topic, key, value))
+        return _AckedFuture(RuntimeError("partition offline") if key in self.down else None)
+
+
+def _row_ids(producer):
+    return [value.id for _, _, value in producer.sent]
+
+
+@pytest.mark.django_db
+def test_failed_row_holds_back_its_key_and_retries_in_order():
+    rows = [
+        OutboxEvent.objects.create(topic="margin-loan-events", key=key, payload={"type": "X", "n": n})
+        for n, key in enumerate(["1", "2", "1", "2", "1"])
+    ]
+
+    producer = _FlakyKeyProducer(down={"1"})
+    relay = OutboxRelay(producer=producer)
+
+    assert relay.relay_batch() == 2
+    # One send per row, one flush; key "1" stops at its failed head
+    assert _row_ids(producer) == [f"outbox:{row.id}" for row in rows]
+    assert producer.flushes == 1
+    assert OutboxEvent.objects.get(id=rows[0].id).attempts == 1
+    assert OutboxEvent.objects.get(id=rows[2].id).attempts == 0
+    assert OutboxEvent.objects.filter(sent_at__isnull=True).count() == 3
+
+    producer.down.clear()
+    producer.sent.clear()
+
+    assert relay.relay_batch() == 3
+    assert _row_ids(producer) == [f"outbox:{rows[i].id}" for i in (0, 2, 4)]
+
+
+@pytest.mark.django_db
+def test_row_is_parked_after_max_attempts(settings):
+    settings.KAFKA_OUTBOX_MAX_ATTEMPTS = 2
+    head = OutboxEvent.objects.create(topic="portfolio-events", key="7", payload={"type": "X"})
+    OutboxEvent.objects.create(topic="portfolio-events", key="7", payload={"type": "Y"})
+
+    producer = _FlakyKeyProducer(down={"7"})
+    relay = OutboxRelay(producer=producer)
+
+    assert relay.relay_batch() == 0
+    assert relay.relay_batch() == 0
+
+    head.refresh_from_db()
+    assert head.parked_at is not None and head.attempts == 2
+    assert OutboxRelay.lag()["parked"] == 1
+    assert OutboxRelay.lag()["pending"] == 1
+
+    producer.down.clear()
+    assert relay.relay_batch() == 1      # the key moves on past the parked row
+    assert OutboxRelay.requeue() == 1
+    assert relay.relay_batch() == 1
+    assert OutboxRelay.lag() == {"pending": 0, "oldest_age_seconds": 0.0, "parked": 0}
+
+
+@pytest.mark.django_db
+def test_relayed_event_keeps_decimal_fields(memory_transport):
+    enqueue("portfolio-events", "3", {"type": "FORCED_SELL", "client_id": 3, "quantity": Decimal("40.0000")})
+    assert OutboxRelay().relay_batch() == 1
+
+    _, _, value = memory_transport.read(TopicPartition("portfolio-events", 0), 0, 1)[0]
+    event = decode(value).event
+    assert event["quantity"] == Decimal("40.0000")
+    assert event["client_id"] == 3
+
+
+@pytest.mark.django_db
+def test_state_events_go_through_the_outbox_only(settings, django_assert_num_queries):
+    client = Client.objects.create(name="State", email="state@example.com")
+    instrument = Instrument.objects.create(symbol="AAPL", name="Apple", exchange="NASDAQ", board="A")
+
+    # Outbox off: no broker round trip on the request path, no event
+    settings.KAFKA_OUTBOX_ENABLED = False
+    position = Portfolio.objects.create(client=client, instrument=instrument, quantity=10, avg_price=5)
+    assert OutboxEvent.objects.count() == 0
+
+    settings.KAFKA_OUTBOX_ENABLED = True
+    position.quantity = 20
+    position.save()
+    [event] = OutboxEvent.objects.all()
+    assert event.payload["type"] == "POSITION_UPDATED"
+    assert not AuditLog.objects.filter(event_type="POSITION_UPDATED").exists()
+
+    # One bulk insert for the whole block
+    with transaction.atomic(), django_assert_num_queries(1):
+        with enqueue_batch():
+            for quantity in (1, 2, 3):
+                enqueue("portfolio-events", str(client.id), {"type": "POSITION_UPDATED", "quantity": quantity})
+    assert OutboxEvent.objects.count() == 4
@@ -24,3 +24,61 @@ def test_producer_singleton():
     KafkaProducerWrapper.close()
     producer3 = KafkaProducerWrapper.get_producer()
     assert producer1 is not producer3  # new producer created
+
+
+class _PendingFuture:
+    def __init__(self):
+        self.callbacks = []
+        self.errbacks = []
+
+    def add_callback(self, fn):
+        self.callbacks.append(fn)
+        return self
+
+    def add_errback(self, fn):
+        self.errbacks.append(fn)
+        return self
+
+
+class _QueueingProducer:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, topic, key=None, value=None):
+        future = _PendingFuture()
+        self.sent.append((topic, key, value, future))
+        return future
+
+
+@pytest.mark.django_db
+def test_async_send_is_bounded_and_reports_delivery(settings, monkeypatch):
+    settings.KAFKA_PUBLISH_MODE = "async"
+    settings.KAFKA_MAX_IN_FLIGHT = 1
+    settings.KAFKA_IN_FLIGHT_TIMEOUT = 0
+
+    producer = _QueueingProducer()
+    monkeypatch.setattr(KafkaProducerWrapper, "_producer", producer)
+    monkeypatch.setattr(KafkaProducerWrapper, "_in_flight", None)
+
+    delivered = []
+    assert KafkaProducerWrapper.send_event(
+        "margin-loan-events", key="1", event={"type": "MARGIN_REQUEST"},
+        on_delivery=delivered.append,
+    ) is True
+
+    # One record unacknowledged → the in-flight queue is full
+    errors = []
+    assert KafkaProducerWrapper.send_event(
+        "margin-loan-events", key="1", event={"type": "MARGIN_REQUEST"},
+        on_error=errors.append,
+    ) is False
+    assert isinstance(errors[0], BufferError)
+
+    # Broker ack frees the slot
+    metadata = type("Metadata", (), {"partition": 0, "offset": 7})()
+    producer.sent[0][3].callbacks[0](metadata)
+    assert delivered == [metadata]
+
+    assert KafkaProducerWrapper.send_event(
+        "margin-loan-events", key="1", event={"type": "MARGIN_REQUEST"},
+    ) is True
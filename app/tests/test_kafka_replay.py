@@ -0,0 +1,157 @@
+from decimal import Decimal
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from core.models import Client, Instrument, MarginLoan, Portfolio
+from core.producers import KafkaProducerWrapper
+from core.replay import read_file, read_topics, replay
+from risk.models import ClientRiskProfile
+
+
+pytestmark = [pytest.mark.usefixtures("memory_transport"), pytest.mark.memory_partitions(2)]
+
+
+@pytest.fixture
+def book(db):
+    client = Client.objects.create(name="Replay", email="replay@example.com")
+    ClientRiskProfile.objects.get_or_create(client=client)
+    aapl = Instrument.objects.create(symbol="AAPL", name="Apple", exchange="NASDAQ", board="A")
+    msft = Instrument.objects.create(symbol="MSFT", name="Microsoft", exchange="NASDAQ", board="A")
+    held = Portfolio.objects.create(client=client, instrument=aapl, quantity=100, avg_price=10)
+    return client, aapl, msft, held
+
+
+def _publish(topic, *events):
+    producer = KafkaProducerWrapper.get_producer()
+    for event in events:
+        producer.send(topic, key=str(event.get("client_id")), value=event)
+
+
+def _events_after_restore(client, msft, held):
+    _publish(
+        "margin-loan-events",
+        {"type": "LOAN_CREATED", "loan_id": 900, "client_id": client.id, "amount": "5000.00",
+         "interest_rate": "0.10", "created_at": "2026-01-02T03:04:05+00:00"},
+        {"type": "MARGIN_REQUEST", "loan_id": 900, "client_id": client.id, "amount": 6000.0},
+        {"type": "LOAN_CREATED", "loan_id": 901, "client_id": 999_999, "amount": "1.00"},
+        {"type": "MARGIN_POLICY_CHANGED", "client_id": client.id, "allow_margin": False,
+         "reason": "MARGIN_CALL_TRIGGERED"},
+        {"type": "TEST_CREATION"},
+    )
+    _publish(
+        "portfolio-events",
+        {"type": "POSITION_UPDATED", "portfolio_id": 700, "client_id": client.id,
+         "instrument_id": msft.id, "quantity": "10", "avg_price": "50"},
+        {"type": "FORCED_SELL", "client_id": client.id, "portfolio_id": held.id,
+         "reason": "loan exceeds eligibility", "quantity": "40.0000"},
+    )
+
+
+def test_replay_rebuilds_loans_positions_and_flags(book):
+    client, _, msft, held = book
+    _events_after_restore(client, msft, held)
+
+    out = StringIO()
+    call_command("replay_events", stdout=out)
+
+    loan = MarginLoan.objects.get(id=900)
+    assert loan.loan_amount == Decimal("6000.00")          # last write wins
+    assert loan.interest_rate == Decimal("0.10")
+    assert loan.created_at.isoformat() == "2026-01-02T03:04:05+00:00"
+    assert not MarginLoan.objects.filter(id=901).exists()  # unknown client
+
+    held.refresh_from_db()
+    assert held.quantity == Decimal("40")
+    assert held.avg_price == Decimal("10")                 # seeded from the restored row
+    assert Portfolio.objects.get(id=700).quantity == Decimal("10")
+    assert not ClientRiskProfile.objects.get(client=client).allow_margin
+
+    assert "7 event(s)" in out.getvalue()
+    assert "events/s" in out.getvalue()
+
+    # Absolute folds: a second pass changes nothing
+    call_command("replay_events", stdout=StringIO())
+    assert MarginLoan.objects.get(id=900).loan_amount == Decimal("6000.00")
+    assert Portfolio.objects.filter(client=client).count() == 2
+
+
+def test_exported_log_replays_from_a_timestamp(book, tmp_path):
+    client, _, msft, held = book
+    _events_after_restore(client, msft, held)
+    path = tmp_path / "events.jsonl"
+
+    call_command("replay_events", export=str(path), stdout=StringIO())
+
+    assert replay(read_file(str(path)), dry_run=True)["events"] == 7
+    result = replay(read_file(str(path), from_timestamp=2**62), dry_run=True)
+    assert result["events"] == 0
+
+    result = replay(read_topics(["portfolio-events"], from_offset=0), dry_run=True)
+    assert result["counts"] == {"POSITION_UPDATED": 1, "FORCED_SELL": 1}
+    assert not MarginLoan.objects.filter(id=900).exists()
+
+
+def test_replay_rebuilds_what_the_producers_published(book, settings):
+    from core.outbox import OutboxRelay
+    from core.services.portfolio_service import apply_trade
+    from core.signals import replaying
+    from risk.services.liquidation import LiquidationOrder, LiquidationPlan, LiquidationPlanner
+    from risk.services.risk_engine import RiskEngine
+
+    settings.KAFKA_OUTBOX_ENABLED = True
+    client, aapl, msft, held = book
+
+    # Positions: model saves / deletes and the liquidation bulk_update
+    bought = apply_trade(client, msft, Decimal("20"), Decimal("50"))
+    apply_trade(client, msft, Decimal("10"), Decimal("80"))
+    LiquidationPlanner.execute(LiquidationPlan(
+        client_id=client.id,
+        max_exposure=Decimal("1"), used_before=Decimal("0"), used_after=Decimal("0"),
+        utilization_before=Decimal("0"), utilization_after=Decimal("0"),
+        orders=(LiquidationOrder(
+            portfolio_id=held.id, instrument_id=aapl.id, symbol="AAPL", margin_rate=Decimal("0.5"),
+            avg_price=Decimal("10"), quantity_before=Decimal("100"),
+            quantity_sold=Decimal("25"), quantity_after=Decimal("75"),
+        ),),
+    ))
+    ibm = Instrument.objects.create(symbol="IBM", name="IBM", exchange="NYSE", board="A")
+    apply_trade(client, ibm, Decimal("5"), Decimal("100"))
+    apply_trade(client, ibm, Decimal("-5"), Decimal("110"))
+
+    # Loans: created, resized, closed
+    kept = MarginLoan.objects.create(client=client, loan_amount=Decimal("1000.00"))
+    kept.loan_amount = Decimal("1500.00")
+    kept.save(update_fields=["loan_amount", "updated_at"])
+    closed = MarginLoan.objects.create(client=client, loan_amount=Decimal("10.00"))
+    closed.delete()
+
+    # Margin policy: switched off by a margin call, then back on
+    RiskEngine._set_allow_margin(client.id, False, "MARGIN_CALL_TRIGGERED", {})
+    RiskEngine._set_allow_margin(client.id, True, "MARGIN_RE_ENABLED", {})
+
+    OutboxRelay().drain()
+
+    expected_positions = set(Portfolio.objects.values_list("id", "instrument_id", "quantity", "avg_price"))
+    expected_loans = set(MarginLoan.objects.values_list("id", "loan_amount", "interest_rate", "created_at"))
+    assert (bought.id, msft.id, Decimal("30"), Decimal("60")) in expected_positions
+    assert (held.id, aapl.id, Decimal("75"), Decimal("10")) in expected_positions
+
+    # Restore point: the book fixture (published before the outbox was on)
+    with replaying():
+        Portfolio.objects.exclude(id=held.id).delete()
+        Portfolio.objects.filter(id=held.id).update(quantity=100)
+        MarginLoan.objects.all().delete()
+        ClientRiskProfile.objects.filter(client=client).update(allow_margin=False)
+
+    result = replay(read_topics())
+
+    assert set(Portfolio.objects.values_list("id", "instrument_id", "quantity", "avg_price")) == expected_positions
+    assert set(MarginLoan.objects.values_list("id", "loan_amount", "interest_rate", "created_at")) == expected_loans
+    assert not MarginLoan.objects.filter(id=closed.id).exists()
+    assert ClientRiskProfile.objects.get(client=client).allow_margin
+    assert result["counts"]["MARGIN_POLICY_CHANGED"] == 2
+    assert result["counts"]["POSITION_CLOSED"] == 1
+    assert result["counts"]["LOAN_CLOSED"] == 1
+    assert "skipped" not in result["counts"]
@@ -0,0 +1,252 @@
+import asyncio
+
+import pytest
+from django.core.management import call_command
+from kafka.structs import TopicPartition
+
+from core.async_consumers import TopicRunner
+from core.consumer_pool import PooledConsumer
+from core.consumers import create_kafka_consumer, process_batch, save_audit_logs
+from core.models import AuditLog
+from core.producers import KafkaProducerWrapper
+from core.retry import RetryScheduler, dlq_topic
+
+TOPIC = "margin-loan-events"
+TP = TopicPartition(TOPIC, 0)
+
+
+pytestmark = pytest.mark.usefixtures("memory_transport")
+
+
+def _publish(*client_ids):
+    for client_id in client_ids:
+        KafkaProducerWrapper.get_producer().send(
+            TOPIC, key=str(client_id), value={"type": "MARGIN_REQUEST", "client_id": client_id}
+        )
+
+
+def _poll(consumer):
+    return [m for messages in consumer.poll(timeout_ms=100).values() for m in messages]
+
+
+@pytest.mark.django_db
+def test_failed_message_is_retried_without_blocking_the_partition():
+    _publish(1, 2, 3)
+    failures = {2: 2}
+    handled = []
+
+    def handler(event):
+        if failures.get(event["client_id"], 0):
+            failures[event["client_id"]] -= 1
+            raise RuntimeError("lock timeout")
+        handled.append(event["client_id"])
+
+    consumer = create_kafka_consumer(TOPIC, "g", enable_auto_commit=False)
+    retry = RetryScheduler(TOPIC, handler, base_delay=0)
+
+    for message in _poll(consumer):
+        retry.attempt(message)
+
+    # 3 went through while 2 waits; the commit stays below 2
+    assert handled == [1, 3]
+    retry.commit(consumer)
+    assert consumer.committed(TP) == 1
+
+    retry.run_due()
+    retry.run_due()
+    assert handled == [1, 3, 2]
+    retry.commit(consumer)
+    assert consumer.committed(TP) == 3
+
+
+@pytest.mark.django_db
+def test_poison_pill_goes_to_dlq_and_replays():
+    _publish(1, 2)
+    AuditLog.objects.all().delete()
+
+    def handler(events):
+        if any(e["client_id"] == 2 for e in events):
+            raise ValueError("bad payload")
+        save_audit_logs(events)
+
+    consumer = create_kafka_consumer(TOPIC, "g", enable_auto_commit=False)
+    retry = RetryScheduler(TOPIC, lambda e: handler([e]), max_attempts=2, base_delay=0)
+
+    process_batch(consumer, handler, retry=retry)
+    assert AuditLog.objects.count() == 1          # the good event survived the batch failure
+
+    retry.run_due()                               # 2nd attempt fails → DLQ
+    assert len(retry) == 0
+    retry.commit(consumer)
+    assert consumer.committed(TP) == 2
+
+    dlq = create_kafka_consumer(dlq_topic(TOPIC), "inspect", enable_auto_commit=False)
+    [dead] = _poll(dlq)
+    assert dead.value["client_id"] == 2
+    assert dead.value["dead_letter"]["attempts"] == 2
+    assert dead.value["dead_letter"]["error_type"] == "ValueError"
+
+    call_command("replay_dlq", topic=TOPIC)
+
+    [replayed] = _poll(consumer)
+    assert replayed.value["event_id"] == dead.value["event_id"]
+    assert "dead_letter" not in replayed.value
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pooled_consumer_retries_and_dead_letters_instead_of_committing_past():
+    _publish(1, 2, 3, 4)
+    failures = {2: 1, 4: 99}
+    handled = []
+
+    def handler(event):
+        if failures.get(event["client_id"], 0):
+            failures[event["client_id"]] -= 1
+            raise RuntimeError("lock timeout")
+        handled.append(event["client_id"])
+
+    consumer = create_kafka_consumer(TOPIC, "pool", enable_auto_commit=False)
+    runner = PooledConsumer(
+        TOPIC,
+        "pool",
+        handler,
+        workers=2,
+        consumer=consumer,
+        retry=RetryScheduler(TOPIC, handler, max_attempts=2, base_delay=0),
+    )
+    runner.pool.start()
+    try:
+        runner.poll_once()
+        runner.pool.join()
+        runner.commit()
+
+        # 2 and 4 failed: the watermark stops below 2
+        assert sorted(handled) == [1, 3]
+        assert consumer.committed(TP) == 1
+
+        # Retries run on the key's worker; 4 fails again and is dead-lettered
+        assert runner.submit_due_retries() == 2
+        runner.pool.join()
+        runner.commit()
+    finally:
+        runner.pool.stop()
+
+    assert sorted(handled) == [1, 2, 3]
+    assert consumer.committed(TP) == 4
+
+    dlq = create_kafka_consumer(dlq_topic(TOPIC), "inspect", enable_auto_commit=False)
+    [dead] = _poll(dlq)
+    assert dead.value["client_id"] == 4
+
+
+@pytest.mark.django_db(transaction=True)
+def test_async_runner_retries_sync_handlers_and_holds_the_commit():
+    _publish(1, 2, 3)
+    failures = {2: 1}
+    handled = []
+
+    def handler(event):
+        if failures.get(event["client_id"], 0):
+            failures[event["client_id"]] -= 1
+            raise RuntimeError("lock timeout")
+        handled.append(event["client_id"])
+
+    consumer = create_kafka_consumer(TOPIC, "async", enable_auto_commit=False)
+    runner = TopicRunner(
+        TOPIC,
+        "async",
+        handler,
+        retry=RetryScheduler(TOPIC, handler, base_delay=0),
+    )
+    runner.consumer = consumer
+
+    async def drive():
+        await runner.handle_batch(consumer.poll(timeout_ms=100))
+        await runner._commit()
+        assert sorted(handled) == [1, 3]
+        assert consumer.committed(TP) == 1
+
+        await runner.handle_batch({}, runner.retry.due())
+        await runner._commit()
+
+    asyncio.run(drive())
+    runner.executor.shutdown(wait=True)
+
+    assert sorted(handled) == [1, 2, 3]
+    assert consumer.committed(TP) == 3
+
+
+def _publish_seq(key, *seqs):
+    for seq in seqs:
+        KafkaProducerWrapper.get_producer().send(
+            TOPIC, key=key, value={"type": "MARGIN_REQUEST", "client_id": int(key), "seq": seq}
+        )
+
+
+@pytest.mark.django_db
+def test_later_messages_wait_behind_their_keys_retry():
+    _publish_seq("7", 1, 2, 3)
+    _publish_seq("8", 1)
+    failures = {1: 1}
+    handled = []
+
+    def handler(event):
+        if event["client_id"] == 7 and failures.get(event["seq"], 0):
+            failures[event["seq"]] -= 1
+            raise RuntimeError("lock timeout")
+        handled.append((event["client_id"], event["seq"]))
+
+    consumer = create_kafka_consumer(TOPIC, "g", enable_auto_commit=False)
+    retry = RetryScheduler(TOPIC, handler, base_delay=0)
+
+    for message in _poll(consumer):
+        retry.attempt(message)
+
+    # 7's later events are parked behind its retry; 8 is not held up
+    assert handled == [(8, 1)]
+    retry.commit(consumer)
+    assert consumer.committed(TP) == 0
+
+    while retry.run_due():
+        pass
+    assert handled == [(8, 1), (7, 1), (7, 2), (7, 3)]
+    assert len(retry) == 0
+    retry.commit(consumer)
+    assert consumer.committed(TP) == 4
+
+
+@pytest.mark.django_db
+def test_failed_dlq_publish_retries_only_the_send():
+    _publish_seq("7", 1, 2)
+    calls = []
+
+    def handler(event):
+        calls.append(event["seq"])
+        if event["seq"] == 1:
+            raise ValueError("bad payload")
+
+    class FlakyProducer:
+        failures = 1
+
+        def send(self, topic, **kwargs):
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("broker down")
+            return KafkaProducerWrapper.get_producer().send(topic, **kwargs)
+
+    consumer = create_kafka_consumer(TOPIC, "g", enable_auto_commit=False)
+    retry = RetryScheduler(TOPIC, handler, max_attempts=1, max_delay=0, producer=FlakyProducer())
+
+    for message in _poll(consumer):
+        retry.attempt(message)
+    assert calls == [1]                 # DLQ send failed; 2 waits behind it
+
+    while retry.run_due():
+        pass
+    assert calls == [1, 2]              # the handler did not run again for 1
+    retry.commit(consumer)
+    assert consumer.committed(TP) == 2
+
+    dlq = create_kafka_consumer(dlq_topic(TOPIC), "inspect", enable_auto_commit=False)
+    [dead] = _poll(dlq)
+    assert dead.value["seq"] == 1
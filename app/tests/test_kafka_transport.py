@@ -0,0 +1,76 @@
+import pytest
+from kafka.structs import TopicPartition
+
+from core.kafka_transport import InMemoryConsumer, InMemoryProducer
+from core.producers import publish_margin_request
+
+TOPIC = "margin-loan-events"
+
+
+pytestmark = [pytest.mark.usefixtures("memory_transport"), pytest.mark.memory_partitions(4)]
+
+
+def _values(batch):
+    return [record.value for records in batch.values() for record in records]
+
+
+def test_same_key_lands_on_one_partition_with_increasing_offsets():
+    producer = InMemoryProducer()
+
+    metadata = [producer.send(TOPIC, key=b"42", value=str(i).encode()).get() for i in range(5)]
+
+    assert len({m.partition for m in metadata}) == 1
+    assert [m.offset for m in metadata] == [0, 1, 2, 3, 4]
+
+
+def test_group_resumes_from_committed_offset():
+    producer = InMemoryProducer()
+    partition = [producer.send(TOPIC, key=b"1", value=i) for i in range(6)][0].get().partition
+
+    consumer = InMemoryConsumer(TOPIC, group_id="g", auto_offset_reset="earliest", enable_auto_commit=False)
+    assert _values(consumer.poll(max_records=4)) == [0, 1, 2, 3]
+    consumer.commit()
+    # Read but not committed
+    assert _values(consumer.poll()) == [4, 5]
+    consumer.close()
+
+    consumer = InMemoryConsumer(TOPIC, group_id="g", auto_offset_reset="earliest", enable_auto_commit=False)
+    assert _values(consumer.poll()) == [4, 5]
+
+    # Seek rewinds the partition for redelivery
+    consumer.seek(TopicPartition(TOPIC, partition), 0)
+    assert _values(consumer.poll()) == [0, 1, 2, 3, 4, 5]
+    consumer.close()
+
+
+def test_group_members_split_partitions_and_rebalance_on_leave():
+    a = InMemoryConsumer(TOPIC, group_id="g", auto_offset_reset="earliest")
+    b = InMemoryConsumer(TOPIC, group_id="g", auto_offset_reset="earliest")
+
+    assert len(a.assignment()) == 2
+    assert a.assignment().isdisjoint(b.assignment())
+
+    b.close()
+    assert len(a.assignment()) == 4
+    a.close()
+
+
+def test_latest_reset_skips_existing_records():
+    InMemoryProducer().send(TOPIC, key=b"1", value=b"old")
+    consumer = InMemoryConsumer(TOPIC, group_id="late")
+    consumer.assignment()
+
+    InMemoryProducer().send(TOPIC, key=b"1", value=b"new")
+    assert _values(consumer.poll()) == [b"new"]
+
+
+@pytest.mark.django_db
+def test_wrapper_publishes_to_in_memory_consumer():
+    from core.consumers import create_kafka_consumer
+
+    assert publish_margin_request(client_id=1, amount=5000.0) is True
+
+    consumer = create_kafka_consumer(TOPIC, "margin-group", enable_auto_commit=False)
+    events = _values(consumer.poll(timeout_ms=100))
+
+    assert [(e["type"], e["client_id"]) for e in events] == [("MARGIN_REQUEST", 1)]